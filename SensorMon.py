@@ -14,6 +14,10 @@
 # See the GNU Lesser General Public License Version 3 for more details.
 #
 
+# Seconds since start, for /ready
+from time import monotonic
+startedAt = monotonic()
+
 # Commandline Arguments
 from argparse import ArgumentParser
 parser = ArgumentParser(description='Sensor Monitor')
@@ -24,6 +28,63 @@ parser.add_argument('-boardname', help='A sensor board name.')
 # Sets boardlist to true when supplied
 parser.add_argument('-boardlist', '-bl', help='Prints the list of supported boards.', action='store_true')
 
+# Sets how often the sensors are read, in seconds
+parser.add_argument('-period', help='The default sensor update period in seconds (default 1).', type=float, default=1.0)
+
+# Sets per sensor update periods, overriding the default period
+parser.add_argument('-cadence', help='Per sensor update periods in seconds, e.g. ltr390=2,bme280=0.5 (the SGP40 expects 1).', default="")
+
+# Sets how the BME280 measures
+parser.add_argument('-bme280mode', help='BME280 forced mode (default, a measurement each read) or normal mode (measuring continuously, read without waiting).', choices=['forced', 'normal'], default=None)
+
+# Sets how each value is smoothed
+parser.add_argument('-filter', help='Per value filters, mean, ema, median or hampel with an optional window, chained with +, e.g. nh3=median:61,voci=hampel:31+ema:20.', default="")
+
+# REST server options
+parser.add_argument('-server', help='The REST server to use, production (default) or dev (the Flask development server).', choices=['production', 'dev'], default='production')
+parser.add_argument('-host', help='The address to listen on (default 0.0.0.0).', default='0.0.0.0')
+parser.add_argument('-port', help='The port to listen on (default 8080).', type=int, default=8080)
+parser.add_argument('-workers', help='Production server worker threads (default 4).', type=int, default=4)
+parser.add_argument('-queue', help='Production server connections allowed to wait for a worker (default 32).', type=int, default=32)
+
+# History options
+parser.add_argument('-history', help='Seconds of values kept in memory for /history (default 86400, one day).', type=float, default=86400.0)
+
+# Persistent store options
+parser.add_argument('-store', help='A directory to persist the values to, off when not set.', default=None)
+parser.add_argument('-commit', help='Seconds between writes to the store (default 60).', type=float, default=60.0)
+parser.add_argument('-retention', help='Days of values kept in the store (default 365).', type=float, default=365.0)
+
+# Push stream options
+parser.add_argument('-streams', help='Maximum /stream clients (default 8), each uses a server worker.', type=int, default=8)
+parser.add_argument('-streamqueue', help='Events queued per /stream client before it is dropped as too slow (default 4).', type=int, default=4)
+
+# Exporter options
+parser.add_argument('-export', help='Push the values to kind=target, influx=http://host:8086/api/v2/write?org=o&bucket=b, mqtt=host:1883/topic or file=/path/values.jsonl. Can be given more than once.', action='append', default=[])
+parser.add_argument('-exportbatch', help='Values sent per batch (default 10).', type=int, default=10)
+parser.add_argument('-exportinterval', help='Longest seconds a value waits to be sent (default 10).', type=float, default=10.0)
+parser.add_argument('-spool', help='Directory values are queued in while an exporter can not send (default spool, or spool in the -store directory).', default=None)
+parser.add_argument('-spoolsize', help='Megabytes queued per exporter before the oldest are dropped (default 64).', type=float, default=64.0)
+
+# Response cache options
+parser.add_argument('-cache', help='Megabytes of /history responses kept to answer repeats (default 8).', type=float, default=8.0)
+
+# Fleet collector options
+parser.add_argument('-collector', help='Runs as a fleet collector instead of reading a board, polling the /values of these nodes, e.g. http://pi1:8080,http://pi2:8080 or @nodes.txt (one per line).', default=None)
+parser.add_argument('-pollperiod', help='Seconds between polls of each node (default 5).', type=float, default=5.0)
+parser.add_argument('-polltimeout', help='Seconds before a poll of a node is given up on (default 2).', type=float, default=2.0)
+
+# Instrumentation
+parser.add_argument('-timings', help='Records per sensor latency histograms, served on /debug/timings.', action='store_true')
+
+# The PI's health
+parser.add_argument('-hosttelemetry', help='Publishes the PI\'s temperatures, CPU clocks, throttling flags, load and memory as extra host_ values.', action='store_true')
+
+# Hardware traces
+parser.add_argument('-record', help='Records every call made on the board hardware to this trace file.', default=None)
+parser.add_argument('-replay', help='Replays the board hardware from this trace file, no hardware needed.', default=None)
+parser.add_argument('-replayspeed', help='Replayed calls take this multiple of their recorded time, or max for no time (default 1).', default='1')
+
 # Read the args
 args = parser.parse_args()
 
@@ -35,6 +96,61 @@ if boardList:
 	print("_______________________________________________________________")
 	print("EnviroPlus\t\tPimoroni EnviroPlus")
 	print("WaveshareESH\t\tWaveshare Enviroment Sensor HAT")
+	print("Simulated\t\tSimulated sensors, for testing without hardware")
+	exit()
+
+def serve(app, workers, onShutdown=None):
+	""" Serves the REST app until we are stopped """
+
+	if args.server == "dev":
+		app.run(host=args.host, port=args.port, threaded=True)
+		return
+
+	from utility.wsgiserver import WSGIServer
+
+	server = WSGIServer(app, args.host, args.port, workers=workers, queueSize=args.queue)
+
+	# Docker stops us with SIGTERM, finish the in flight requests before exiting
+	import signal
+	def stopServing(signum, frame):
+		print("Shutting down")
+		server.shutdown()
+		if onShutdown is not None:
+			onShutdown()
+	signal.signal(signal.SIGTERM, stopServing)
+	signal.signal(signal.SIGINT, stopServing)
+
+	server.serveForever()
+
+# Fleet collector mode, serves the merged values of other nodes rather than reading a board
+if args.collector:
+	from flask import Flask, Response
+	from utility.fleet import FleetCollector
+
+	if args.collector.startswith("@"):
+		with open(args.collector[1:]) as f:
+			urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+	else:
+		urls = [url.strip() for url in args.collector.split(",") if url.strip()]
+
+	collector = FleetCollector(urls, period=args.pollperiod, timeout=args.polltimeout)
+	print("Collecting from " + str(len(urls)) + " nodes every " + str(args.pollperiod) + "s")
+
+	app = Flask(__name__)
+
+	@app.route('/', methods=['GET'])
+	def home():
+		# A simple redirect to the fleet values page
+		return '''<meta http-equiv=\"refresh\" content=\"time=0; URL=/fleet/values" \/>'''
+
+	# The last values of every node, with how old they are and whether the last poll worked
+	@app.route('/fleet/values', methods=['GET'])
+	def api_fleet():
+		return Response(response=collector.getValues(), status=200, mimetype="application/json")
+
+	collector.start()
+	serve(app, args.workers)
+	collector.stop()
 	exit()
 
 # Load the choosen board or exit
@@ -46,6 +162,17 @@ else:
 	parser.print_help()
 	exit()
 
+# Hardware traces, set up before the board module opens the hardware
+from utility import trace
+
+if args.record is not None:
+	trace.record(args.record)
+	print("Recording the hardware to " + args.record)
+
+if args.replay is not None:
+	trace.replay(args.replay, trace.parseSpeed(args.replayspeed))
+	print("Replaying the hardware from " + args.replay)
+
 # The board module importer
 import importlib
 BoardClass = getattr(importlib.import_module("boards." + boardName.lower()), boardName)
@@ -53,42 +180,301 @@ BoardClass = getattr(importlib.import_module("boards." + boardName.lower()), boa
 # Instantiate the selected board
 board = BoardClass()
 
+# Per value filters, checked before the sensors start
+from utility.filters import createFilter, parseFilters
+
+for channel, spec in parseFilters(args.filter).items():
+	if channel not in board.filters:
+		print("Unknown value " + channel + " for -filter, one of " + ", ".join(board.filters))
+		exit(1)
+	try:
+		createFilter(spec, 1)
+	except ValueError as e:
+		print("Bad -filter for " + channel + " - " + str(e))
+		exit(1)
+	board.filters[channel] = spec
+
+# The BME280 acquisition mode, also set before the sensors start
+if args.bme280mode is not None:
+	if not hasattr(board, "bme280_mode"):
+		print("Board " + boardName + " has no BME280 for -bme280mode")
+		exit(1)
+	board.bme280_mode = args.bme280mode
+
+# The PI's own health as extra values, published again so the first snapshot has them for the history and store
+host = None
+if args.hosttelemetry:
+	from utility.hosttelemetry import HostTelemetry
+
+	host = HostTelemetry()
+	host.update(board.currentValues)
+	board.publisher.publish(board.currentValues)
+	print("Host telemetry " + ", ".join(host.channels))
+
+# Start its sensors
+# They start on their own threads, while the rest of SensorMon (numpy, flask, the history) loads
+board.begin()
+
+# Hot path latency histograms, off unless asked for
+if args.timings:
+	board.timings.enable()
+
 # Threading
 import threading
 
 updateLock = threading.Lock()
-updateThread = threading.Thread()
-running = False
 
-# Sleep
-from time import sleep
+# Acquisition
+from utility.scheduler import AcquisitionScheduler
+from utility.timings import TIMING_BUCKETS
+
+scheduler = None
+
+# The longest a /values long poll may wait, in seconds
+LONG_POLL_MAX_WAIT = 30.0
+
+def parseCadences(text):
+	""" Parses name=seconds pairs into a dictionary """
+
+	cadences = {}
+
+	for pair in text.split(","):
+		if pair.strip() == "":
+			continue
+		name, period = pair.split("=")
+		cadences[name.strip().lower()] = float(period)
+
+	return cadences
+
+# Per task update periods
+cadences = parseCadences(args.cadence)
+
+# How often the board publishes new values, in seconds
+publishPeriod = cadences.get("publish", args.period)
 
 ## Rest API
+import json
+import math
+import os
+from time import time
+
 import flask
 from flask import Flask,request, jsonify, Response
 
+# History of the published values
+import numpy
+from utility.history import HistoryRing, toList
+from utility.export import EXPORT_BLOCK_ROWS, exportCSV, exportColumns, columnsLayout
+from utility.encoding import FORMATS, JSON_TYPE, CBOR_TYPE, MSGPACK_TYPE, COLUMNS_TYPE, encodeCBOR, encodeMsgPack, parsePrecision, quantize, packColumns
+
+history = HistoryRing(max(1, int(args.history / publishPeriod)))
+board.publisher.addListener(history.append)
+
+# Per minute and per hour min/max/mean of the published values
+from utility.rollup import Rollups
+
+rollups = Rollups()
+
+# Persist the published values, written in groups to spare the SD card
+store = None
+if args.store:
+	from utility.tsstore import TimeSeriesStore
+
+	store = TimeSeriesStore(args.store, commitInterval=args.commit, retention=args.retention * 86400.0)
+
+	# Pick up the history where we left off, if it is from the same board
+	storedChannels, storedTimes, storedData = store.tail(history.capacity)
+	boardChannels = [name for name, value in board.getSnapshot().values.items() if isinstance(value, (int, float))]
+	if storedChannels == boardChannels:
+		history.load(storedChannels, storedTimes, storedData)
+		print("Loaded " + str(len(storedTimes)) + " values from the store")
+
+		# Rebuild the rollups from the store too, so they reach back as far as it does, a segment at a time
+		if len(storedTimes):
+			began = time()
+			newest = storedTimes[-1]
+			for channels, times, data in store.blocks(newest - rollups.span()):
+				if channels == storedChannels:
+					rollups.load(channels, times, data, newest)
+			print("Rebuilt the rollups from the store in " + "%.2f" % (time() - began) + "s")
+
+	board.publisher.addListener(store.append)
+	store.start()
+
+board.publisher.addListener(rollups.append)
+
+def queryRaw(channels, start, end, step):
+	""" Raw values from the memory history, and from the store for anything older """
+
+	oldest = history.oldestTime()
+	if store is None or (oldest is not None and start >= oldest):
+		return history.query(channels, start, end, step)
+
+	split = end if oldest is None else min(end, oldest)
+	times, columns = store.query(channels, start, split, step)
+	if split >= end:
+		return times, columns
+
+	recentTimes, recentColumns = history.query(channels, split, end, step)
+
+	return numpy.concatenate((times, recentTimes)), {name: numpy.concatenate((columns[name], recentColumns[name])) for name in channels}
+
+# Push stream of new values
+from utility.stream import StreamHub
+
+streamHub = StreamHub(maxClients=args.streams, queueSize=args.streamqueue)
+board.publisher.addListener(streamHub.publish)
+
+# Push the values to other systems
+exporters = []
+if args.export:
+	from utility.exporters import createExporters
+
+	spoolPath = args.spool or (os.path.join(args.store, "spool") if args.store else "spool")
+	exporters = createExporters(args.export, boardName, spoolPath, batchSize=args.exportbatch, interval=args.exportinterval, spoolBytes=int(args.spoolsize * 1024 * 1024))
+
+	for exporter in exporters:
+		print("Exporting to " + exporter.name + ", " + str(exporter.spool.count()) + " values spooled")
+		board.publisher.addListener(exporter.append)
+		exporter.start()
+
+# Prometheus metrics, rendered each publish rather than each scrape, empty until the first
+from utility.metrics import MetricsExporter, METRICS_CONTENT_TYPE
+
+channels = dict(board.getChannels())
+if host is not None:
+	channels.update(host.channels)
+
+metrics = MetricsExporter(boardName, channels)
+board.publisher.addListener(metrics.publish)
+
+# Encoded and compressed /history responses, for repeats of popular queries
+from utility.responsecache import ResponseCache, CachedResponse, chooseEncoding, compressStream, historyCacheKey
+
+responseCache = ResponseCache(maxBytes=int(args.cache * 1024 * 1024))
+
+def chooseFormat(offered):
+	""" The mime type to answer with, from ?format= or the Accept header, None if we can not give what was asked for """
+
+	name = request.args.get("format")
+	if name is not None:
+		mimetype = FORMATS.get(name)
+		return mimetype if mimetype in offered else None
+
+	if not request.accept_mimetypes:
+		return JSON_TYPE
+
+	return request.accept_mimetypes.best_match(offered)
+
+def notAcceptable(offered):
+	return Response(response=json.dumps({"error": "Can only answer with " + ", ".join(offered)}), status=406, mimetype="application/json")
+
+def notPublished():
+	""" 503 until the sensors have been read and the values published once, as /ready """
+
+	return Response(response=json.dumps({"error": "The sensors are starting, no values have been published yet"}), status=503, mimetype="application/json", headers={"Retry-After": str(max(1, int(math.ceil(publishPeriod))))})
+
+def encodeHistory(mimetype, channels, start, end, step, tier, precision):
+	""" Queries and encodes a /history response """
+
+	if tier is None:
+		times, columns = queryRaw(channels, start, end, step)
+		stats = None
+	else:
+		# Bucket start times, the mean as the values and the min, max and count of each bucket
+		times, buckets = tier.query(channels, start, end, step)
+		columns = {name: bucket[2] for name, bucket in buckets.items()}
+		stats = {
+			"min": quantize({name: bucket[0] for name, bucket in buckets.items()}, precision),
+			"max": quantize({name: bucket[1] for name, bucket in buckets.items()}, precision),
+			"count": {name: bucket[3] for name, bucket in buckets.items()},
+		}
+
+	columns = quantize(columns, precision)
+	tierName = "raw" if tier is None else tier.name
+
+	if mimetype == COLUMNS_TYPE:
+		# Little endian arrays, float64 times then float32 values, described in the headers
+		packed = [("times", times, "<f8")] + [(name, columns[name], "<f4") for name in channels]
+		if stats is not None:
+			packed = packed + [(name + ".min", stats["min"][name], "<f4") for name in channels]
+			packed = packed + [(name + ".max", stats["max"][name], "<f4") for name in channels]
+			packed = packed + [(name + ".count", stats["count"][name], "<u4") for name in channels]
+
+		layout, body = packColumns(packed)
+
+		return CachedResponse(body, COLUMNS_TYPE, {"X-Columns": layout, "X-Rows": str(len(times)), "X-Tier": tierName})
+
+	result = {
+		"from": start,
+		"to": end,
+		"step": step,
+		"tier": tierName,
+		"channels": channels,
+	}
+
+	# Columns of values, one list per channel
+	result["times"] = toList(times)
+	result["values"] = {name: toList(column) for name, column in columns.items()}
+	if stats is not None:
+		result["min"] = {name: toList(column) for name, column in stats["min"].items()}
+		result["max"] = {name: toList(column) for name, column in stats["max"].items()}
+		result["count"] = {name: column.tolist() for name, column in stats["count"].items()}
+
+	if mimetype == CBOR_TYPE:
+		body = encodeCBOR(result)
+	elif mimetype == MSGPACK_TYPE:
+		body = encodeMsgPack(result)
+	else:
+		body = json.dumps(result).encode("utf-8")
+
+	return CachedResponse(body, mimetype, {})
+
+def sendCached(key, cached):
+	""" A response from the cache, compressed if the client accepts it """
+
+	body, encoding = responseCache.getBody(key, cached, chooseEncoding(request.accept_encodings))
+
+	response = Response(response=body, status=200, mimetype=cached.mimetype, headers=cached.headers)
+	if encoding is not None:
+		response.headers["Content-Encoding"] = encoding
+	response.vary.add("Accept")
+	response.vary.add("Accept-Encoding")
+
+	return response
+
 def createRestApp():
 	app = Flask(__name__)
 
-	def update():
-		global running
-		global updateLock
-		while running:
-			with updateLock:
-				board.updateValues()
-			# Sleep outside the lock!
-			sleep(1)
-
 	def beginUpdating():
-		global running
-		global updateThread
+		global scheduler
+
+		# Each sensor runs on its own cadence, the lock is only held while a sensor is being read
+		# or the values are being published, readers use the published snapshot instead
+		scheduler = AcquisitionScheduler(lock=updateLock, timings=board.timings)
+
+		tasks = board.getTasks()
+		if host is not None:
+			tasks.insert(0, ("host", lambda: host.update(board.currentValues), False))
+		names = [task[0] for task in tasks]
+		for name, job, onBus in tasks:
+			period = cadences.get(name, args.period)
+			print("Task " + name + " every " + str(period) + "s")
+
+			# Publish the values the tasks before it read on the same tick, not the tick before
+			after = names[:names.index(name)] if name == "publish" else ()
+			scheduler.addTask(name, period, job, onBus, after)
 
-		# Update Thread
-		updateThread = threading.Thread(None, update)
+		for name in cadences:
+			if name in names:
+				continue
+			print("Warning no task named " + name + ", choose from " + ", ".join(names))
+
+		# Loop timings for /metrics
+		metrics.scheduler = scheduler
 
 		# Start
-		running = True
-		updateThread.start()
+		scheduler.start()
 
 	# Default path
 	@app.route('/', methods=['GET'])
@@ -99,16 +485,228 @@ def createRestApp():
 	# Our Values Path
 	@app.route('/values', methods=['GET'])
 	def api_all():
-		global updateLock
-		with updateLock:
-			# Response is the sensor values wrapped in json
-			return Response(response=board.getJSONValues(), status=200, mimetype="application/json")
+		# Long poll, /values?since=<sequence>&wait=<seconds> waits for values newer than since
+		since = request.args.get("since", type=int)
 
-	beginUpdating()
+		if since is None:
+			# No lock needed, the board swaps in a complete snapshot each update
+			snapshot = board.getSnapshot()
+		else:
+			wait = min(max(request.args.get("wait", 0.0, type=float), 0.0), LONG_POLL_MAX_WAIT)
+			snapshot = board.publisher.waitForSnapshot(since, wait)
+
+		# The placeholder values the board starts with are not values
+		if snapshot.sequence == 0:
+			return notPublished()
+
+		# JSON, CBOR or MessagePack
+		offered = [JSON_TYPE, CBOR_TYPE, MSGPACK_TYPE]
+		mimetype = chooseFormat(offered)
+		if mimetype is None:
+			return notAcceptable(offered)
+
+		# Each encoding is a different representation, so has its own tag
+		etag = snapshot.etag if mimetype == JSON_TYPE else snapshot.etag + "-" + mimetype.split("/")[1]
+
+		# The client already has these values
+		if (etag in request.if_none_match) or (since is not None and snapshot.sequence == since):
+			response = Response(status=304)
+		elif mimetype == JSON_TYPE:
+			# Response is the last published sensor values, already encoded as json
+			response = Response(response=snapshot.json, status=200, mimetype=JSON_TYPE)
+		else:
+			response = Response(response=snapshot.encode(mimetype), status=200, mimetype=mimetype)
+
+		response.set_etag(etag)
+		response.vary.add("Accept")
+
+		# The values will not change until the next publish
+		response.headers["Cache-Control"] = "max-age=" + str(int(publishPeriod))
+
+		return response
 
-	app.run(host="0.0.0.0", port="8080")
+	# History, /history?channels=temperature,humidity&from=<time>&to=<time>&step=<seconds>&tier=<auto|raw|1m|1h>
+	# Times are seconds since the epoch, or relative to now when zero or negative
+	@app.route('/history', methods=['GET'])
+	def api_history():
+		now = time()
+
+		end = request.args.get("to", now, type=float)
+		if end <= 0:
+			end = now + end
+
+		start = request.args.get("from", end - 3600.0, type=float)
+		if start <= 0:
+			start = now + start
+
+		step = request.args.get("step", 0.0, type=float)
+
+		channels = history.channels or []
+		if request.args.get("channels"):
+			channels = request.args.get("channels").split(",")
+			unknown = [name for name in channels if name not in (history.channels or [])]
+			if unknown:
+				return Response(response=json.dumps({"error": "Unknown channels " + ", ".join(unknown)}), status=400, mimetype="application/json")
+
+		# Long ranges or wide steps are answered from the rollups, rather than scanning the raw samples
+		tierName = request.args.get("tier", "auto")
+		if tierName == "auto":
+			# Raw queries older than the history are answered from the store
+			rawOldest = -math.inf if store is not None else history.oldestTime()
+			tier = rollups.chooseTier(start, step, rawOldest)
+		elif tierName == "raw":
+			tier = None
+		else:
+			tier = rollups.getTier(tierName)
+			if tier is None:
+				return Response(response=json.dumps({"error": "Unknown tier " + tierName}), status=400, mimetype="application/json")
+
+		# JSON, CBOR, MessagePack or packed columns
+		offered = [JSON_TYPE, COLUMNS_TYPE, CBOR_TYPE, MSGPACK_TYPE]
+		mimetype = chooseFormat(offered)
+		if mimetype is None:
+			return notAcceptable(offered)
+
+		# Optional rounding, ?precision=2 or ?precision=temperature:1,humidity:0
+		try:
+			precision = parsePrecision(request.args.get("precision"))
+		except ValueError:
+			return Response(response=json.dumps({"error": "precision should be decimal places, or channel:places pairs"}), status=400, mimetype="application/json")
+
+		# Repeats are answered from the cache, until the data they were answered from changes
+		# A range up to now, or from or to relative to now, moves with now
+		relative = request.args.get("to", 0.0, type=float) <= 0 or request.args.get("from", 1.0, type=float) <= 0
+		key = historyCacheKey(request.args.items(multi=True), mimetype, start, end, relative, tier, history, publishPeriod)
+		cached = responseCache.get(key)
+		if cached is None:
+			cached = encodeHistory(mimetype, channels, start, end, step, tier, precision)
+			responseCache.put(key, cached)
+
+		return sendCached(key, cached)
+
+	# Export, /export?channels=temperature,humidity&from=<time>&to=<time>&step=<seconds>&format=<csv|f32>
+	# Streams the raw values a block at a time, so any range can be exported in constant memory
+	@app.route('/export', methods=['GET'])
+	def api_export():
+		now = time()
+
+		end = request.args.get("to", now, type=float)
+		if end <= 0:
+			end = now + end
+
+		start = request.args.get("from", end - 86400.0, type=float)
+		if start <= 0:
+			start = now + start
+
+		step = request.args.get("step", 0.0, type=float)
+
+		channels = history.channels or []
+		if request.args.get("channels"):
+			channels = request.args.get("channels").split(",")
+			unknown = [name for name in channels if name not in (history.channels or [])]
+			if unknown:
+				return Response(response=json.dumps({"error": "Unknown channels " + ", ".join(unknown)}), status=400, mimetype="application/json")
+
+		# Each block covers about EXPORT_BLOCK_ROWS rows
+		blockSeconds = EXPORT_BLOCK_ROWS * max(publishPeriod, step)
+
+		filename = "sensormon-" + boardName.lower() + "-" + str(int(start)) + "-" + str(int(end))
+
+		exportFormat = request.args.get("format", "csv")
+		if exportFormat == "csv":
+			response = Response(response=exportCSV(queryRaw, channels, start, end, step, blockSeconds), status=200, mimetype="text/csv")
+			filename = filename + ".csv"
+		elif exportFormat == "f32":
+			response = Response(response=exportColumns(queryRaw, channels, start, end, step, blockSeconds), status=200, mimetype=COLUMNS_TYPE)
+			response.headers["X-Columns"] = columnsLayout(channels)
+			filename = filename + ".bin"
+		else:
+			return Response(response=json.dumps({"error": "Unknown format " + exportFormat + ", choose from csv or f32"}), status=400, mimetype="application/json")
+
+		response.headers["Content-Disposition"] = "attachment; filename=\"" + filename + "\""
+
+		# Compressed as it streams
+		encoding = chooseEncoding(request.accept_encodings)
+		if encoding is not None:
+			response.response = compressStream(response.response, encoding)
+			response.headers["Content-Encoding"] = encoding
+		response.vary.add("Accept-Encoding")
+
+		return response
+
+	# Server-Sent Events, pushes each new set of values as it is published
+	@app.route('/stream', methods=['GET'])
+	def api_stream():
+		client = streamHub.subscribe()
+		if client is None:
+			return Response(response="Too many stream clients", status=503, headers={"Retry-After": "5"})
+
+		# Before the first publish the stream starts with the first values rather than the placeholders
+		snapshot = board.getSnapshot()
+		response = Response(response=streamHub.stream(client, snapshot if snapshot.sequence > 0 else None), status=200, mimetype="text/event-stream")
+		response.headers["Cache-Control"] = "no-cache"
+
+		return response
+
+	# Prometheus metrics, the values and the acquisition loop timings
+	@app.route('/metrics', methods=['GET'])
+	def api_metrics():
+		return Response(response=metrics.getMetrics(), status=200, content_type=METRICS_CONTENT_TYPE)
+
+	# Latency histograms of each sensor task and stage, with the overrun and late start counters
+	@app.route('/debug/timings', methods=['GET'])
+	def api_timings():
+		tasks = {}
+		for task in scheduler.tasks:
+			tasks[task.name] = {
+				"period": task.period,
+				"runs": task.runs,
+				"overruns": task.overruns,
+				"missed": task.missed,
+				"late": task.late,
+				"lateness": task.lateness,
+				"duration": task.duration,
+			}
+
+		result = {
+			"enabled": board.timings.enabled,
+			"buckets": list(TIMING_BUCKETS),
+			"tasks": tasks,
+			"stages": board.timings.toDict(),
+			"responseCache": {"hits": responseCache.hits, "misses": responseCache.misses, "bytes": responseCache.size, "entries": len(responseCache.entries)},
+		}
+
+		return Response(response=json.dumps(result), status=200, mimetype="application/json")
+
+	# Whether every sensor has started, 503 until they have (or if one failed)
+	@app.route('/ready', methods=['GET'])
+	def api_ready():
+		readiness = board.readiness
+		sensors = readiness.toDict()
+		ready = readiness.settled() and all(sensor["state"] == "ready" for sensor in sensors.values())
+
+		result = {
+			"ready": ready,
+			"uptime": monotonic() - startedAt,
+			"sensors": sensors,
+		}
+
+		return Response(response=json.dumps(result), status=200 if ready else 503, mimetype="application/json")
+
+	beginUpdating()
 
 	return app
 
 # create the rest app
-app = createRestApp()
\ No newline at end of file
+app = createRestApp()
+
+# Serve it until we are stopped, each stream client holds a worker so add enough for them on top of the request workers
+serve(app, args.workers + args.streams, streamHub.close)
+
+scheduler.stop()
+
+for exporter in exporters:
+	exporter.stop()
+
+if store is not None:
+	store.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# A simple HTTP load generator for comparing the REST servers
+#
+# Runs a number of concurrent clients against a url for a fixed time, each client
+# keeps its connection alive (if the server allows), then prints requests/sec and
+# latency percentiles.
+
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from time import perf_counter
+from urllib.parse import urlsplit
+import threading
+
+def client(url, duration, latencies, errors):
+
+	parts = urlsplit(url)
+	path = parts.path or "/"
+	if parts.query:
+		path = path + "?" + parts.query
+
+	connection = None
+	end = perf_counter() + duration
+
+	while perf_counter() < end:
+		start = perf_counter()
+		try:
+			if connection is None:
+				connection = HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+
+			connection.request("GET", path)
+			response = connection.getresponse()
+			response.read()
+
+			if response.status != 200:
+				errors.append(response.status)
+
+			if response.will_close:
+				connection.close()
+				connection = None
+		except Exception as e:
+			errors.append(repr(e))
+			connection = None
+			continue
+
+		latencies.append(perf_counter() - start)
+
+	if connection is not None:
+		connection.close()
+
+def percentile(values, p):
+	return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+
+	parser = ArgumentParser(description='SensorMon HTTP benchmark')
+	parser.add_argument('-url', help='The url to request (default http://127.0.0.1:8080/values).', default='http://127.0.0.1:8080/values')
+	parser.add_argument('-clients', help='Concurrent clients (default 8).', type=int, default=8)
+	parser.add_argument('-duration', help='Seconds to run for (default 10).', type=float, default=10.0)
+	args = parser.parse_args()
+
+	latencies = []
+	errors = []
+
+	threads = [threading.Thread(None, client, args=(args.url, args.duration, latencies, errors)) for n in range(args.clients)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	latencies.sort()
+
+	print("Requests\t" + str(len(latencies)))
+	print("Errors\t\t" + str(len(errors)))
+	if latencies:
+		print("Req/sec\t\t" + str(round(len(latencies) / args.duration, 1)))
+		print("p50 ms\t\t" + str(round(percentile(latencies, 0.50) * 1000, 2)))
+		print("p99 ms\t\t" + str(round(percentile(latencies, 0.99) * 1000, 2)))
+		print("max ms\t\t" + str(round(latencies[-1] * 1000, 2)))
+
+if __name__ == "__main__":
+	main()
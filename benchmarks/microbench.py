@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Microbenchmarks of the code run every tick
+#
+# Times the smoothing buffer, filters and filter groups, the BME280 compensation, the SGP40 VOC algorithm (and its
+# fixed point helpers) and CRC, the JSON values and the EnviroPlus display rendering.
+# Each case is run in batches of at least -mintime seconds, -repeat times, and the median
+# and fastest batch are reported as nanoseconds per call.
+#
+# The results can be written as JSON (-output), with the machine they were run on, to
+# keep as a baseline for that machine. Given a baseline (-baseline) any case slower than
+# it by more than -threshold is reported as a regression and the exit status is 1.
+#
+# No PI is needed, the boards are imported with their hardware replayed from a trace
+# that only has what the display needs to start. Cases whose libraries (or fonts) are
+# not installed are skipped.
+
+from argparse import ArgumentParser
+from time import time
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utility import trace
+
+RESULTS_VERSION = 1
+
+# Window the boards smooth over
+SAMPLE_WINDOW_LEN = 10
+
+# An hour of samples at 1 a second
+LONG_WINDOW_LEN = 3600
+
+# Datasheet example calibration, and typical raw readings (about 25C, 1000hPa, 45%)
+BME280_CALIBRATION = {
+	"dig_t1": 27504, "dig_t2": 26435, "dig_t3": -1000,
+	"dig_p1": 36477, "dig_p2": -10685, "dig_p3": 3024, "dig_p4": 2855, "dig_p5": 140,
+	"dig_p6": -7, "dig_p7": 15500, "dig_p8": -14600, "dig_p9": 6000,
+	"dig_h1": 75.0, "dig_h2": 362.0, "dig_h3": 0.0, "dig_h4": 313.0, "dig_h5": 50.0, "dig_h6": 30.0,
+}
+BME280_RAW = (519888, 415148, 27000)
+
+# Raw readings compensated together, e.g. a recorded log
+BME280_BATCH_LEN = 1000
+
+# A typical SGP40 raw reading
+SGP40_RAW = 30000
+
+def benchCBuffer():
+
+	from utility.cbuffer import CBuffer
+
+	buffer = CBuffer(SAMPLE_WINDOW_LEN)
+	for n in range(SAMPLE_WINDOW_LEN):
+		buffer.addValue(20.0 + n)
+
+	# A long window, the running sum, which costs the same however long
+	longBuffer = CBuffer(LONG_WINDOW_LEN)
+	for n in range(LONG_WINDOW_LEN):
+		longBuffer.addValue(20.0 + n)
+
+	return {
+		"cbuffer.addValue": lambda: buffer.addValue(21.5),
+		"cbuffer.getValue": buffer.getValue,
+		"cbuffer.addValue.long": lambda: longBuffer.addValue(21.5),
+		"cbuffer.getValue.long": longBuffer.getValue,
+	}
+
+def benchFilters():
+
+	import random
+
+	from utility.filters import createFilter
+
+	cases = {}
+
+	# Noisy samples, cycled so each add is a new value
+	samples = [random.Random(n).gauss(100.0, 5.0) for n in range(1024)]
+
+	for kind in ("ema", "median", "hampel"):
+		for length in (SAMPLE_WINDOW_LEN, LONG_WINDOW_LEN):
+			buffer = createFilter(kind + ":" + str(length), length)
+			for n in range(length):
+				buffer.addValue(samples[n % len(samples)])
+
+			state = {"n": 0}
+			def add(buffer=buffer, state=state):
+				state["n"] = (state["n"] + 1) & 1023
+				buffer.addValue(samples[state["n"]])
+
+			suffix = "" if length == SAMPLE_WINDOW_LEN else ".long"
+			cases["filter." + kind + ".addValue" + suffix] = add
+			cases["filter." + kind + ".getValue" + suffix] = buffer.getValue
+
+	return cases
+
+def benchFilterGroup():
+
+	from utility.filters import createFilterGroup
+
+	cases = {}
+
+	# A sensor's values, added together
+	names = ["value" + str(n) for n in range(3)]
+	group = createFilterGroup(names, {}, SAMPLE_WINDOW_LEN)
+
+	row = [20.0 + n for n in range(len(names))]
+	for n in range(SAMPLE_WINDOW_LEN):
+		group.addValues(row)
+
+	cases["filtergroup.addValues"] = lambda: group.addValues(row)
+
+	return cases
+
+def benchBME280():
+
+	from sensors.BME280 import BME280Calibration
+
+	calibration = BME280Calibration()
+	for name, value in BME280_CALIBRATION.items():
+		setattr(calibration, name, value)
+	calibration.compute_coefficients()
+
+	temperature, pressure, humidity = BME280_RAW
+	calibration.compensate_temperature(temperature)
+
+	cases = {
+		"bme280.compensate_temperature": lambda: calibration.compensate_temperature(temperature),
+		"bme280.compensate_pressure": lambda: calibration.compensate_pressure(pressure),
+		"bme280.compensate_humidity": lambda: calibration.compensate_humidity(humidity),
+	}
+
+	# The batch needs numpy, which the single sample methods do not
+	try:
+		import numpy
+	except ImportError:
+		return cases
+
+	temperatures = numpy.full(BME280_BATCH_LEN, temperature)
+	pressures = numpy.full(BME280_BATCH_LEN, pressure)
+	humidities = numpy.full(BME280_BATCH_LEN, humidity)
+	cases["bme280.compensate_arrays." + str(BME280_BATCH_LEN)] = lambda: calibration.compensate_arrays(temperatures, pressures, humidities)
+
+	return cases
+
+def benchSGP40():
+
+	from sensors.SGP40 import SGP40
+	from sensors.SGP40_VOC import Sensirion_VOCAlgorithm
+
+	algorithm = Sensirion_VOCAlgorithm()
+	algorithm.vocalgorithm_init()
+
+	a = algorithm._fix16_from_int(3)
+	b = algorithm._fix16_from_int(7)
+
+	# The CRC sent with the humidity and temperature, without a bus
+	crc = SGP40()._SGP40__crc
+
+	return {
+		"voc.vocalgorithm_process": lambda: algorithm.vocalgorithm_process(SGP40_RAW),
+		"voc._fix16_mul": lambda: algorithm._fix16_mul(a, b),
+		"voc._fix16_div": lambda: algorithm._fix16_div(a, b),
+		"voc._fix16_sqrt": lambda: algorithm._fix16_sqrt(b),
+		"voc._fix16_exp": lambda: algorithm._fix16_exp(-a),
+		"sgp40.crc": lambda: crc(0x80, 0x00),
+	}
+
+def benchValues(boardName):
+
+	import importlib
+
+	values = importlib.import_module("boards." + boardName.lower()).Values()
+
+	return {boardName.lower() + ".Values.toJSON": values.toJSON}
+
+def benchDisplay():
+
+	from boards.enviroplusdisplay import Display
+
+	display = Display()
+	display.updateValues(3, 123.45, 21.37, 45.6, 1013.2, 123456.0, 23456.0, 345678.0)
+
+	return {
+		"display.lcd_sensor_mode": display.lcd_sensor_mode,
+		"display.lcd_clock_mode": display.lcd_clock_mode,
+	}
+
+def writeDisplayTrace(path):
+	""" A trace of an ST7735 with just what the Display needs to start """
+
+	writer = trace.TraceWriter(path)
+	writer.write({"device": "st7735", "attribute": "width", "value": 160})
+	writer.write({"device": "st7735", "attribute": "height", "value": 80})
+	writer.write({"key": "st7735", "method": "begin", "args": [], "time": 0.0, "result": None, "seconds": 0.0})
+	writer.write({"key": "st7735", "method": "display", "args": [{"object": "Image"}], "time": 0.0, "result": None, "seconds": 0.0})
+	writer.close()
+
+def getCases():
+	""" Returns (cases, skipped) as name -> callable and name -> why """
+
+	benches = [
+		("cbuffer", benchCBuffer),
+		("filters", benchFilters),
+		("filtergroup", benchFilterGroup),
+		("bme280", benchBME280),
+		("sgp40", benchSGP40),
+		("enviroplus.Values", lambda: benchValues("EnviroPlus")),
+		("waveshareesh.Values", lambda: benchValues("WaveshareESH")),
+		("simulated.Values", lambda: benchValues("Simulated")),
+		("display", benchDisplay),
+	]
+
+	cases = {}
+	skipped = {}
+
+	for name, bench in benches:
+		try:
+			cases.update(bench())
+		except (ImportError, OSError) as e:
+			skipped[name] = repr(e)
+
+	return cases, skipped
+
+def getHost():
+	""" What the results were run on, the PI model where there is one """
+
+	model = None
+	try:
+		with open("/proc/device-tree/model", "r") as file:
+			model = file.read().strip("\0\n ")
+	except OSError:
+		pass
+
+	return {
+		"model": model,
+		"machine": platform.machine(),
+		"system": platform.system(),
+		"python": platform.python_version(),
+		"implementation": platform.python_implementation(),
+	}
+
+def measure(fn, repeat, minTime):
+	""" Times fn in batches of at least minTime seconds, returns nanoseconds per call """
+
+	timer = timeit.Timer(fn)
+
+	# Find a batch size, which also warms up the case
+	number = 1
+	while True:
+		if timer.timeit(number) >= minTime:
+			break
+		number = number * 2
+
+	batches = [seconds / number * 1e9 for seconds in timer.repeat(repeat, number)]
+
+	return {
+		"median_ns": statistics.median(batches),
+		"min_ns": min(batches),
+		"max_ns": max(batches),
+		"number": number,
+		"repeat": repeat,
+	}
+
+def compare(results, baseline, threshold):
+	""" Prints each case against the baseline, returns the names of the regressions """
+
+	regressions = []
+
+	print("")
+	print("Case".ljust(36) + "baseline ns\tnow ns\t\tchange")
+	for name, result in results.items():
+		base = baseline.get("results", {}).get(name)
+		if base is None:
+			print(name.ljust(36) + "-\t\t" + str(round(result["median_ns"], 1)))
+			continue
+
+		change = result["median_ns"] / base["median_ns"] - 1.0
+		flag = ""
+		if change > threshold:
+			regressions.append(name)
+			flag = "\tREGRESSION"
+
+		print(name.ljust(36) + str(round(base["median_ns"], 1)) + "\t\t" + str(round(result["median_ns"], 1)) + "\t\t" + "%+.1f%%" % (change * 100.0) + flag)
+
+	return regressions
+
+def main():
+
+	parser = ArgumentParser(description='SensorMon microbenchmarks')
+	parser.add_argument('-filter', help='Only run cases whose name contains this.', default=None)
+	parser.add_argument('-repeat', help='Batches timed per case (default 7).', type=int, default=7)
+	parser.add_argument('-mintime', help='Shortest batch in seconds (default 0.05).', type=float, default=0.05)
+	parser.add_argument('-output', help='Writes the results as JSON to this file.', default=None)
+	parser.add_argument('-baseline', help='Compares against results written before with -output.', default=None)
+	parser.add_argument('-threshold', help='Slowdown against the baseline reported as a regression (default 0.15, 15%%).', type=float, default=0.15)
+	args = parser.parse_args()
+
+	# Replay the hardware, so the boards can be imported without it
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "display.trace")
+		writeDisplayTrace(path)
+		trace.replay(path, trace.MAX_SPEED)
+
+		cases, skipped = getCases()
+
+	results = {}
+	for name, fn in cases.items():
+		if args.filter is not None and args.filter not in name:
+			continue
+
+		results[name] = measure(fn, args.repeat, args.mintime)
+		print(name.ljust(36) + str(round(results[name]["median_ns"], 1)) + " ns")
+
+	for name, why in skipped.items():
+		print(name.ljust(36) + "skipped, " + why)
+
+	document = {
+		"version": RESULTS_VERSION,
+		"timestamp": time(),
+		"host": getHost(),
+		"settings": {"repeat": args.repeat, "mintime": args.mintime},
+		"results": results,
+		"skipped": skipped,
+	}
+
+	if args.output is not None:
+		with open(args.output, "w") as file:
+			json.dump(document, file, indent=2)
+
+	if args.baseline is not None:
+		with open(args.baseline, "r") as file:
+			baseline = json.load(file)
+
+		regressions = compare(results, baseline, args.threshold)
+		if regressions:
+			print("")
+			print(str(len(regressions)) + " regressions over " + str(round(args.threshold * 100)) + "%")
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
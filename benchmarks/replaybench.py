@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Benchmarks a board's acquisition pipeline from a recorded hardware trace
+#
+# Replays a trace (recorded on a PI with SensorMon -record) into the board, then runs
+# each of its tasks in turn, as fast as it can, until the trace runs out. Each round is
+# the sensor reads and their smoothing, the publish of a snapshot (and its JSON) and
+# encoding the snapshot as CBOR and MessagePack.
+# No PI is needed, but the board's sensor libraries must be installed.
+#
+# At speed max the sensor waits (conversions, integrations) are skipped as well as the
+# recorded bus time, so what is left is the cost of the Python around the hardware.
+
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+import importlib
+import inspect
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utility import trace
+from utility.encoding import CBOR_TYPE, MSGPACK_TYPE
+
+def runJob(job, skipWaits):
+	""" Runs a job to completion, sleeping for any waits it yields unless skipped """
+
+	result = job()
+
+	if inspect.isgenerator(result):
+		for wait in result:
+			if not skipWaits:
+				sleep(wait)
+
+def percentile(values, p):
+	return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+
+	parser = ArgumentParser(description='SensorMon trace replay benchmark')
+	parser.add_argument('-trace', help='The trace file to replay.', required=True)
+	parser.add_argument('-boardname', help='The board the trace was recorded on.', required=True)
+	parser.add_argument('-speed', help='A multiple of the recorded speed, or max (default max).', default='max')
+	parser.add_argument('-rounds', help='Most rounds to run (default all the trace has).', type=int, default=None)
+	args = parser.parse_args()
+
+	speed = trace.parseSpeed(args.speed)
+	trace.replay(args.trace, speed)
+
+	BoardClass = getattr(importlib.import_module("boards." + args.boardname.lower()), args.boardname)
+
+	began = perf_counter()
+	board = BoardClass()
+	board.begin()
+	board.readiness.wait()
+	print("Started in " + str(round(perf_counter() - began, 3)) + "s")
+
+	for name, sensor in board.readiness.toDict().items():
+		if sensor["state"] != "ready":
+			print("Sensor " + name + " " + sensor["state"] + ", its task is skipped")
+
+	tasks = board.getTasks()
+	stages = {name: [] for name, job, onBus in tasks}
+	stages["encode"] = []
+
+	rounds = 0
+	began = perf_counter()
+	try:
+		while args.rounds is None or rounds < args.rounds:
+			for name, job, onBus in tasks:
+				start = perf_counter()
+				runJob(job, speed == trace.MAX_SPEED)
+				stages[name].append(perf_counter() - start)
+
+			start = perf_counter()
+			snapshot = board.getSnapshot()
+			snapshot.encode(CBOR_TYPE)
+			snapshot.encode(MSGPACK_TYPE)
+			stages["encode"].append(perf_counter() - start)
+
+			rounds = rounds + 1
+	except trace.TraceError as e:
+		print(str(e))
+
+	elapsed = perf_counter() - began
+
+	print("Rounds\t\t" + str(rounds))
+	if rounds:
+		print("Rounds/sec\t" + str(round(rounds / elapsed, 1)))
+
+	print("Stage\t\tp50 us\tp99 us\tmax us")
+	for name, times in stages.items():
+		if not times:
+			continue
+		times.sort()
+		print(name.ljust(16) + str(round(percentile(times, 0.50) * 1e6, 1)) + "\t" + str(round(percentile(times, 0.99) * 1e6, 1)) + "\t" + str(round(times[-1] * 1e6, 1)))
+
+if __name__ == "__main__":
+	main()
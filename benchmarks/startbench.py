@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Measures how long SensorMon takes to start
+#
+# Starts SensorMon with a board, then polls it until the REST server answers (serving)
+# and until /ready says every sensor has started (ready), and prints both times.
+# Repeats a number of times and prints the median and worst of each.
+
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from time import perf_counter, sleep
+import os
+import signal
+import subprocess
+import sys
+
+# Seconds between polls
+POLL_INTERVAL = 0.01
+
+def getStatus(port, path):
+	""" The HTTP status of a GET, None if the server is not answering yet """
+
+	connection = HTTPConnection("127.0.0.1", port, timeout=1)
+	try:
+		connection.request("GET", path)
+		response = connection.getresponse()
+		response.read()
+		return response.status
+	except OSError:
+		return None
+	finally:
+		connection.close()
+
+def startOnce(board, port, timeout):
+	""" Returns (seconds until serving, seconds until ready) """
+
+	sensorMon = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SensorMon.py")
+
+	began = perf_counter()
+	process = subprocess.Popen([sys.executable, sensorMon, "-boardname", board, "-port", str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+	serving = None
+	ready = None
+	try:
+		while perf_counter() - began < timeout:
+			if process.poll() is not None:
+				raise RuntimeError("SensorMon exited with " + str(process.returncode))
+
+			status = getStatus(port, "/ready")
+			if status is not None and serving is None:
+				serving = perf_counter() - began
+			if status == 200:
+				ready = perf_counter() - began
+				break
+
+			sleep(POLL_INTERVAL)
+	finally:
+		process.send_signal(signal.SIGTERM)
+		process.wait()
+
+	return serving, ready
+
+def formatSeconds(value):
+	return "-" if value is None else str(round(value, 3))
+
+def main():
+
+	parser = ArgumentParser(description='SensorMon start up benchmark')
+	parser.add_argument('-boardname', help='The board to start (default Simulated).', default='Simulated')
+	parser.add_argument('-port', help='The port to start it on (default 8090).', type=int, default=8090)
+	parser.add_argument('-runs', help='Times to start it (default 5).', type=int, default=5)
+	parser.add_argument('-timeout', help='Seconds to wait for it to be ready (default 60).', type=float, default=60.0)
+	args = parser.parse_args()
+
+	servings = []
+	readies = []
+
+	for n in range(args.runs):
+		serving, ready = startOnce(args.boardname, args.port, args.timeout)
+		print("Run " + str(n + 1) + "\tserving " + formatSeconds(serving) + "s\tready " + formatSeconds(ready) + "s")
+
+		if serving is not None:
+			servings.append(serving)
+		if ready is not None:
+			readies.append(ready)
+
+	for name, values in (("Serving", servings), ("Ready", readies)):
+		values.sort()
+		if values:
+			print(name + "\tp50 " + formatSeconds(values[len(values) // 2]) + "s\tmax " + formatSeconds(values[-1]) + "s")
+
+if __name__ == "__main__":
+	main()
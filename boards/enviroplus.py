@@ -17,30 +17,32 @@
 # Devices supported		-	Temperature, Humidity and Pressure, Lux, Proximity, Gas and LCD.
 # Devices not supported	-	Noise and Particulate matter addon.
 
-from smbus import SMBus
-I2C_DEV=SMBus(1)
+# PI I2C, recorded or replayed when tracing
+from utility.trace import openBus
+I2C_DEV=openBus(1)
 
 # Temperature, Humidity and Pressure
 from sensors.BME280 import BME280
 
-# CPU Temp
-from subprocess import PIPE, Popen
-
 # The Lux/Proximity sensors
 from ltr559 import LTR559
 
 # Gas sensor
 from sensors import MICS6814
 
-# EnviroPlus OLED Display
-from boards.enviroplusdisplay import Display
-
-from utility.cbuffer import CBuffer
+from utility.filters import createFilterGroup
+from utility.readiness import Readiness
 from utility.picputemperature import PICPUTemp
+from utility.scheduler import runJob
+from utility.snapshot import SnapshotPublisher
+from utility.timings import Timings
 
 # Assuming updating at 1 sample per second this is ten seconds of samples
 SAMPLE_WINDOW_LEN = 10
 
+# Standby between BME280 measurements in normal mode (ms), with 16x oversampling a new one is ready every 240ms
+BME280_STANDBY_MS = 125
+
 # A class to describe what our JSON returned values will look like
 import json
 class Values:
@@ -59,13 +61,41 @@ class Values:
 	def toJSON(self):
 		return "{ \"values\" :" + json.dumps(self, default=lambda o: o.__dict__, sort_keys=False) + "}"
 
+# What each value is, (sensor, unit, description), used for /metrics
+CHANNELS = {
+	"proximity" : ("ltr559", "counts", "Proximity, higher is closer"),
+	"lux" : ("ltr559", "lux", "Illuminance"),
+	"temperature" : ("bme280", "celsius", "Temperature"),
+	"humidity" : ("bme280", "percent", "Relative humidity"),
+	"pressure" : ("bme280", "hectopascals", "Air pressure"),
+	"reducing" : ("mics6814", "ohms", "Reducing gas sensor resistance (e.g. carbon monoxide)"),
+	"oxidising" : ("mics6814", "ohms", "Oxidising gas sensor resistance (e.g. nitrogen dioxide)"),
+	"nh3" : ("mics6814", "ohms", "NH3 gas sensor resistance (e.g. ammonia)"),
+}
+
+# How each value is smoothed, see utility/filters.py
+# The gas sensors are spiky, outliers are rejected before they are smoothed
+FILTERS = {
+	"proximity" : "mean",
+	"lux" : "mean",
+	"temperature" : "mean",
+	"humidity" : "mean",
+	"pressure" : "mean",
+	"reducing" : "hampel:31+ema",
+	"oxidising" : "hampel:31+ema",
+	"nh3" : "hampel:31+ema",
+}
+
 # The board class
 class EnviroPlus:
 
 	# Setup the LCD controller and backing frame buffer
 	def initDisplay(self):
 
-		self.display = Display()
+		# EnviroPlus OLED Display, imported here as loading PIL and the fonts is slow
+		from boards.enviroplusdisplay import Display
+
+		self.display = Display(self.timings)
 
 		print("OLED Display Ready")
 
@@ -75,14 +105,12 @@ class EnviroPlus:
 		# CPU Temp
 		self.cpu_temp = PICPUTemp(SAMPLE_WINDOW_LEN)
 
-		# Buffers for BME280 stats
-		self.bme280_temps = CBuffer(SAMPLE_WINDOW_LEN)
-		self.bme280_humidity = CBuffer(SAMPLE_WINDOW_LEN)
-		self.bme280_pressure = CBuffer(SAMPLE_WINDOW_LEN)
+		# Buffers for BME280 stats, the temperature is not smoothed
+		self.bme280_values = createFilterGroup(["humidity", "pressure"], self.filters, SAMPLE_WINDOW_LEN)
 
 		# Create a BME280 instance (SMBus 1)
 		self.bme280 = BME280(i2c_dev=I2C_DEV)
-		self.bme280.setup(mode="forced", temperature_oversampling=16, pressure_oversampling=16)
+		self.bme280.setup(mode=self.bme280_mode, temperature_oversampling=16, pressure_oversampling=16, temperature_standby=BME280_STANDBY_MS)
 
 		print("BME280 Ready")
 
@@ -90,10 +118,9 @@ class EnviroPlus:
 	def initLTR559(self):
 
 		# Buffers for the LTR559 Stats
-		self.ltr559_lux = CBuffer(SAMPLE_WINDOW_LEN)
-		self.ltr559_prox = CBuffer(SAMPLE_WINDOW_LEN)
+		self.ltr559_values = createFilterGroup(["proximity", "lux"], self.filters, SAMPLE_WINDOW_LEN)
 
-		self.ltr559 = LTR559()
+		self.ltr559 = LTR559(i2c_dev=openBus(1))
 
 		print("LTR559 Ready")
 
@@ -101,9 +128,7 @@ class EnviroPlus:
 	def initMICS6814(self):
 
 		# Buffers for the MICS6814 Stats
-		self.mics6814_reducing = CBuffer(SAMPLE_WINDOW_LEN)
-		self.mics6814_oxidising = CBuffer(SAMPLE_WINDOW_LEN)
-		self.mics6814_nh3 = CBuffer(SAMPLE_WINDOW_LEN)
+		self.mics6814_values = createFilterGroup(["reducing", "oxidising", "nh3"], self.filters, SAMPLE_WINDOW_LEN)
 
 		self.mics6814 = MICS6814
 
@@ -132,74 +157,142 @@ class EnviroPlus:
 		# PI is inside a aluminium case, with very low load.
 		self.smooth_factor = smooth_factor
 
+		# Hot path latency histograms, off unless enabled
+		self.timings = Timings()
+
 		# Sensor values for formatting into JSON
 		self.currentValues = Values()
 
-		self.initBME280()
-		self.initLTR559()
-		self.initMICS6814()
-		self.initDisplay()
+		# Published snapshots of the values, read by the REST API
+		self.publisher = SnapshotPublisher(self.currentValues)
+
+		# Raw proximity, used by the display
+		self.r_proximity = 0.0
+
+		# How each value is smoothed, can be changed before begin()
+		self.filters = dict(FILTERS)
+
+		# Forced (a measurement each read) or normal (measuring continuously), can be changed before begin()
+		self.bme280_mode = "forced"
 
-		print("EnviroPlus Ready")
+		# Which sensors have started, see begin()
+		self.readiness = Readiness()
+
+	def begin(self):
+		""" Starts the sensors, each on its own thread so their warm ups overlap """
+
+		self.readiness.start([
+			("bme280", self.initBME280),
+			("ltr559", self.initLTR559),
+			("mics6814", self.initMICS6814),
+			("display", self.initDisplay),
+		])
 
 	# Fetches the current cpu temperature
 	def get_cpu_temperature(self):
 
-		process = Popen(['cat', '/sys/class/thermal/thermal_zone0/temp'], stdout=PIPE)
-		(output, process) = process.communicate()
-		#print ("output 1: ", output.strip())
-		return float(output) * 0.001
+		# The same thermal zone the BME280 compensation reads
+		return float(self.cpu_temp.zone.read()) * 0.001
 
-	def updateValues(self):
-		""" Performs a collection of values from supported devices """
+	def updateBME280(self):
+		""" Reads the BME280 temperature, humidity and pressure, yields while a forced measurement runs """
 
 		# Update the cpu temp which is used to smooth/adjust the bme280 temp
-		self.cpu_temp.update()
+		with self.timings.stage("bme280", "cputemp"):
+			self.cpu_temp.update()
+
+		# In forced mode a measurement is started and its datasheet time yielded, in normal mode the chip is always measuring
+		wait = self.bme280.start_measurement()
+		if wait:
+			yield wait
 
 		# BME280 lib is modified to coalesce the three calls
-		thp = self.bme280.get_thp()
+		with self.timings.stage("bme280", "read"):
+			thp = self.bme280.read_data()
 		temperature = thp[0]
-		self.bme280_humidity.addValue(thp[1])
-		humidity = self.bme280_humidity.getValue()
-		self.bme280_pressure.addValue(thp[2])
-		pressure = self.bme280_pressure.getValue()
+		humidity, pressure = self.bme280_values.addValues(thp[1:])
 
 		# Write current smoothed data to JSON values
 		self.currentValues.temperature, self.currentValues.humidity, self.currentValues.pressure = temperature, humidity, pressure
 
-		# LTR559
-		r_proximity = self.ltr559.get_proximity()
-		r_lux = self.ltr559.get_lux()
+	def updateLTR559(self):
+		""" Reads the LTR559 proximity and lux """
+
+		with self.timings.stage("ltr559", "read"):
+			r_proximity = self.ltr559.get_proximity()
+			r_lux = self.ltr559.get_lux()
 
-		self.ltr559_prox.addValue(r_proximity)
-		proximity = self.ltr559_prox.getValue()
-		self.ltr559_lux.addValue(r_lux)
-		lux = self.ltr559_lux.getValue()
+		proximity, lux = self.ltr559_values.addValues((r_proximity, r_lux))
+
+		# The display needs the raw proximity value
+		self.r_proximity = r_proximity
 
 		# Write current smoothed data to JSON values
 		self.currentValues.proximity, self.currentValues.lux = proximity, lux
 
-		# MICS6814
-		gas = MICS6814.read_all()
-
-		self.mics6814_oxidising.addValue(gas.oxidising)
-		oxidising = self.mics6814_oxidising.getValue()
+	def updateMICS6814(self):
+		""" Reads the MICS6814 gas resistances """
 
-		self.mics6814_reducing.addValue(gas.reducing)
-		reducing = self.mics6814_reducing.getValue()
+		# Three ADC conversions
+		with self.timings.stage("mics6814", "adc"):
+			gas = MICS6814.read_all()
 
-		self.mics6814_nh3.addValue(gas.nh3)
-		nh3 = self.mics6814_nh3.getValue()
+		reducing, oxidising, nh3 = self.mics6814_values.addValues((gas.reducing, gas.oxidising, gas.nh3))
 
 		# Write current smoothed data to JSON values
 		self.currentValues.reducing, self.currentValues.oxidising, self.currentValues.nh3 = reducing, oxidising, nh3
 
+	def updateDisplay(self):
+		""" Draws the latest values to the display """
+
+		v = self.currentValues
+
 		# Send the values to the display
-		self.display.updateValues(proximity, lux, temperature, humidity, pressure, reducing, oxidising, nh3)
+		self.display.updateValues(v.proximity, v.lux, v.temperature, v.humidity, v.pressure, v.reducing, v.oxidising, v.nh3)
 
 		# update the display - note raw proximity value needed here
-		self.display.draw(r_proximity)
+		self.display.draw(self.r_proximity)
+
+	def publishValues(self):
+		""" Publishes the current values as a new snapshot for readers """
+
+		self.publisher.publish(self.currentValues)
+
+	def getTasks(self):
+		""" The acquisition tasks for this board as (name, job, on the i2c bus) """
+
+		# The display is on SPI so does not need to wait for the i2c bus
+		# Publish before drawing so readers do not wait on the frame upload
+		# Each sensor is skipped until it has started, and nothing is published until they all have and have read their values
+		# Publish runs after the sensor tasks listed before it on the same tick
+		ready = self.readiness
+		return [
+			("bme280", ready.gate("bme280", self.updateBME280), True),
+			("ltr559", ready.gate("ltr559", self.updateLTR559), True),
+			("mics6814", ready.gate("mics6814", self.updateMICS6814), True),
+			("publish", ready.gateSettled(self.publishValues), False),
+			("display", ready.gate("display", self.updateDisplay, writesValues=False), False),
+		]
+
+	def updateValues(self):
+		""" Performs a collection of values from supported devices """
+
+		self.readiness.wait()
+
+		for name, job, onBus in self.getTasks():
+			runJob(job)
+
+	def getChannels(self):
+		""" Describes each value as (sensor, unit, description) """
+
+		return CHANNELS
+
+	def getSnapshot(self):
+		""" Return the last published snapshot, with its encoded json """
+
+		return self.publisher.getSnapshot()
 
 	def getJSONValues(self):
-		# Return values formatted as JSON
-		return self.currentValues.toJSON()
\ No newline at end of file
+		""" Return the last published values formated as json """
+
+		return self.publisher.getSnapshot().toJSON()
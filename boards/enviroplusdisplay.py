@@ -18,15 +18,15 @@
 # Has two modes, sensors and clock.
 # Switches between them on a timer or via proximity sensor trigger.
 
-# LCD Graphics (note ST7735 hardcoded to 160x80)
-import ST7735
-
 # Graphics Lib
 from PIL import Image, ImageDraw, ImageFont
 
 # Date display
 from datetime import datetime, timedelta
 
+from utility.timings import Timings
+from utility.trace import openDevice
+
 # Graphics
 FG_TEXT_COLOR = (200, 200, 200)
 BG_TEXT_COLOR = (0, 0, 0)
@@ -53,9 +53,26 @@ class LCD_MODE(Enum):
 	SENSORS = 0
 	CLOCK = 1
 
+def createLCD():
+
+	# LCD Graphics (note ST7735 hardcoded to 160x80)
+	import ST7735
+
+	return ST7735.ST7735(
+	    port=0,
+	    cs=1,
+	    dc=9,
+	    backlight=12,
+	    rotation=270,
+	    spi_speed_hz=10000000
+	)
+
 class Display:
 
-	def __init__(self):
+	def __init__(self, timings=None):
+
+		# Times the frame drawing and upload when enabled
+		self.timings = timings if timings is not None else Timings()
 
 		# frame count, we start on 1 as this is the first update
 		self.frame=1
@@ -63,15 +80,8 @@ class Display:
 		# startup display mode at startup
 		self.lcd_mode=LCD_MODE.SENSORS
 
-		# Create an ST7735 LCD instance
-		self.lcd = ST7735.ST7735(
-		    port=0,
-		    cs=1,
-		    dc=9,
-		    backlight=12,
-		    rotation=270,
-		    spi_speed_hz=10000000
-		)
+		# Create an ST7735 LCD instance, recorded or replayed when tracing
+		self.lcd = openDevice("st7735", createLCD)
 
 		# Initialize display
 		self.lcd.begin()
@@ -169,10 +179,11 @@ class Display:
 		#print("LCD Mode".ljust(lbljust), self.lcd_mode)
 
 		# Decide which display to write to the frame buffer based on the LCD_MODE
-		if (self.lcd_mode == LCD_MODE.SENSORS):
-				self.lcd_sensor_mode()
-		elif (self.lcd_mode == LCD_MODE.CLOCK):
-				self.lcd_clock_mode()
+		with self.timings.stage("display", "render"):
+			if (self.lcd_mode == LCD_MODE.SENSORS):
+					self.lcd_sensor_mode()
+			elif (self.lcd_mode == LCD_MODE.CLOCK):
+					self.lcd_clock_mode()
 
 		# debug to test the display is updating (will over write the bottom of display with a black bar and a frame counter.
 		debugFrame = 0
@@ -181,7 +192,8 @@ class Display:
 			draw.text((0, 60), str(self.frame), font=TITLE_TEXT_FONT, fill=(255,0,0))
 
 		# Upload the buffer to the display
-		self.lcd.display(self.fb)
+		with self.timings.stage("display", "upload"):
+			self.lcd.display(self.fb)
 
 		# The frame counter
 		self.frame = self.frame + 1
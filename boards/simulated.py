@@ -0,0 +1,162 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Simulated Board Support
+# No hardware needed, for testing SensorMon (e.g. as stand-in nodes for -collector) off a PI.
+# Values follow a daily cycle with a little noise, and each read takes about as long as a real one.
+
+import math
+import random
+from time import sleep, time
+
+from utility.filters import createFilterGroup
+from utility.readiness import Readiness
+from utility.scheduler import runJob
+from utility.snapshot import SnapshotPublisher
+from utility.timings import Timings
+
+# Assuming updating at 1 sample per second this is ten seconds of samples
+SAMPLE_WINDOW_LEN = 10
+
+# Roughly a BME280 forced mode measurement at 16x oversampling
+READ_TIME = 0.04
+
+# Seconds the simulated sensor takes to start
+START_TIME = 0.5
+
+# A class to describe what our json returned values will look like
+import json
+class Values:
+
+	def __init__(self):
+
+		self.temperature = 0.0
+		self.humidity = 0.0
+		self.pressure = 0.0
+		self.lux = 0.0
+
+	def toJSON(self):
+		return "{ \"values\" :" + json.dumps(self, default=lambda o: o.__dict__, sort_keys=False) + "}"
+
+# What each value is, (sensor, unit, description), used for /metrics
+CHANNELS = {
+	"temperature" : ("simulated", "celsius", "Temperature"),
+	"humidity" : ("simulated", "percent", "Relative humidity"),
+	"pressure" : ("simulated", "hectopascals", "Air pressure"),
+	"lux" : ("simulated", "lux", "Illuminance"),
+}
+
+# How each value is smoothed, see utility/filters.py
+FILTERS = {
+	"temperature" : "mean",
+	"humidity" : "mean",
+	"pressure" : "mean",
+	"lux" : "mean",
+}
+
+class Simulated:
+
+	def __init__(self, seed=None):
+
+		self.random = random.Random(seed)
+
+		# Hot path latency histograms, off unless enabled
+		self.timings = Timings()
+
+		# How each value is smoothed, can be changed before begin()
+		self.filters = dict(FILTERS)
+
+		# Each simulated node is a little different
+		self.offset = self.random.uniform(-2.0, 2.0)
+
+		# Sensor values for formatting into JSON
+		self.currentValues = Values()
+
+		# Published snapshots of the values, read by the REST API
+		self.publisher = SnapshotPublisher(self.currentValues)
+
+		# Which sensors have started, see begin()
+		self.readiness = Readiness()
+
+	def initSensors(self):
+
+		# Buffers for the stats, after any change to the filters
+		self.values = createFilterGroup(["temperature", "humidity", "pressure", "lux"], self.filters, SAMPLE_WINDOW_LEN)
+
+		# Stands in for the setup and warm up reads of a real sensor
+		sleep(START_TIME)
+
+		print("Simulated Sensors Ready")
+
+	def begin(self):
+		""" Starts the simulated sensors on their own thread """
+
+		self.readiness.start([("sensors", self.initSensors)])
+
+	def updateSensors(self):
+		""" Makes up the next values, yields for the simulated conversion time """
+
+		yield READ_TIME
+
+		# Fraction of the day, warmest and brightest mid afternoon
+		day = (time() % 86400.0) / 86400.0
+		cycle = math.sin(2.0 * math.pi * (day - 0.375))
+
+		temperature, humidity, pressure, lux = self.values.addValues((
+			18.0 + self.offset + 4.0 * cycle + self.random.gauss(0.0, 0.1),
+			50.0 - 10.0 * cycle + self.random.gauss(0.0, 0.5),
+			1013.0 + self.random.gauss(0.0, 0.2),
+			max(0.0, 400.0 * cycle + self.random.gauss(0.0, 5.0)),
+		))
+
+		self.currentValues.temperature, self.currentValues.humidity, self.currentValues.pressure = temperature, humidity, pressure
+		self.currentValues.lux = lux
+
+	def publishValues(self):
+		""" Publishes the current values as a new snapshot for readers """
+
+		self.publisher.publish(self.currentValues)
+
+	def getTasks(self):
+		""" The acquisition tasks for this board as (name, job, on the i2c bus) """
+
+		ready = self.readiness
+		return [
+			("sensors", ready.gate("sensors", self.updateSensors), True),
+			("publish", ready.gateSettled(self.publishValues), False),
+		]
+
+	def updateValues(self):
+		""" Performs a collection of values from supported devices """
+
+		self.readiness.wait()
+
+		for name, job, onBus in self.getTasks():
+			runJob(job)
+
+	def getChannels(self):
+		""" Describes each value as (sensor, unit, description) """
+
+		return CHANNELS
+
+	def getSnapshot(self):
+		""" Return the last published snapshot, with its encoded json """
+
+		return self.publisher.getSnapshot()
+
+	def getJSONValues(self):
+		""" Return the last published values formated as json """
+
+		return self.publisher.getSnapshot().toJSON()
@@ -20,15 +20,18 @@
 # LTR390 (als, +lux via calculation, uvs, +uvi via calculation)
 # SGP40 (voc index)
 
-# PI I2C
-from smbus import SMBus
-I2C_DEV=SMBus(1)
+# PI I2C, recorded or replayed when tracing
+from utility import trace
+I2C_DEV=trace.openBus(1)
 
 # Temperature, Humidity and Pressure
 from sensors.BME280 import BME280
 
 # Light, IR, Lux
+import python_tsl2591.sensor
 from python_tsl2591 import tsl2591
+from python_tsl2591.sensor import COMMAND_BIT, REGISTER_CHAN0_LOW, REGISTER_CHAN1_LOW
+TSL2591_SMBUS = python_tsl2591.sensor.SMBus
 
 # ALS, LUX, UV, UVI
 from sensors.LTR390 import LTR390
@@ -36,12 +39,19 @@ from sensors.LTR390 import LTR390
 # VOC Index
 from sensors.SGP40 import SGP40
 
-from utility.cbuffer import CBuffer
+from utility.filters import createFilterGroup
+from utility.readiness import Readiness
 from utility.picputemperature import PICPUTemp
+from utility.scheduler import runJob
+from utility.snapshot import SnapshotPublisher
+from utility.timings import Timings
 
 # Assuming updating at 1 sample per second this is ten seconds of samples
 SAMPLE_WINDOW_LEN = 10
 
+# Standby between BME280 measurements in normal mode (ms), with 16x oversampling a new one is ready every 240ms
+BME280_STANDBY_MS = 125
+
 # A class to describe what our json returned values will look like
 import json
 class Values:
@@ -66,12 +76,43 @@ class Values:
 	def toJSON(self):
 		return "{ \"values\" :" + json.dumps(self, default=lambda o: o.__dict__, sort_keys=False) + "}"
 
+# What each value is, (sensor, unit, description), used for /metrics
+CHANNELS = {
+	"temperature" : ("bme280", "celsius", "Temperature"),
+	"humidity" : ("bme280", "percent", "Relative humidity"),
+	"pressure" : ("bme280", "hectopascals", "Air pressure"),
+	"fullspectrum" : ("tsl2591", "counts", "Full spectrum (visible and infrared) light"),
+	"infrared" : ("tsl2591", "counts", "Infrared light"),
+	"lux1" : ("tsl2591", "lux", "Illuminance"),
+	"als" : ("ltr390", "counts", "Ambient light"),
+	"lux2" : ("ltr390", "lux", "Illuminance"),
+	"uvs" : ("ltr390", "counts", "Ultraviolet light"),
+	"uvi" : ("ltr390", "index", "UV index"),
+	"voci" : ("sgp40", "index", "VOC index, higher is worse air quality"),
+}
+
+# How each value is smoothed, see utility/filters.py
+# The VOC index can spike, outliers are rejected before it is smoothed
+FILTERS = {
+	"temperature" : "mean",
+	"humidity" : "mean",
+	"pressure" : "mean",
+	"fullspectrum" : "mean",
+	"infrared" : "mean",
+	"lux1" : "mean",
+	"als" : "mean",
+	"lux2" : "mean",
+	"uvs" : "mean",
+	"uvi" : "mean",
+	"voci" : "hampel:31+ema",
+}
+
 class WaveshareESH:
 
 	def initSGP40(self):
 
 		# Buffer for the SGP40 Stats
-		self.sgp40_voci = CBuffer(SAMPLE_WINDOW_LEN)
+		self.sgp40_values = createFilterGroup(["voci"], self.filters, SAMPLE_WINDOW_LEN)
 
 		# Values are just for initialization
 		self.sgp40 = SGP40(i2c_dev=I2C_DEV, relative_humidity = 50, temperature_c = 25)
@@ -84,10 +125,7 @@ class WaveshareESH:
 	def initLTR390(self):
 
 		# Buffers for the LTR390 Stats
-		self.ltr390_als = CBuffer(SAMPLE_WINDOW_LEN)
-		self.ltr390_lux = CBuffer(SAMPLE_WINDOW_LEN)
-		self.ltr390_uvs = CBuffer(SAMPLE_WINDOW_LEN)
-		self.ltr390_uvi = CBuffer(SAMPLE_WINDOW_LEN)
+		self.ltr390_values = createFilterGroup(["als", "lux2", "uvs", "uvi"], self.filters, SAMPLE_WINDOW_LEN)
 
 		# Create an LTR390 instance
 		self.ltr390 = LTR390(i2c_dev=I2C_DEV)
@@ -100,26 +138,28 @@ class WaveshareESH:
 		# CPU Temp
 		self.cpu_temp = PICPUTemp(SAMPLE_WINDOW_LEN)
 
-		# Buffers for BME280 stats
-		self.bme280_temps = CBuffer(SAMPLE_WINDOW_LEN)
-		self.bme280_humidity = CBuffer(SAMPLE_WINDOW_LEN)
-		self.bme280_pressure = CBuffer(SAMPLE_WINDOW_LEN)
+		# Buffers for BME280 stats, the temperature is not smoothed
+		self.bme280_values = createFilterGroup(["humidity", "pressure"], self.filters, SAMPLE_WINDOW_LEN)
 
 		# Create a BME280 instance (SMBus 1)
 		self.bme280 = BME280(i2c_dev=I2C_DEV)
-		self.bme280.setup(mode="forced", temperature_oversampling=16, pressure_oversampling=16)
+		self.bme280.setup(mode=self.bme280_mode, temperature_oversampling=16, pressure_oversampling=16, temperature_standby=BME280_STANDBY_MS)
 
 		print("BME280 Ready")
 
 	# Setup the TSL2591 Light, IR and Lux Sensor
 	def initTSL2591(self):
 
+		# The TSL2591 opens its own bus, which must be traced too, and share the bus lock
+		if trace.enabled():
+			python_tsl2591.sensor.SMBus = trace.openBus
+		else:
+			python_tsl2591.sensor.SMBus = lambda number: trace.lockBus(number, TSL2591_SMBUS(number))
+
 		self.tsl2591 = tsl2591()
 
 		# Buffers for TSL2591 stats
-		self.tsl2591_full = CBuffer(SAMPLE_WINDOW_LEN)
-		self.tsl2591_ir = CBuffer(SAMPLE_WINDOW_LEN)
-		self.tsl2591_lux = CBuffer(SAMPLE_WINDOW_LEN)
+		self.tsl2591_values = createFilterGroup(["fullspectrum", "infrared", "lux1"], self.filters, SAMPLE_WINDOW_LEN)
 
 		print("TSL2591 Ready")
 
@@ -132,75 +172,133 @@ class WaveshareESH:
 		# PI is inside a aluminium case, with very low load.
 		self.smooth_factor = smooth_factor
 
-		self.initBME280()
-		self.initTSL2591()
-		self.initLTR390()
-		self.initSGP40()
+		# Hot path latency histograms, off unless enabled
+		self.timings = Timings()
+
+		# How each value is smoothed, can be changed before begin()
+		self.filters = dict(FILTERS)
+
+		# Forced (a measurement each read) or normal (measuring continuously), can be changed before begin()
+		self.bme280_mode = "forced"
 
 		# Sensor values for formating into json
 		self.currentValues = Values()
 
-		print("Waveshare Environment Sensor HAT Ready")
+		# Published snapshots of the values, read by the REST API
+		self.publisher = SnapshotPublisher(self.currentValues)
 
-	def updateValues(self):
-		""" Performs a collection of values from supported devices """
+		# Which sensors have started, see begin()
+		self.readiness = Readiness()
+
+	def begin(self):
+		""" Starts the sensors, each on its own thread so the SGP40 warm up overlaps the others """
+
+		self.readiness.start([
+			("bme280", self.initBME280),
+			("tsl2591", self.initTSL2591),
+			("ltr390", self.initLTR390),
+			("sgp40", self.initSGP40),
+		])
+
+	def updateBME280(self):
+		""" Reads the BME280 temperature, humidity and pressure, yields while a forced measurement runs """
 
 		# Update the cpu temp which is used to smooth/adjust the bme280 temp
-		self.cpu_temp.update()
+		with self.timings.stage("bme280", "cputemp"):
+			self.cpu_temp.update()
+
+		# In forced mode a measurement is started and its datasheet time yielded, in normal mode the chip is always measuring
+		wait = self.bme280.start_measurement()
+		if wait:
+			yield wait
 
 		# BME280 lib is modified to coalesce the three calls
-		thp = self.bme280.get_thp()
+		with self.timings.stage("bme280", "read"):
+			thp = self.bme280.read_data()
 		temperature = thp[0]
-		self.bme280_humidity.addValue(thp[1])
-		humidity = self.bme280_humidity.getValue()
-		self.bme280_pressure.addValue(thp[2])
-		pressure = self.bme280_pressure.getValue()
+		humidity, pressure = self.bme280_values.addValues(thp[1:])
 		# Write current smoothed data to JSON values
 		self.currentValues.temperature, self.currentValues.humidity, self.currentValues.pressure = temperature, humidity, pressure
 
-		# TSL2591
-		fullspectrum, infrared = self.tsl2591.get_full_luminosity()
-		lux = self.tsl2591.calculate_lux(fullspectrum, infrared)
-		self.tsl2591_full.addValue(fullspectrum)
-		self.tsl2591_ir.addValue(infrared)
-		self.tsl2591_lux.addValue(lux)
+	def updateTSL2591(self):
+		""" Reads the TSL2591 light and infrared channels, yields while the ADC integrates """
+
+		# Equivalent to tsl2591.get_full_luminosity but yields the ADC wait instead of sleeping
+		self.tsl2591.enable()
+		yield 0.105 + 0.100 * self.tsl2591.integration_time
+		fullspectrum = self.tsl2591.bus.read_word_data(self.tsl2591.sender_address, COMMAND_BIT | REGISTER_CHAN0_LOW)
+		infrared = self.tsl2591.bus.read_word_data(self.tsl2591.sender_address, COMMAND_BIT | REGISTER_CHAN1_LOW)
+		self.tsl2591.disable()
+
+		with self.timings.stage("tsl2591", "lux"):
+			lux = self.tsl2591.calculate_lux(fullspectrum, infrared)
+		self.tsl2591_values.addValues((fullspectrum, infrared, lux))
 		# Write current smoothed data to JSON values
 		self.currentValues.fullspectrum, self.currentValues.infrared, self.currentValues.lux1 = fullspectrum, infrared, lux
 
-		# LTS390
-		aluu = self.ltr390.getAllValues()
+	def updateLTR390(self):
+		""" Reads the LTR390 ALS and UVS, yields after each mode switch while a sample is collected """
 
-		# Add to our buffers
-		self.ltr390_als.addValue(aluu[0])
-		self.ltr390_lux.addValue(aluu[1])
-		self.ltr390_uvs.addValue(aluu[2])
-		self.ltr390_uvi.addValue(aluu[3])
+		aluu = yield from self.ltr390.collectAllValues()
 
-		# get our smoothed values
-		als = self.ltr390_als.getValue()
-		lux = self.ltr390_lux.getValue()
-		uvs = self.ltr390_uvs.getValue()
-		uvi = self.ltr390_uvi.getValue()
+		# Add to our buffers and get our smoothed values
+		als, lux, uvs, uvi = self.ltr390_values.addValues(aluu)
 
 		self.currentValues.als, self.currentValues.lux2 = als, lux
 		self.currentValues.uvs, self.currentValues.uvi = uvs, uvi
 
-		# SGP40
+	def updateSGP40(self):
+		""" Reads the SGP40 VOC index, yields while the sensor is measuring """
 
 		# Note! - Here we set the current values for the SGP40
 		# Enables temperature and humidity compensation
-		self.sgp40.set_envparams(humidity,temperature)
-		tvoci = self.sgp40.get_voc_index()
-
-		# Add to our buffer
-		self.sgp40_voci.addValue(tvoci)
+		self.sgp40.set_envparams(self.currentValues.humidity, self.currentValues.temperature)
+		tvoci = yield from self.sgp40.collect_voc_index()
 
-		# get our smoothed value
-		voci = self.sgp40_voci.getValue()
+		# Add to our buffer and get our smoothed value
+		voci, = self.sgp40_values.addValues((tvoci,))
 
 		self.currentValues.voci = voci
 
+	def publishValues(self):
+		""" Publishes the current values as a new snapshot for readers """
+
+		self.publisher.publish(self.currentValues)
+
+	def getTasks(self):
+		""" The acquisition tasks for this board as (name, job, on the i2c bus) """
+
+		# Note - The SGP40 VOC algorithm expects to be sampled once a second
+		# Each sensor is skipped until it has started, and nothing is published until they all have and have read their values
+		# Publish runs after the sensor tasks listed before it on the same tick
+		ready = self.readiness
+		return [
+			("bme280", ready.gate("bme280", self.updateBME280), True),
+			("tsl2591", ready.gate("tsl2591", self.updateTSL2591), True),
+			("ltr390", ready.gate("ltr390", self.updateLTR390), True),
+			("sgp40", ready.gate("sgp40", self.updateSGP40), True),
+			("publish", ready.gateSettled(self.publishValues), False),
+		]
+
+	def updateValues(self):
+		""" Performs a collection of values from supported devices """
+
+		self.readiness.wait()
+
+		for name, job, onBus in self.getTasks():
+			runJob(job)
+
+	def getChannels(self):
+		""" Describes each value as (sensor, unit, description) """
+
+		return CHANNELS
+
+	def getSnapshot(self):
+		""" Return the last published snapshot, with its encoded json """
+
+		return self.publisher.getSnapshot()
+
 	def getJSONValues(self):
-		""" Return values formated as json """
+		""" Return the last published values formated as json """
 
-		return self.currentValues.toJSON()
+		return self.publisher.getSnapshot().toJSON()
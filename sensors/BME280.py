@@ -35,6 +35,22 @@ CHIP_ID = 0x60
 I2C_ADDRESS_GND = 0x76
 I2C_ADDRESS_VCC = 0x77
 
+# Maximum measurement time in ms (datasheet 9.1 and appendix B), per oversample of each
+# channel, plus the fixed start up and the pressure and humidity settling times
+MEASUREMENT_START_MS = 1.25
+MEASUREMENT_SAMPLE_MS = 2.3
+MEASUREMENT_SETTLE_MS = 0.575
+
+
+def measurement_time(temperature_oversampling, pressure_oversampling, humidity_oversampling):
+    """Maximum time in seconds a forced mode measurement takes, a channel oversampled 0 times is skipped."""
+    time_ms = MEASUREMENT_START_MS + MEASUREMENT_SAMPLE_MS * temperature_oversampling
+    if pressure_oversampling:
+        time_ms += MEASUREMENT_SAMPLE_MS * pressure_oversampling + MEASUREMENT_SETTLE_MS
+    if humidity_oversampling:
+        time_ms += MEASUREMENT_SAMPLE_MS * humidity_oversampling + MEASUREMENT_SETTLE_MS
+    return time_ms / 1000.0
+
 
 class S8Adapter(Adapter):
     """Convert unsigned 8bit integer to signed."""
@@ -102,6 +118,8 @@ class BME280Calibration():
 
         self.temperature_fine = 0
 
+        self.compute_coefficients()
+
     def set_from_namedtuple(self, value):
         # Iterate through a tuple supplied by i2cdevice
         # and copy its values into the class attributes
@@ -111,37 +129,90 @@ class BME280Calibration():
             except AttributeError:
                 pass
 
+        self.compute_coefficients()
+
+    def compute_coefficients(self):
+        """Folds the calibration into the few constants the compensation needs, call after changing a dig_ value.
+
+        The datasheet (section 8.1) floating point formulas, with the scalings and the terms
+        that only depend on the calibration multiplied out once here rather than every sample.
+        """
+        # temperature_fine = d * (t2 / 2^14) + d^2 * (t3 / 2^34), where d = raw - t1 * 16
+        self._t_offset = self.dig_t1 * 16.0
+        self._t_linear = self.dig_t2 / 16384.0
+        self._t_square = self.dig_t3 / 17179869184.0
+
+        # Pressure is a ratio of quadratics in v = temperature_fine / 2 - 64000, then a quadratic correction of it
+        self._p_offset = 1048576.0 - self.dig_p4 * 16.0
+        self._p_linear = self.dig_p5 / 8192.0
+        self._p_square = self.dig_p6 / 536870912.0
+        self._p_divisor = float(self.dig_p1)
+        self._p_divisor_linear = self.dig_p1 * self.dig_p2 / 17179869184.0
+        self._p_divisor_square = self.dig_p1 * self.dig_p3 / 9007199254740992.0
+        self._p_scale = 1.0 + self.dig_p8 / 524288.0
+        self._p_scale_square = self.dig_p9 / 34359738368.0
+        self._p_correction = self.dig_p7 / 16.0
+
+        # Humidity in v = temperature_fine - 76800
+        self._h_offset = self.dig_h4 * 64.0
+        self._h_slope = self.dig_h5 / 16384.0
+        self._h_scale = self.dig_h2 / 65536.0
+        self._h3 = self.dig_h3 / 67108864.0
+        self._h6 = self.dig_h6 / 67108864.0
+        self._h1 = self.dig_h1 / 524288.0
+
     def compensate_temperature(self, raw_temperature):
-        var1 = (raw_temperature / 16384.0 - self.dig_t1 / 1024.0) * self.dig_t2
-        var2 = raw_temperature / 131072.0 - self.dig_t1 / 8192.0
-        var2 = var2 * var2 * self.dig_t3
-        self.temperature_fine = (var1 + var2)
+        d = raw_temperature - self._t_offset
+        self.temperature_fine = d * (self._t_linear + d * self._t_square)
         return self.temperature_fine / 5120.0
 
     def compensate_pressure(self, raw_pressure):
-        var1 = self.temperature_fine / 2.0 - 64000.0
-        var2 = var1 * var1 * self.dig_p6 / 32768.0
-        var2 = var2 + var1 * self.dig_p5 * 2
-        var2 = var2 / 4.0 + self.dig_p4 * 65536.0
-        var1 = (self.dig_p3 * var1 * var1 / 524288.0 + self.dig_p2 * var1) / 524288.0
-        var1 = (1.0 + var1 / 32768.0) * self.dig_p1
-        pressure = 1048576.0 - raw_pressure
-        pressure = (pressure - var2 / 4096.0) * 6250.0 / var1
-        var1 = self.dig_p9 * pressure * pressure / 2147483648.0
-        var2 = pressure * self.dig_p8 / 32768.0
-        return pressure + (var1 + var2 + self.dig_p7) / 16.0
+        v = self.temperature_fine * 0.5 - 64000.0
+        divisor = self._p_divisor + v * (self._p_divisor_linear + v * self._p_divisor_square)
+        pressure = (self._p_offset - raw_pressure - v * (self._p_linear + v * self._p_square)) * 6250.0 / divisor
+        return pressure * (self._p_scale + pressure * self._p_scale_square) + self._p_correction
 
     def compensate_humidity(self, raw_humidity):
-        var1 = self.temperature_fine - 76800.0
-        var2 = self.dig_h4 * 64.0 + (self.dig_h5 / 16384.0) * var1
-        var3 = raw_humidity - var2
-        var4 = self.dig_h2 / 65536.0
-        var5 = 1.0 + (self.dig_h3 / 67108864.0) * var1
-        var6 = 1.0 + (self.dig_h6 / 67108864.0) * var1 * var5
-        var6 = var3 * var4 * (var5 * var6)
-
-        humidity = var6 * (1.0 - self.dig_h1 * var6 / 524288.0)
-        return max(0.0, min(100.0, humidity))
+        v = self.temperature_fine - 76800.0
+        var5 = 1.0 + self._h3 * v
+        humidity = (raw_humidity - self._h_offset - self._h_slope * v) * self._h_scale * var5 * (1.0 + self._h6 * v * var5)
+        humidity = humidity * (1.0 - self._h1 * humidity)
+        if humidity < 0.0:
+            return 0.0
+        if humidity > 100.0:
+            return 100.0
+        return humidity
+
+    def compensate_arrays(self, raw_temperature, raw_pressure, raw_humidity):
+        """Compensates arrays of raw DATA readings in one pass, e.g. a recorded log or a burst.
+
+        Returns numpy arrays of (temperature C, pressure Pa, humidity %), as the single sample
+        methods do. A pressure the calibration can not give (divide by 0) is NaN.
+        temperature_fine is left as it was.
+        """
+        import numpy
+
+        raw_temperature = numpy.asarray(raw_temperature, dtype=numpy.float64)
+        raw_pressure = numpy.asarray(raw_pressure, dtype=numpy.float64)
+        raw_humidity = numpy.asarray(raw_humidity, dtype=numpy.float64)
+
+        d = raw_temperature - self._t_offset
+        fine = d * (self._t_linear + d * self._t_square)
+        temperature = fine / 5120.0
+
+        v = fine * 0.5 - 64000.0
+        divisor = self._p_divisor + v * (self._p_divisor_linear + v * self._p_divisor_square)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            pressure = (self._p_offset - raw_pressure - v * (self._p_linear + v * self._p_square)) * 6250.0 / divisor
+        pressure[divisor == 0.0] = numpy.nan
+        pressure = pressure * (self._p_scale + pressure * self._p_scale_square) + self._p_correction
+
+        v = fine - 76800.0
+        var5 = 1.0 + self._h3 * v
+        humidity = (raw_humidity - self._h_offset - self._h_slope * v) * self._h_scale * var5 * (1.0 + self._h6 * v * var5)
+        humidity = numpy.clip(humidity * (1.0 - self._h1 * humidity), 0.0, 100.0)
+
+        return temperature, pressure, humidity
 
 
 class BME280:
@@ -203,7 +274,13 @@ class BME280:
                              1000: 0b101,
                              10: 0b110,
                              20: 0b111})),
-                BitField('filter', 0b00011100),                   # Controls the time constant of the IIR filter
+                BitField('filter', 0b00011100,                    # Controls the time constant of the IIR filter
+                         adapter=LookupAdapter({
+                             0: 0b000,
+                             2: 0b001,
+                             4: 0b010,
+                             8: 0b011,
+                             16: 0b100})),
                 BitField('spi3w_en', 0b0000001, read_only=True),  # Enable 3-wire SPI interface when set to 1. IE: Don't set this bit!
             )),
             Register('DATA', 0xF7, fields=(
@@ -235,7 +312,7 @@ class BME280:
             ), bit_width=7 * 8)
         ))
 
-    def setup(self, mode='normal', temperature_oversampling=16, pressure_oversampling=16, humidity_oversampling=16, temperature_standby=500):
+    def setup(self, mode='normal', temperature_oversampling=16, pressure_oversampling=16, humidity_oversampling=16, temperature_standby=500, iir_filter=4):
         if self._is_setup:
             return
         self._is_setup = True
@@ -243,6 +320,9 @@ class BME280:
         self._bme280.select_address(self._i2c_addr)
         self._mode = mode
 
+        # How long a forced measurement takes with these settings, waited for instead of polling STATUS
+        self._measurement_time = measurement_time(temperature_oversampling, pressure_oversampling, humidity_oversampling)
+
         if mode == "forced":
             mode = "sleep"
 
@@ -263,26 +343,38 @@ class BME280:
                          osrs_t=temperature_oversampling,
                          osrs_p=pressure_oversampling)
 
+        # In normal mode the chip measures continuously, every measurement time plus standby
         self._bme280.set('CONFIG',
                          t_sb=temperature_standby,
-                         filter=2)
+                         filter=iir_filter)
 
         self.calibration.set_from_namedtuple(self._bme280.get('CALIBRATION'))
         self.calibration.set_from_namedtuple(self._bme280.get('CALIBRATION2'))
 
-    def update_sensor(self):
+    def start_measurement(self):
+        """Starts a forced mode measurement, returns the seconds to wait before reading it (0 in normal mode)."""
         self.setup()
 
-        if self._mode == "forced":
-            self._bme280.set('CTRL_MEAS', mode="forced")
-            while self._bme280.get('STATUS').measuring:
-                time.sleep(0.001)
+        if self._mode != "forced":
+            return 0.0
+
+        self._bme280.set('CTRL_MEAS', mode="forced")
+        return self._measurement_time
 
+    def read_data(self):
+        """Reads and compensates the latest measurement, in normal mode the chip always has one. Returns [temperature, humidity, pressure]."""
         raw = self._bme280.get('DATA')
 
         self.temperature = self.calibration.compensate_temperature(raw.temperature)
         self.pressure = self.calibration.compensate_pressure(raw.pressure) / 100.0
         self.humidity = self.calibration.compensate_humidity(raw.humidity)
+        return [self.temperature, self.humidity, self.pressure]
+
+    def update_sensor(self):
+        wait = self.start_measurement()
+        if wait:
+            time.sleep(wait)
+        self.read_data()
 
     def get_temperature(self):
         self.update_sensor()
@@ -14,7 +14,6 @@
 #
 
 import time
-import smbus
 
 # I2C Address
 LTR390_ADDR = 0X53
@@ -200,11 +199,8 @@ class LTR390:
 
 		return (uv/LTS390_UVSensitivity) * self.wfact
 
-	def getAllValues(self):
-		""" Returns all values from an ALS read and UVS read.
-		Internallly waits after each mode switch to give time to collect
-		a valid sample reading.
-		"""
+	def getSampleTime(self):
+		""" The time to wait after a mode switch for a valid sample to be collected """
 
 		# tSleep is adjusted "based" on the collection time in the data sheet
 		tSleep = 0.125 * MEAS_RATE.getIntFactor(self.res)
@@ -213,16 +209,41 @@ class LTR390:
 		if tSleep <0.1:
 			tSleep = 0.1;
 
+		return tSleep
+
+	def collectAllValues(self):
+		""" Generator version of getAllValues.
+		Yields the time to wait after each mode switch instead of sleeping,
+		so the caller can use the bus for something else in the meantime.
+		Returns the same values as getAllValues.
+		"""
+
+		tSleep = self.getSampleTime()
+
 		# Analogue Light
 		self.modeALS()
-		time.sleep(tSleep)
+		yield tSleep
 		als = self.readALS()
 		lux = self.calcLUX(als)
 
 		# Ultra-violet
 		self.modeUVS()
-		time.sleep(tSleep)
+		yield tSleep
 		uvs = self.readUVS()
 		uvi = self.calcUVI(uvs)
 
 		return als, lux, uvs, uvi
+
+	def getAllValues(self):
+		""" Returns all values from an ALS read and UVS read.
+		Internallly waits after each mode switch to give time to collect
+		a valid sample reading.
+		"""
+
+		collector = self.collectAllValues()
+
+		try:
+			while True:
+				time.sleep(next(collector))
+		except StopIteration as done:
+			return done.value
@@ -26,8 +26,12 @@
 
 import time
 import atexit
+import importlib
 import ads1015
-import RPi.GPIO as GPIO
+from utility.trace import openBus, openDevice
+
+# The heater pin, recorded or replayed when tracing
+GPIO = openDevice("gpio", lambda: importlib.import_module("RPi.GPIO"))
 
 MICS6814_HEATER_PIN = 24
 MICS6814_GAIN = 6.144
@@ -70,7 +74,7 @@ def setup():
         return
     _is_setup = True
 
-    adc = ads1015.ADS1015(i2c_addr=0x49)
+    adc = ads1015.ADS1015(i2c_addr=0x49, i2c_dev=openBus(1))
     adc.set_mode('single')
     adc.set_programmable_gain(MICS6814_GAIN)
     adc.set_sample_rate(1600)
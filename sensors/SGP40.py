@@ -21,7 +21,6 @@
 # SOFTWARE.
 #
 
-import smbus
 import time
 from sensors.SGP40_VOC import Sensirion_VOCAlgorithm
 
@@ -89,22 +88,44 @@ class SGP40:
             self.get_voc_index()
         return self.__measure_test()
 
-    def measure_raw(self):
-        """ Get raw data
+    def collect_raw(self):
+        """ Generator version of measure_raw
 
-        : return int collect result
-          :-1 collect failed
-          :>0 the collection value
+        Yields the measurement duration instead of sleeping, so the caller
+        can use the bus while the sensor is measuring.
+        : return int collect result, as measure_raw
         """
         self.__data_transform()
         self.__i2cbus.write_i2c_block_data(self.__i2c_addr,self.CMD_MEASURE_RAW_H, [self.CMD_MEASURE_RAW_L,self.__rh_h,self.__rh_l,self.__rh__crc,self.__temc_h,self.__temc_l,self.__temc__crc])
-        time.sleep(self.DURATION_READ_RAW_VOC)
+        yield self.DURATION_READ_RAW_VOC
         raw = self.__i2cbus.read_i2c_block_data(self.__i2c_addr,self.OFFSET,3)
         if self.__check__crc(raw) == 0:
           return raw[0]<<8 | raw[1]
         else:
           return -1
 
+    def measure_raw(self):
+        """ Get raw data
+
+        : return int collect result
+          :-1 collect failed
+          :>0 the collection value
+        """
+        return self.__run(self.collect_raw())
+
+    def collect_voc_index(self):
+        """ Generator version of get_voc_index
+
+        Yields the measurement duration instead of sleeping.
+        :return int The VOC index measured, as get_voc_index
+        """
+        raw = yield from self.collect_raw()
+        if raw<0:
+            return -1
+        else:
+            vocIndex = self.__my_vocalgorithm.vocalgorithm_process(raw)
+            return vocIndex
+
     def get_voc_index(self):
         """ Measure VOC index after humidity compensation
         :note  VOC index can indicate the quality of the air directly. The larger the value, the worse the air quality.
@@ -114,12 +135,18 @@ class SGP40:
         :note    00-500,ventilate, purify intensely
         :return int The VOC index measured, ranged from 0 to 500
         """
-        raw = self.measure_raw()
-        if raw<0:
-            return -1
-        else:
-            vocIndex = self.__my_vocalgorithm.vocalgorithm_process(raw)
-            return vocIndex
+        return self.__run(self.collect_voc_index())
+
+    def __run(self, collector):
+        """ Runs a collect_ generator to completion, sleeping for each wait it yields
+
+        :return the generator result
+        """
+        try:
+            while True:
+                time.sleep(next(collector))
+        except StopIteration as done:
+            return done.value
 
     def __data_transform(self):
         """ Convert environment parameters
@@ -0,0 +1,84 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# The tests import the modules as SensorMon does, from the top of the repository
+# Run with python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import json
+import socket
+import subprocess
+import urllib.error
+import urllib.request
+from time import monotonic, sleep
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def freePort():
+
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+def waitUntilReady(url, process, timeout=30.0):
+
+	deadline = monotonic() + timeout
+	while monotonic() < deadline:
+		if process.poll() is not None:
+			raise RuntimeError("SensorMon exited with " + str(process.returncode))
+		try:
+			with urllib.request.urlopen(url + "/ready", timeout=1.0) as response:
+				if json.load(response)["ready"]:
+					return
+		except (urllib.error.URLError, OSError, ValueError):
+			pass
+		sleep(0.1)
+
+	raise RuntimeError("SensorMon at " + url + " was not ready in " + str(timeout) + "s")
+
+@pytest.fixture
+def simulatedNode():
+	""" Starts SensorMon on the Simulated board on a free local port, returns its URL once ready """
+
+	processes = []
+
+	def start(*arguments, ready=True):
+		port = freePort()
+		process = subprocess.Popen(
+			[sys.executable, "SensorMon.py", "-boardname", "Simulated", "-host", "127.0.0.1", "-port", str(port)] + list(arguments),
+			cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		processes.append(process)
+
+		url = "http://127.0.0.1:" + str(port)
+		if ready:
+			waitUntilReady(url, process)
+
+		return url
+
+	yield start
+
+	for process in processes:
+		process.terminate()
+	for process in processes:
+		try:
+			process.wait(timeout=10.0)
+		except subprocess.TimeoutExpired:
+			process.kill()
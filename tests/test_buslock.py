@@ -0,0 +1,90 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Sensor inits and the bus worker share an i2c bus, each call holds the bus lock
+
+import threading
+from time import sleep
+
+from utility import trace
+from utility.readiness import Readiness
+from utility.scheduler import AcquisitionScheduler
+
+class Bus:
+	""" As smbus, the address is set on the handle then the transfer made, and each device answers its own address """
+
+	def __init__(self):
+
+		self.address = None
+		self.devices = {}
+		self.wrong = 0
+
+	def read_byte_data(self, address, register):
+
+		self.address = address
+		# Time for another thread to set its address on the handle
+		sleep(0.0001)
+		if self.address != address:
+			self.wrong = self.wrong + 1
+
+		return self.devices.get(self.address, 0)
+
+def hammer(bus, address, value, count):
+	""" A sensor's init, each read should be from its own device """
+
+	def init():
+		for n in range(count):
+			if bus.read_byte_data(address, 0) != value:
+				raise IOError("read another device")
+
+	return init
+
+def testHandlesOnABusShareItsLock():
+
+	first = trace.lockBus(7, Bus())
+	second = trace.lockBus(7, Bus())
+	other = trace.lockBus(8, Bus())
+
+	assert first._lock is second._lock
+	assert first._lock is not other._lock
+
+def testInitsAndTheBusWorkerNeverMixCalls():
+
+	raw = Bus()
+	raw.devices = {0x29: 1, 0x53: 2, 0x59: 3, 0x76: 4}
+	bus = trace.lockBus(9, raw)
+
+	# Three sensors starting while a ready one is read on the bus worker
+	readiness = Readiness()
+	readiness.start([
+		("tsl2591", hammer(bus, 0x29, 1, 200)),
+		("ltr390", hammer(bus, 0x53, 2, 200)),
+		("sgp40", hammer(bus, 0x59, 3, 200)),
+	])
+
+	reads = []
+	def read():
+		reads.append(bus.read_byte_data(0x76, 0))
+
+	scheduler = AcquisitionScheduler()
+	scheduler.addTask("bme280", 0.001, read, True)
+	scheduler.start()
+	readiness.wait(10.0)
+	scheduler.stop()
+
+	assert readiness.toDict()["tsl2591"]["state"] == "ready"
+	assert all(readiness.isReady(name) for name in ("tsl2591", "ltr390", "sgp40"))
+	assert reads and all(value == 4 for value in reads)
+	assert raw.wrong == 0
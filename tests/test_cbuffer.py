@@ -0,0 +1,56 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# The smoothing buffer, short windows as a list and long ones as a ring with a running sum
+
+import math
+import random
+
+from utility.cbuffer import CBuffer, ShortCBuffer, SHORT_WINDOW_LEN
+
+def testShortWindowsAreAList():
+
+	assert type(CBuffer(10)) is ShortCBuffer
+	assert type(CBuffer(SHORT_WINDOW_LEN)) is ShortCBuffer
+	assert type(CBuffer(SHORT_WINDOW_LEN + 1)) is CBuffer
+	assert isinstance(CBuffer(10), CBuffer)
+
+def testBothAreTheMeanOfTheWindow():
+
+	for length in (1, 10, SHORT_WINDOW_LEN, SHORT_WINDOW_LEN + 1, 500):
+		buffer = CBuffer(length)
+		samples = []
+		generator = random.Random(length)
+
+		for n in range(3 * length + 7):
+			sample = generator.gauss(20.0, 5.0)
+			buffer.addValue(sample)
+			samples = (samples + [sample])[-length:]
+			assert math.isclose(buffer.getValue(), math.fsum(samples) / len(samples), rel_tol=1e-12)
+
+def testNonFiniteSamplesLeaveWithTheWindow():
+
+	for length in (10, SHORT_WINDOW_LEN + 1):
+		buffer = CBuffer(length)
+		for n in range(length):
+			buffer.addValue(1.0)
+
+		buffer.addValue(float("nan"))
+		for n in range(length - 1):
+			assert math.isnan(buffer.getValue())
+			buffer.addValue(2.0)
+
+		buffer.addValue(2.0)
+		assert buffer.getValue() == 2.0
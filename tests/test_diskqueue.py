@@ -0,0 +1,135 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# The on disk queue exporters spill to while their sink is down
+
+import os
+import threading
+
+from utility.diskqueue import DiskQueue
+
+def records(first, count):
+	return [b"record %d" % n for n in range(first, first + count)]
+
+def testPeekReturnsTheOldestBatchesUntilAcked(tmp_path):
+
+	queue = DiskQueue(str(tmp_path))
+	assert queue.empty()
+
+	queue.put(records(0, 3))
+	queue.put(records(3, 3))
+	queue.put(records(6, 3))
+	assert queue.count() == 9
+
+	# Whole batches, up to about the records asked for
+	batch, token = queue.peek(6)
+	assert batch == records(0, 6)
+
+	# Read again until acked
+	assert queue.peek(6)[0] == batch
+	queue.ack(token)
+	assert queue.count() == 3
+	assert queue.peek(100)[0] == records(6, 3)
+
+	# At least one batch however few are asked for
+	assert queue.peek(1)[0] == records(6, 3)
+
+def testBatchesSurviveReopening(tmp_path):
+
+	queue = DiskQueue(str(tmp_path))
+	queue.put(records(0, 2))
+	queue.put(records(2, 2))
+	queue.ack(queue.peek(2)[1])
+
+	queue = DiskQueue(str(tmp_path))
+	assert queue.count() == 2
+	assert queue.peek(10)[0] == records(2, 2)
+
+	# New batches go after those already there
+	queue.put(records(4, 2))
+	assert queue.peek(10)[0] == records(2, 4)
+
+def testOldestBatchesAreDroppedOverTheLimit(tmp_path):
+
+	queue = DiskQueue(str(tmp_path), maxBytes=200)
+	for n in range(10):
+		queue.put(records(n * 4, 4))
+
+	assert queue.size <= 200
+	assert queue.dropped > 0
+	assert queue.count() + queue.dropped == 40
+	assert len(os.listdir(str(tmp_path))) == len(queue.batches)
+
+	# The newest are kept, in order
+	kept = queue.peek(100)[0]
+	assert kept == records(40 - len(kept), len(kept))
+
+	# The batch just written is kept however big
+	queue.put([b"x" * 1000])
+	assert queue.peek(100)[0] == [b"x" * 1000]
+
+def testAckOfEvictedBatchesIsHarmless(tmp_path):
+
+	queue = DiskQueue(str(tmp_path), maxBytes=100)
+	queue.put(records(0, 4))
+	batch, token = queue.peek(10)
+
+	# Evicted while being sent
+	queue.put(records(4, 4))
+	queue.put(records(8, 4))
+	queue.ack(token)
+
+	assert queue.peek(10)[0] == records(8, 4)
+
+def testMissingBatchIsSkipped(tmp_path):
+
+	queue = DiskQueue(str(tmp_path))
+	queue.put(records(0, 2))
+	queue.put(records(2, 2))
+	os.remove(queue.filename(queue.batches[0][0]))
+
+	batch, token = queue.peek(10)
+	assert batch == records(2, 2)
+	assert queue.dropped == 2
+
+	# The missing batch goes with the ack
+	queue.ack(token)
+	assert queue.empty()
+
+def testPeekWhilePutsEvict(tmp_path):
+
+	queue = DiskQueue(str(tmp_path), maxBytes=500)
+	errors = []
+	stop = threading.Event()
+
+	def reader():
+		try:
+			while not stop.is_set():
+				batch, token = queue.peek(8)
+				# Whole batches of 4, in order
+				assert len(batch) % 4 == 0
+				assert all(int(a.split()[1]) + 1 == int(b.split()[1]) for a, b in zip(batch, batch[1:]))
+		except Exception as e:
+			errors.append(e)
+
+	thread = threading.Thread(target=reader)
+	thread.start()
+	for n in range(2000):
+		queue.put(records(n * 4, 4))
+	stop.set()
+	thread.join()
+
+	assert errors == []
+	assert queue.dropped > 0
@@ -0,0 +1,171 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Exporting to a local stand in for InfluxDB, through outages and a failing disk queue
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+import pytest
+
+import utility.exporters
+from utility.diskqueue import DiskQueue
+from utility.exporters import Exporter, InfluxSink
+from utility.snapshot import Snapshot
+
+class Influx(BaseHTTPRequestHandler):
+	""" Keeps the lines written, or answers 503 while down """
+
+	def do_POST(self):
+
+		body = self.rfile.read(int(self.headers["Content-Length"]))
+		self.server.posts.append(body)
+
+		if self.server.down:
+			self.send_response(503)
+		else:
+			self.server.lines.extend(body.split(b"\n"))
+			self.send_response(204)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		pass
+
+@pytest.fixture
+def influx():
+
+	server = ThreadingHTTPServer(("127.0.0.1", 0), Influx)
+	server.lines = []
+	server.posts = []
+	server.down = False
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+
+	yield server
+
+	server.shutdown()
+	server.server_close()
+
+@pytest.fixture(autouse=True)
+def quickRetries(monkeypatch):
+	monkeypatch.setattr(utility.exporters, "RETRY_MIN", 0.05)
+	monkeypatch.setattr(utility.exporters, "RETRY_MAX", 0.2)
+
+def createExporter(influx, spool):
+
+	url = "http://127.0.0.1:%d/api/v2/write?org=home&bucket=sensors" % influx.server_address[1]
+
+	return Exporter("influx0", InfluxSink(url, "test", timeout=2.0), spool, batchSize=5, interval=0.05)
+
+def publish(exporter, first, count):
+
+	for n in range(first, first + count):
+		exporter.append(Snapshot({"temperature": float(n)}, 0, 1000.0 + n))
+
+def temperatures(influx):
+	return [float(line.split()[1].split(b"=")[1]) for line in influx.lines]
+
+def waitFor(condition, timeout=5.0):
+
+	deadline = monotonic() + timeout
+	while not condition():
+		assert monotonic() < deadline
+		sleep(0.01)
+
+def testValuesArriveInOrderThroughAnOutage(influx, tmp_path):
+
+	exporter = createExporter(influx, DiskQueue(str(tmp_path)))
+	exporter.start()
+
+	publish(exporter, 0, 10)
+	waitFor(lambda: len(influx.lines) == 10)
+
+	# Spooled while down, then drained ahead of anything newer
+	influx.down = True
+	publish(exporter, 10, 10)
+	waitFor(lambda: exporter.spilled >= 10)
+	influx.down = False
+	publish(exporter, 20, 10)
+	waitFor(lambda: len(influx.lines) == 30)
+
+	exporter.stop()
+
+	assert temperatures(influx) == [float(n) for n in range(30)]
+	assert exporter.failures > 0
+	assert exporter.spool.empty()
+
+class FailingSpool(DiskQueue):
+	""" A disk queue on a disk that fails, until it is fixed """
+
+	def __init__(self, path):
+		super().__init__(path)
+		self.broken = True
+
+	def put(self, records):
+		if self.broken:
+			raise OSError(28, "No space left on device")
+		super().put(records)
+
+	def peek(self, maxRecords):
+		if self.broken:
+			raise OSError(5, "Input/output error")
+		return super().peek(maxRecords)
+
+def testExporterOutlivesAFailingDiskQueue(influx, tmp_path):
+
+	spool = FailingSpool(str(tmp_path))
+	spool.broken = False
+	exporter = createExporter(influx, spool)
+	exporter.start()
+
+	# The sink down and the spool failing, the batches in hand are lost but the thread carries on
+	influx.down = True
+	spool.broken = True
+	publish(exporter, 0, 10)
+	waitFor(lambda: exporter.lost > 0)
+	assert exporter.thread.is_alive()
+
+	# Both back, exporting again
+	spool.broken = False
+	influx.down = False
+	publish(exporter, 10, 5)
+	waitFor(lambda: 14.0 in temperatures(influx))
+
+	exporter.stop()
+
+	assert temperatures(influx)[-5:] == [10.0, 11.0, 12.0, 13.0, 14.0]
+
+def testUnreadableSpooledBatchesAreNotSent(influx, tmp_path):
+
+	# A spooled batch whose file has gone, read back as no records
+	spool = DiskQueue(str(tmp_path))
+	spool.put([b"sensors temperature=1.0 1000000000000"])
+	os.remove(spool.filename(0))
+
+	exporter = createExporter(influx, spool)
+	exporter.start()
+	waitFor(spool.empty)
+
+	publish(exporter, 0, 5)
+	waitFor(lambda: len(influx.lines) == 5)
+
+	exporter.stop()
+
+	assert b"" not in influx.posts
+	assert spool.empty() and spool.dropped == 1
+	assert temperatures(influx) == [0.0, 1.0, 2.0, 3.0, 4.0]
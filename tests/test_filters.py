@@ -0,0 +1,59 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+
+# The filters a sensor's values are smoothed with, added together
+
+import math
+import random
+
+from utility.cbuffer import CBuffer
+from utility.filters import createFilter, createFilterGroup
+
+WINDOW = 10
+
+def testGroupsAreTheMeansOfEachValue():
+
+	group = createFilterGroup(["a", "b", "c"], {}, WINDOW)
+	buffers = [CBuffer(WINDOW) for n in range(3)]
+	generator = random.Random(3)
+
+	for sample in range(5 * WINDOW):
+		row = [generator.gauss(20.0, 5.0) for n in range(3)]
+		if sample == 2 * WINDOW:
+			row[0] = float("nan")
+
+		smoothed = group.addValues(row)
+
+		for value, buffer, result in zip(row, buffers, smoothed):
+			buffer.addValue(value)
+			expected = buffer.getValue()
+			assert (math.isnan(expected) and math.isnan(result)) or result == expected
+
+def testGroupsKeepEachValuesFilter():
+
+	group = createFilterGroup(["a", "b"], {"b": "median:5"}, WINDOW)
+	median = createFilter("median:5", WINDOW)
+
+	for sample in [1.0, 9.0, 2.0, 8.0, 3.0, 100.0]:
+		smoothed = group.addValues([sample, sample])
+		median.addValue(sample)
+		assert smoothed[1] == median.getValue()
+
+def testSimulatedValuesAreAllSmoothed():
+
+	from boards.simulated import CHANNELS, FILTERS
+
+	assert set(FILTERS) == set(CHANNELS)
@@ -0,0 +1,148 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+
+# The fleet collector, polling simulated nodes and one that never answers
+
+import asyncio
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+from time import monotonic, sleep
+
+import pytest
+
+from utility.fleet import FleetCollector
+
+@pytest.fixture
+def silentNode():
+	""" A node that accepts connections and never answers, returns its URL """
+
+	listener = socket.socket()
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(8)
+	connections = []
+
+	def accept():
+		while True:
+			try:
+				connections.append(listener.accept()[0])
+			except OSError:
+				return
+
+	threading.Thread(target=accept, daemon=True).start()
+
+	yield "http://127.0.0.1:" + str(listener.getsockname()[1])
+
+	listener.close()
+	for connection in connections:
+		connection.close()
+
+def waitFor(check, timeout=30.0):
+
+	deadline = monotonic() + timeout
+	while monotonic() < deadline:
+		if check():
+			return
+		sleep(0.1)
+
+	raise AssertionError("Timed out waiting")
+
+def testCollectorPollsNodesWithKeepAliveAndETags(simulatedNode, silentNode, monkeypatch):
+
+	# Publishing every 5s so most polls find the values unchanged
+	urls = [simulatedNode("-cadence", "publish=5"), simulatedNode("-cadence", "publish=5")]
+
+	# Until their first publish the nodes answer 503, after which a poll starts a new connection
+	for url in urls:
+		urllib.request.urlopen(url + "/values?since=0&wait=10", timeout=15.0).close()
+
+	# Connections opened to each node
+	opened = {}
+	openConnection = asyncio.open_connection
+	async def counting(host, port, *arguments, **keywords):
+		opened[port] = opened.get(port, 0) + 1
+		return await openConnection(host, port, *arguments, **keywords)
+	monkeypatch.setattr(asyncio, "open_connection", counting)
+
+	collector = FleetCollector(urls + [silentNode], period=0.5, timeout=0.3)
+	collector.start()
+	try:
+		nodes = collector.nodes[:2]
+		waitFor(lambda: all(node.ok and node.notModified >= 3 for node in nodes) and collector.nodes[2].failures >= 1)
+
+		document = json.loads(collector.getValues())
+	finally:
+		collector.stop()
+
+	assert document["healthy"] == 2
+
+	for node in nodes:
+		status = document["nodes"][node.name]
+		assert status["ok"] and status["error"] is None
+		assert status["age"] is not None and status["age"] < 5.0
+
+		# The node's own values, spliced in as sent
+		assert status["snapshot"] == json.loads(node.body)
+		assert status["snapshot"]["sequence"] == status["sequence"] >= 1
+
+		# Unchanged values are a 304, and every poll used the one connection
+		assert node.notModified >= 3
+		assert opened[node.port] == 1
+
+	silent = collector.nodes[2]
+	status = document["nodes"][silent.name]
+	assert not status["ok"]
+	assert status["error"] == "Timed out"
+	assert status["snapshot"] is None and status["age"] is None
+
+	# Every poll failed, but for one that may be in flight
+	assert status["failures"] >= 1 and status["polls"] - status["failures"] <= 1
+
+	# Each poll gave up at its own timeout, and did not hold up the other nodes
+	assert 0.3 <= status["latency"] < 1.0
+	assert all(node.polls > 1 for node in nodes)
+
+def testCollectorServesTheMergedValues(simulatedNode, silentNode):
+
+	urls = [simulatedNode(), simulatedNode(), simulatedNode()]
+
+	# The collector's own -boardname is not used
+	collector = simulatedNode("-collector", ",".join(urls + [silentNode]), "-pollperiod", "0.5", "-polltimeout", "0.3", ready=False)
+
+	def merged():
+		try:
+			with urllib.request.urlopen(collector + "/fleet/values", timeout=5.0) as response:
+				return json.load(response)
+		except (urllib.error.URLError, OSError):
+			return None
+
+	def polled(document):
+		return document is not None and document["healthy"] == 3 and document["nodes"][silentNode.split("://")[1]]["failures"] >= 1
+
+	waitFor(lambda: polled(merged()))
+
+	document = merged()
+	assert len(document["nodes"]) == 4
+
+	for url in urls:
+		status = document["nodes"][url.split("://")[1]]
+		assert status["url"] == url and status["ok"]
+		assert status["snapshot"]["values"]["pressure"] > 900.0
+
+	status = document["nodes"][silentNode.split("://")[1]]
+	assert not status["ok"] and status["error"] == "Timed out" and status["snapshot"] is None
@@ -0,0 +1,54 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# No value gauges are exported before the values have been read
+
+import urllib.request
+from time import sleep
+
+from utility.metrics import MetricsExporter
+from utility.snapshot import Snapshot
+
+CHANNELS = {"temperature": ("bme280", "celsius", "Temperature")}
+
+def testNothingIsExportedBeforeThePublish():
+
+	metrics = MetricsExporter("test", CHANNELS)
+	assert metrics.getMetrics() == b""
+
+def testValueGaugesWaitForThePublishedValues():
+
+	metrics = MetricsExporter("test", CHANNELS)
+
+	# The placeholder values the board starts with
+	assert b"sensormon_temperature_celsius" not in metrics.render(Snapshot({"temperature": 0.0}, 0, 0.0))
+
+	metrics.publish(Snapshot({"temperature": 21.5}, 1, 1000.0))
+	assert b"sensormon_temperature_celsius{board=\"test\",sensor=\"bme280\"} 21.5" in metrics.getMetrics()
+
+def testNodeExportsNoValuesWhileWarmingUp(simulatedNode):
+
+	# The simulated sensors take half a second to start, publishing every 5 seconds
+	url = simulatedNode("-cadence", "publish=5", ready=False)
+
+	for attempt in range(100):
+		try:
+			with urllib.request.urlopen(url + "/metrics", timeout=1.0) as response:
+				body = response.read()
+			break
+		except OSError:
+			sleep(0.1)
+
+	assert b"sensormon_temperature_celsius" not in body
@@ -0,0 +1,112 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Publishing runs after the sensor reads of the same tick, and never before a sensor has read
+
+from time import sleep
+
+from utility.readiness import Readiness
+from utility.scheduler import AcquisitionScheduler
+
+def runFor(scheduler, seconds):
+
+	scheduler.start()
+	sleep(seconds)
+	scheduler.stop()
+
+def testPublishRunsAfterTheSensorsOfTheSameTick():
+
+	events = []
+
+	def sensor():
+		# A conversion wait, so the publish deadline comes round first
+		yield 0.02
+		events.append("sensor")
+
+	scheduler = AcquisitionScheduler()
+	scheduler.addTask("sensor", 0.1, sensor, True)
+	scheduler.addTask("publish", 0.1, lambda: events.append("publish"), False, after=["sensor"])
+	runFor(scheduler, 0.35)
+
+	assert events[:6] == ["sensor", "publish"] * 3
+
+def testPublishDoesNotWaitForSlowerTasks():
+
+	events = []
+
+	scheduler = AcquisitionScheduler()
+	scheduler.addTask("slow", 10.0, lambda: events.append("slow"), True)
+	scheduler.addTask("publish", 0.05, lambda: events.append("publish"), False, after=["slow"])
+	runFor(scheduler, 0.22)
+
+	# The slow task runs once at the start, publish keeps its own cadence
+	assert events[0] == "slow"
+	assert events.count("publish") >= 4
+
+def testAfterMustNameAnEarlierTask():
+
+	scheduler = AcquisitionScheduler()
+
+	try:
+		scheduler.addTask("publish", 1.0, lambda: None, False, after=["sensor"])
+	except ValueError:
+		return
+
+	assert False, "expected a ValueError"
+
+def testNothingIsPublishedBeforeTheSensorsHaveRead():
+
+	readiness = Readiness()
+	readiness.start([("sensor", lambda: None), ("display", lambda: None), ("broken", lambda: 1 / 0)])
+	readiness.wait()
+
+	published = []
+	sensor = readiness.gate("sensor", lambda: None)
+	display = readiness.gate("display", lambda: None, writesValues=False)
+	publish = readiness.gateSettled(lambda: published.append(True))
+
+	# Settled, but the sensor has not read yet
+	publish()
+	assert published == []
+
+	# The display and the failed sensor are not waited for
+	sensor()
+	publish()
+	assert published == [True]
+
+def testAGeneratorSensorHasReadWhenItFinishes():
+
+	readiness = Readiness()
+	readiness.start([("sensor", lambda: None)])
+	readiness.wait()
+
+	def read():
+		yield 0.0
+
+	steps = readiness.gate("sensor", read)()
+	assert not readiness.hasValues()
+
+	for wait in steps:
+		pass
+	assert readiness.hasValues()
+
+def testNothingIsPublishedWhenEverySensorFailed():
+
+	readiness = Readiness()
+	readiness.start([("broken", lambda: 1 / 0)])
+	readiness.wait()
+
+	readiness.gate("broken", lambda: None)
+	assert not readiness.hasValues()
@@ -0,0 +1,126 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# /history cache keys, a repeat is only answered from the cache if the data it covers can not have changed
+
+import json
+import urllib.request
+
+from utility.history import HistoryRing
+from utility.responsecache import historyCacheKey
+from utility.rollup import RollupTier
+from utility.snapshot import Snapshot
+
+PUBLISH_PERIOD = 1.0
+
+def filledHistory(times):
+
+	history = HistoryRing(100)
+	for timestamp in times:
+		history.append(Snapshot({"temperature": 20.0}, 0, timestamp))
+
+	return history
+
+def testRelativeRangesAreKeyedAsAskedUntilThePublish():
+
+	history = filledHistory([1000.0 + n for n in range(50)])
+	args = [("from", "-5"), ("to", "-2")]
+
+	# The same URL a moment apart, both ranges before the newest sample
+	first = historyCacheKey(args, "application/json", 1040.0, 1043.0, True, None, history, PUBLISH_PERIOD)
+	again = historyCacheKey(args, "application/json", 1040.5, 1043.5, True, None, history, PUBLISH_PERIOD)
+	assert first == again
+
+	# Never sealed, the range moves on with the next publish
+	history.append(Snapshot({"temperature": 21.0}, 0, 1050.0))
+	assert historyCacheKey(args, "application/json", 1041.0, 1044.0, True, None, history, PUBLISH_PERIOD) != first
+
+def testRelativeRollupRangesAreNeverSealed():
+
+	history = filledHistory([1000.0 + n for n in range(50)])
+	tier = RollupTier("1m", 60, 10, ["temperature"])
+	for n in range(300):
+		tier.add(600.0 + n, [20.0])
+
+	key = historyCacheKey([("from", "-300"), ("to", "-100")], "application/json", 600.0, 800.0, True, tier, history, PUBLISH_PERIOD)
+	assert key[-1] != "sealed"
+
+def testOldAbsoluteRangesAreSealed():
+
+	history = filledHistory([1000.0 + n for n in range(50)])
+	args = [("from", "1010"), ("to", "1020")]
+
+	key = historyCacheKey(args, "application/json", 1010.0, 1020.0, False, None, history, PUBLISH_PERIOD)
+	assert key[-1] == "sealed"
+
+	# New samples do not change it
+	history.append(Snapshot({"temperature": 21.0}, 0, 1050.0))
+	assert historyCacheKey(args, "application/json", 1010.0, 1020.0, False, None, history, PUBLISH_PERIOD) == key
+
+def testRangesUpToNowChangeEachPublish():
+
+	history = filledHistory([1000.0 + n for n in range(50)])
+	args = [("from", "1010")]
+
+	key = historyCacheKey(args, "application/json", 1010.0, 1060.0, False, None, history, PUBLISH_PERIOD)
+	history.append(Snapshot({"temperature": 21.0}, 0, 1050.0))
+
+	assert historyCacheKey(args, "application/json", 1010.0, 1060.0, False, None, history, PUBLISH_PERIOD) != key
+
+def testFormatsAndOtherArgumentsAreKeyedApart():
+
+	history = filledHistory([1000.0 + n for n in range(50)])
+
+	json = historyCacheKey([("channels", "temperature")], "application/json", 1010.0, 1020.0, False, None, history, PUBLISH_PERIOD)
+	cbor = historyCacheKey([("channels", "temperature")], "application/cbor", 1010.0, 1020.0, False, None, history, PUBLISH_PERIOD)
+	step = historyCacheKey([("channels", "temperature"), ("step", "5")], "application/json", 1010.0, 1020.0, False, None, history, PUBLISH_PERIOD)
+
+	assert len({json, cbor, step}) == 3
+
+def testRollupRangesBeforeTheOpenBucketAreSealed():
+
+	history = filledHistory([1000.0 + n for n in range(50)])
+	tier = RollupTier("1m", 60, 10, ["temperature"])
+	for n in range(300):
+		tier.add(600.0 + n, [20.0])
+
+	# The open bucket starts at 840
+	sealed = historyCacheKey([], "application/json", 600.0, 840.0, False, tier, history, PUBLISH_PERIOD)
+	open = historyCacheKey([], "application/json", 600.0, 900.0, False, tier, history, PUBLISH_PERIOD)
+
+	assert sealed[-1] == "sealed"
+	assert open[-1] != "sealed"
+
+def testRepeatedRelativeQueriesAreAnsweredFromTheCache(simulatedNode):
+
+	# Publishing every 5 seconds, so both requests are between publishes
+	url = simulatedNode("-cadence", "publish=5")
+
+	def get(path):
+		with urllib.request.urlopen(url + path, timeout=5.0) as response:
+			return response.read()
+
+	# A publish could fall between the two, then the next pair is
+	for attempt in range(3):
+		first = get("/history?from=-3600")
+		before = json.loads(get("/debug/timings"))["responseCache"]
+		second = get("/history?from=-3600")
+		after = json.loads(get("/debug/timings"))["responseCache"]
+		if after["hits"] == before["hits"] + 1:
+			break
+
+	assert second == first
+	assert after["hits"] == before["hits"] + 1
+	assert after["entries"] == before["entries"]
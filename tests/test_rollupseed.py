@@ -0,0 +1,109 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Rebuilding the rollup tiers from the store at startup
+
+import numpy
+
+from utility.rollup import Rollups
+from utility.snapshot import Snapshot
+from utility.tsstore import TimeSeriesStore
+
+# Long enough to hold every sample, so loading trims none of them
+TIERS = [("1m", 60, 1000), ("1h", 3600, 100)]
+
+# The samples are from 1970, kept however old they are
+RETENTION = float("inf")
+
+def snapshots(count, begin=100000.0, period=7.0):
+
+	for n in range(count):
+		# A gap in one value now and then, as when a sensor misses a read
+		humidity = float("nan") if n % 13 == 0 else 40.0 + (n % 5)
+		yield Snapshot({"temperature": 20.0 + (n % 17) * 0.25, "humidity": humidity}, 0, begin + n * period)
+
+def assertSameTiers(loaded, appended):
+
+	for tier, expected in zip(loaded.tiers, appended.tiers):
+		assert tier.count == expected.count
+		assert tier.firstTime == expected.firstTime
+		assert tier.openStart == expected.openStart
+		assert numpy.array_equal(tier.starts, expected.starts)
+		assert numpy.array_equal(tier.counts, expected.counts)
+		assert numpy.array_equal(tier.openCount, expected.openCount)
+		assert numpy.allclose(tier.sums, expected.sums)
+		assert numpy.allclose(tier.openSum, expected.openSum)
+		assert numpy.array_equal(tier.mins, expected.mins)
+		assert numpy.array_equal(tier.maxs, expected.maxs)
+
+def testStoreBlocksAreTheCommittedSamplesOldestFirst(tmp_path):
+
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=50)
+	for snapshot in snapshots(120):
+		store.append(snapshot)
+	store.commit()
+
+	blocks = list(store.blocks(100000.0 + 30 * 7.0))
+	assert len(blocks) == 3
+
+	times = numpy.concatenate([times for channels, times, data in blocks])
+	assert times[0] == 100000.0 + 30 * 7.0
+	assert len(times) == 90
+	assert (numpy.diff(times) > 0).all()
+	assert all(channels == ["temperature", "humidity"] for channels, times, data in blocks)
+
+	store.close()
+
+def testRollupsLoadedFromTheStoreMatchThoseBuiltAsPublished(tmp_path):
+
+	appended = Rollups(TIERS)
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=64)
+	for snapshot in snapshots(1500):
+		appended.append(snapshot)
+		store.append(snapshot)
+	store.commit()
+	store.close()
+
+	# As at startup, the store opened again and read back a segment at a time
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=64)
+	loaded = Rollups(TIERS)
+	channels, times, data = store.tail(1)
+	newest = times[-1]
+	for channels, times, data in store.blocks(newest - loaded.span()):
+		loaded.load(channels, times, data, newest)
+	store.close()
+
+	assert loaded.channels == appended.channels
+	assertSameTiers(loaded, appended)
+
+	# Carrying on from the store as published snapshots arrive
+	more = list(snapshots(1600))[1500:]
+	for snapshot in more:
+		appended.append(snapshot)
+		loaded.append(snapshot)
+	assertSameTiers(loaded, appended)
+
+def testLoadKeepsOnlyWhatTheTierHolds():
+
+	rollups = Rollups([("1m", 60, 10)])
+	times = numpy.arange(0.0, 3600.0, 5.0)
+	rollups.load(["temperature"], times, numpy.ones((1, len(times))))
+
+	tier = rollups.getTier("1m")
+	# Back to a bucket before the oldest the ring keeps from the newest sample, rather than the whole hour
+	assert tier.firstTime >= times[-1] - 11 * 60
+	assert tier.count == 11
+	assert tier.covers(3600.0 - 9 * 60)
+	assert not tier.covers(0.0)
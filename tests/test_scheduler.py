@@ -0,0 +1,106 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Tasks run on absolute deadlines, in deadline order, skipping those they miss
+
+from time import monotonic, sleep
+
+from utility.scheduler import AcquisitionScheduler
+
+def runFor(scheduler, seconds):
+
+	scheduler.start()
+	sleep(seconds)
+	scheduler.stop()
+
+def recorder(starts, busy=0.0):
+	""" A job recording when each run starts, then busy for a while """
+
+	def job():
+		starts.append(monotonic())
+		sleep(busy)
+
+	return job
+
+def testDeadlinesDoNotDriftWithTheReadTime():
+
+	starts = []
+
+	# Busy for most of each period, update then sleep(period) would be 0.035s later each run
+	scheduler = AcquisitionScheduler()
+	scheduler.addTask("sensor", 0.05, recorder(starts, 0.035), True)
+	runFor(scheduler, 0.52)
+
+	assert len(starts) >= 8
+	for n, began in enumerate(starts):
+		assert abs((began - starts[0]) - n * 0.05) < 0.02
+
+def testTasksRunInDeadlineOrder():
+
+	runs = []
+
+	def job(name, period):
+		count = [0]
+
+		def run():
+			runs.append((count[0] * period, name))
+			count[0] = count[0] + 1
+			sleep(0.002)
+
+		return run
+
+	scheduler = AcquisitionScheduler()
+	scheduler.addTask("fast", 0.04, job("fast", 0.04), True)
+	scheduler.addTask("slow", 0.06, job("slow", 0.06), True)
+	runFor(scheduler, 0.5)
+
+	# On the one bus worker, each run after those due before it
+	deadlines = [deadline for deadline, name in runs]
+	assert len(deadlines) >= 15
+	assert all(later >= earlier - 1e-9 for earlier, later in zip(deadlines, deadlines[1:]))
+
+	# Each at its own cadence
+	fast = [deadline for deadline, name in runs if name == "fast"]
+	slow = [deadline for deadline, name in runs if name == "slow"]
+	assert len(fast) >= len(slow) + 3
+
+def testMissedDeadlinesAreSkipped():
+
+	starts = []
+	overran = []
+
+	def job():
+		starts.append(monotonic())
+		if len(starts) == 3:
+			# Overruns by two and a bit periods
+			overran.append(True)
+			sleep(0.125)
+
+	scheduler = AcquisitionScheduler()
+	scheduler.addTask("sensor", 0.05, job, True)
+	task = scheduler.tasks[0]
+	runFor(scheduler, 0.6)
+
+	assert overran
+	assert task.missed == 2
+	assert task.overruns == 1
+
+	# No burst to catch up, the run after the overrun is on the next deadline and the rest keep to the grid
+	gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+	assert all(gap > 0.03 for gap in gaps)
+	assert abs((starts[3] - starts[0]) - 0.25) < 0.02
+	for began in starts:
+		offset = (began - starts[0]) % 0.05
+		assert min(offset, 0.05 - offset) < 0.02
@@ -0,0 +1,106 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Which of the raw history and the rollup tiers a /history query is answered from
+
+import math
+
+from utility.history import HistoryRing
+from utility.rollup import Rollups, RollupTier
+from utility.snapshot import Snapshot
+
+TIERS = [("1m", 60, 100), ("1h", 3600, 100)]
+
+def publish(listener, times):
+
+	for timestamp in times:
+		listener.append(Snapshot({"temperature": 20.0}, 0, timestamp))
+
+def testHistoryCoversOnlyBackToItsOldestSample():
+
+	history = HistoryRing(100)
+	assert not history.covers(0.0)
+
+	# Started at 1000, as after a restart
+	publish(history, [1000.0 + n for n in range(10)])
+	assert history.covers(1000.0)
+	assert history.covers(1005.0)
+	assert not history.covers(999.0)
+
+def testHistoryCoversOnceWrapped():
+
+	history = HistoryRing(10)
+	publish(history, [1000.0 + n for n in range(25)])
+
+	assert history.covers(1015.0)
+	assert not history.covers(1014.0)
+
+def testTierCoversOnlyBackToItsOldestBucket():
+
+	tier = RollupTier("1m", 60, 100, ["temperature"])
+	assert not tier.covers(0.0)
+
+	for n in range(30):
+		tier.add(6000.0 + n, [20.0])
+
+	# Only the open bucket, from 6000
+	assert tier.covers(6000.0)
+	assert tier.covers(6030.0)
+	assert not tier.covers(5990.0)
+
+	for n in range(300):
+		tier.add(6030.0 + n, [20.0])
+	assert tier.covers(6000.0)
+	assert not tier.covers(5999.0)
+
+def testTierCoversOnceWrapped():
+
+	tier = RollupTier("1m", 60, 5, ["temperature"])
+	for n in range(10 * 60):
+		tier.add(6000.0 + n, [20.0])
+
+	# 9 buckets sealed, the newest 5 kept from 6240
+	assert tier.covers(6240.0)
+	assert not tier.covers(6239.0)
+
+def testChooseTierAfterARestartFallsBackToTheStore():
+
+	rollups = Rollups(TIERS)
+	publish(rollups, [100000.0 + n for n in range(120)])
+
+	# From before the restart at 60s steps, the 1m tier only has buckets since then
+	assert rollups.chooseTier(99000.0, 60.0, -math.inf) is None
+
+def testChooseTierUsesATierThatReachesBack():
+
+	rollups = Rollups(TIERS)
+	publish(rollups, [100000.0 + n * 10 for n in range(600)])
+
+	assert rollups.chooseTier(100000.0, 60.0, -math.inf).name == "1m"
+	assert rollups.chooseTier(100000.0, 7200.0, -math.inf).name == "1h"
+
+	# Fine steps are answered from the raw values when they reach back
+	assert rollups.chooseTier(100000.0, 1.0, 100000.0) is None
+
+def testChooseTierWithoutRawPicksWhatReachesFurthest():
+
+	rollups = Rollups(TIERS)
+	publish(rollups, [100000.0 + n * 10 for n in range(600)])
+
+	# No store, and the raw history starts later than the tiers
+	assert rollups.chooseTier(50000.0, 1.0, 104000.0) is not None
+
+	# The raw history reaches further
+	assert rollups.chooseTier(50000.0, 60.0, 90000.0) is None
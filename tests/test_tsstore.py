@@ -0,0 +1,134 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# The store keeps few segments mapped, and keeps the rows of a commit that failed
+
+import os
+
+import numpy
+import pytest
+
+import utility.tsstore
+from utility.snapshot import Snapshot
+from utility.tsstore import MAPPED_SEGMENTS, Segment, TimeSeriesStore
+
+# The samples are from 1970, kept however old they are
+RETENTION = float("inf")
+
+def append(store, first, count):
+
+	for n in range(first, first + count):
+		store.append(Snapshot({"temperature": float(n), "humidity": 50.0}, 0, 1000.0 + n))
+
+def mapped(store):
+	return [segment for segment in store.segments if segment.map is not None]
+
+def testOnlyTheLastAndRecentlyReadSegmentsAreMapped(tmp_path):
+
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=10)
+	append(store, 0, 100)
+	store.commit()
+
+	assert len(store.segments) == 10
+	assert mapped(store) == [store.segments[-1]]
+
+	# Reading everything maps each in turn, keeping only the last few read
+	times, columns = store.query(["temperature"], 0.0, 2000.0)
+	assert list(columns["temperature"]) == [float(n) for n in range(100)]
+	assert len(mapped(store)) <= MAPPED_SEGMENTS + 1
+	assert store.segments[-1] in mapped(store)
+
+	store.close()
+
+	# Opened again, only the segment being written is mapped
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=10)
+	assert mapped(store) == [store.segments[-1]]
+	assert store.segments[0].start() == 1000.0
+	assert store.segments[0].end() == 1009.0
+
+	for channels, times, data in store.blocks(0.0):
+		assert len(mapped(store)) <= MAPPED_SEGMENTS + 1
+	assert list(store.tail(25)[1]) == [1000.0 + n for n in range(75, 100)]
+
+	append(store, 100, 5)
+	store.commit()
+	assert list(store.query(["temperature"], 1095.0, 2000.0)[1]["temperature"]) == [95.0, 96.0, 97.0, 98.0, 99.0, 100.0, 101.0, 102.0, 103.0, 104.0]
+
+	store.close()
+
+def testRowsOfAFailedWriteAreCommittedNextTime(tmp_path, monkeypatch):
+
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=10)
+	append(store, 0, 5)
+	store.commit()
+
+	# The card fills, partway through a group that spans two segments
+	write = Segment.write
+	def failingWrite(segment, times, rows):
+		if times[0] >= 1010.0:
+			raise OSError(28, "No space left on device")
+		write(segment, times, rows)
+
+	monkeypatch.setattr(Segment, "write", failingWrite)
+	append(store, 5, 10)
+	with pytest.raises(OSError):
+		store.commit()
+
+	# Published while the card was full
+	append(store, 15, 3)
+
+	monkeypatch.setattr(Segment, "write", write)
+	store.commit()
+
+	times, columns = store.query(["temperature"], 0.0, 2000.0)
+	assert list(columns["temperature"]) == [float(n) for n in range(18)]
+
+	store.close()
+
+def testAFailedNewSegmentIsNotLeftBehind(tmp_path, monkeypatch):
+
+	store = TimeSeriesStore(str(tmp_path), retention=RETENTION, segmentRows=10)
+	append(store, 0, 10)
+	store.commit()
+
+	class Full:
+		def __init__(self, path, mode):
+			self.file = open(path, mode)
+
+		def __enter__(self):
+			return self
+
+		def __exit__(self, *exception):
+			self.file.close()
+
+		def write(self, data):
+			self.file.write(data)
+
+		def truncate(self, size):
+			raise OSError(28, "No space left on device")
+
+	monkeypatch.setattr(utility.tsstore, "open", Full, raising=False)
+	append(store, 10, 5)
+	with pytest.raises(OSError):
+		store.commit()
+	monkeypatch.delattr(utility.tsstore, "open")
+
+	assert os.listdir(str(tmp_path)) == [os.path.basename(store.segments[0].path)]
+
+	store.commit()
+	times, columns = store.query(["temperature"], 0.0, 2000.0)
+	assert list(columns["temperature"]) == [float(n) for n in range(15)]
+
+	store.close()
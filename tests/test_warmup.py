@@ -0,0 +1,68 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# While the sensors start the REST server is up, but serves no placeholder values
+
+import json
+import urllib.error
+import urllib.request
+from time import sleep
+
+def get(url, timeout=15.0):
+	""" (status, headers, body) of a GET, waiting for the server to be listening """
+
+	for attempt in range(100):
+		try:
+			with urllib.request.urlopen(url, timeout=timeout) as response:
+				return response.status, response.headers, response.read()
+		except urllib.error.HTTPError as e:
+			return e.code, e.headers, e.read()
+		except OSError:
+			sleep(0.1)
+
+	raise RuntimeError("No answer from " + url)
+
+def testValuesAre503UntilTheFirstPublish(simulatedNode):
+
+	# Publishing every 5 seconds, the first after the sensors start is at 5s
+	url = simulatedNode("-cadence", "publish=5", ready=False)
+
+	status, headers, body = get(url + "/values")
+	assert status == 503
+	assert int(headers["Retry-After"]) >= 1
+
+	# A long poll waits for the first values
+	status, headers, body = get(url + "/values?since=0&wait=10")
+	assert status == 200
+	values = json.loads(body)
+	assert values["sequence"] >= 1
+	assert values["values"]["pressure"] > 900.0
+
+	status, headers, body = get(url + "/values")
+	assert status == 200
+
+def testStreamStartsWithTheFirstPublishedValues(simulatedNode):
+
+	url = simulatedNode("-cadence", "publish=5", ready=False)
+	get(url + "/ready")
+
+	with urllib.request.urlopen(url + "/stream", timeout=15.0) as response:
+		for line in response:
+			if line.startswith(b"data: "):
+				values = json.loads(line[len(b"data: "):])
+				break
+
+	assert values["sequence"] >= 1
+	assert values["values"]["pressure"] > 900.0
@@ -15,14 +15,109 @@
 
 # A Simple Circular Buffer Datastructure
 # To avoid having this exact code duplicated everywhere
+#
+# The samples are kept in a preallocated array, the newest overwriting the oldest, with
+# a running sum of them so adding a sample and getting the average do not depend on the
+# window length. The running sum is compensated (Neumaier) so adding and removing samples
+# for days does not drift it away from the true sum.
+#
+# Short windows (the boards smooth over 10 samples) are a ShortCBuffer, the plain list
+# summed for each average, which is quicker than the running sum until the window is a
+# few dozen samples (about 0.33us against 0.48us per add and mean at 10 here).
+
+from array import array
+
+# Longest window kept as a plain list, about where the running sum becomes quicker
+SHORT_WINDOW_LEN = 32
 
 class CBuffer:
 
+	def __new__(cls, buffer_len):
+
+		# A short window is a ShortCBuffer
+		if cls is CBuffer and buffer_len <= SHORT_WINDOW_LEN:
+			cls = ShortCBuffer
+
+		return super().__new__(cls)
+
 	def __init__(self, buffer_len):
 
 		# We generate a smoothed result using this buffer
-		self.buffer_len = buffer_len;
-		self.cbuffer = [];
+		self.buffer_len = buffer_len
+		self.cbuffer = array("d", bytes(8 * buffer_len))
+
+		# Where the next sample goes, and how many samples there are
+		self.index = 0
+		self.count = 0
+
+		# Running sum of the finite samples, and its compensation
+		self.total = 0.0
+		self.compensation = 0.0
+
+		# Samples that are NaN or infinite, which are not in the running sum
+		self.nonFinite = 0
+
+	# Appends a value
+	def addValue(self, value):
+
+		value = float(value)
+		buffer = self.cbuffer
+		index = self.index
+		total = self.total
+		compensation = self.compensation
+
+		# Remove the oldest sample from the running sum
+		# (NaN and infinity are only counted, x - x is 0 for finite x)
+		if self.count == self.buffer_len:
+			oldest = -buffer[index]
+			if oldest - oldest == 0.0:
+				newTotal = total + oldest
+				if abs(total) >= abs(oldest):
+					compensation += (total - newTotal) + oldest
+				else:
+					compensation += (oldest - newTotal) + total
+				total = newTotal
+			else:
+				self.nonFinite -= 1
+		else:
+			self.count += 1
+
+		# Add the new one, keeping the low order bits lost in the addition
+		if value - value == 0.0:
+			newTotal = total + value
+			if abs(total) >= abs(value):
+				compensation += (total - newTotal) + value
+			else:
+				compensation += (value - newTotal) + total
+			total = newTotal
+		else:
+			self.nonFinite += 1
+
+		self.total = total
+		self.compensation = compensation
+
+		# Append to the window
+		buffer[index] = value
+
+		index += 1
+		self.index = 0 if index == self.buffer_len else index
+
+	# As an average over the current buffer values
+	def getValue(self):
+
+		# A NaN or infinity in the window gives the same result as summing it
+		if self.nonFinite:
+			return sum(self.cbuffer[:self.count]) / float(self.count)
+
+		return (self.total + self.compensation) / float(self.count)
+
+class ShortCBuffer(CBuffer):
+	""" The window as a plain list, summed for each average """
+
+	def __init__(self, buffer_len):
+
+		self.buffer_len = buffer_len
+		self.cbuffer = []
 
 	# Appends a value
 	def addValue(self, value):
@@ -31,10 +126,10 @@ class CBuffer:
 		self.cbuffer.append(value)
 
 		# Remove the oldest sample
-		if (len(self.cbuffer) > self.buffer_len):
+		if len(self.cbuffer) > self.buffer_len:
 			del self.cbuffer[0]
 
 	# As an average over the current buffer values
 	def getValue(self):
 
-		return sum(self.cbuffer) / float(len(self.cbuffer))
\ No newline at end of file
+		return sum(self.cbuffer) / float(len(self.cbuffer))
@@ -0,0 +1,166 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# A bounded on disk queue of records, where exporters spill while their sink is down
+#
+# Each put is one batch file of length prefixed records, written to a temporary name
+# then renamed, so a crash leaves either the whole batch or none of it.
+# Batches are read back oldest first and deleted once they have been delivered.
+# When the queue is over its size limit the oldest batches are dropped.
+#
+# Batches are read under the lock, so a put evicting the oldest can not delete one
+# while it is being read. A batch that can not be read (e.g. removed by hand, or
+# truncated by a full disk) is skipped, and goes with the ack of the rest.
+
+import os
+import struct
+import threading
+
+BATCH_SUFFIX = ".batch"
+
+# Record count, then each record as a length and its bytes
+COUNT_FORMAT = "<I"
+LENGTH_FORMAT = "<I"
+
+class DiskQueue:
+
+	def __init__(self, path, maxBytes=64 * 1024 * 1024):
+
+		self.path = path
+		self.maxBytes = maxBytes
+
+		os.makedirs(path, exist_ok=True)
+
+		self.lock = threading.Lock()
+
+		# (sequence, bytes, records) of each batch, oldest first
+		self.batches = []
+		for name in sorted(os.listdir(path)):
+			if not name.endswith(BATCH_SUFFIX):
+				continue
+
+			filename = os.path.join(path, name)
+			try:
+				with open(filename, "rb") as f:
+					records = struct.unpack(COUNT_FORMAT, f.read(struct.calcsize(COUNT_FORMAT)))[0]
+				self.batches.append((int(name[:-len(BATCH_SUFFIX)]), os.path.getsize(filename), records))
+			except (ValueError, OSError, struct.error) as e:
+				print("Skipping spooled batch " + name + " - " + repr(e))
+
+		self.nextSequence = self.batches[-1][0] + 1 if self.batches else 0
+		self.size = sum(batch[1] for batch in self.batches)
+
+		# Stats
+		self.dropped = 0
+
+	def filename(self, sequence):
+		return os.path.join(self.path, "%020d" % sequence + BATCH_SUFFIX)
+
+	def count(self):
+		""" The number of records queued """
+
+		with self.lock:
+			return sum(batch[2] for batch in self.batches)
+
+	def empty(self):
+
+		with self.lock:
+			return not self.batches
+
+	def put(self, records):
+		""" Appends a batch of records (bytes) """
+
+		if not records:
+			return
+
+		data = [struct.pack(COUNT_FORMAT, len(records))]
+		for record in records:
+			data.append(struct.pack(LENGTH_FORMAT, len(record)))
+			data.append(record)
+		data = b"".join(data)
+
+		with self.lock:
+			sequence = self.nextSequence
+			self.nextSequence = sequence + 1
+
+			filename = self.filename(sequence)
+			with open(filename + ".tmp", "wb") as f:
+				f.write(data)
+			os.replace(filename + ".tmp", filename)
+
+			self.batches.append((sequence, len(data), len(records)))
+			self.size = self.size + len(data)
+
+			# Over the limit, drop the oldest, always keeping the batch just written
+			while self.size > self.maxBytes and len(self.batches) > 1:
+				oldest, size, count = self.batches.pop(0)
+				os.remove(self.filename(oldest))
+				self.size = self.size - size
+				self.dropped = self.dropped + count
+
+	def peek(self, maxRecords):
+		""" Reads the oldest batches, up to about maxRecords, returns (records, token) with the token for ack() """
+
+		records = []
+
+		with self.lock:
+			batches = []
+			total = 0
+			for batch in self.batches:
+				if batches and total + batch[2] > maxRecords:
+					break
+				batches.append(batch)
+				total = total + batch[2]
+
+			for sequence, size, count in batches:
+				try:
+					records.extend(self.read(sequence, count))
+				except (OSError, struct.error) as e:
+					print("Skipping spooled batch " + str(sequence) + " - " + repr(e))
+					self.dropped = self.dropped + count
+
+		return records, [batch[0] for batch in batches]
+
+	def read(self, sequence, count):
+		""" The records of a batch """
+
+		with open(self.filename(sequence), "rb") as f:
+			data = f.read()
+
+		records = []
+		offset = struct.calcsize(COUNT_FORMAT)
+		for _ in range(count):
+			length = struct.unpack_from(LENGTH_FORMAT, data, offset)[0]
+			offset = offset + struct.calcsize(LENGTH_FORMAT)
+			if offset + length > len(data):
+				raise struct.error("batch is truncated")
+			records.append(data[offset:offset + length])
+			offset = offset + length
+
+		return records
+
+	def ack(self, token):
+		""" Deletes the batches read by peek() once they are delivered """
+
+		sequences = set(token)
+
+		with self.lock:
+			for batch in [batch for batch in self.batches if batch[0] in sequences]:
+				self.batches.remove(batch)
+				self.size = self.size - batch[1]
+				try:
+					os.remove(self.filename(batch[0]))
+				except FileNotFoundError:
+					pass
@@ -0,0 +1,194 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Compact binary encodings of the values
+#
+# CBOR (RFC 8949) and MessagePack encoders for the handful of types a snapshot holds
+# (maps, lists, strings, ints, floats, bools and None), no extra packages needed.
+# Floats are written as 32 bit when that is exact and 64 bit otherwise.
+#
+# History columns are packed as little endian arrays straight from numpy, the times as
+# float64 (float32 can not hold epoch seconds to better than a couple of minutes) and
+# the values as float32, described by a layout string such as "times:f8,temperature:f4".
+
+import struct
+
+import numpy
+
+# Formats we can answer with, by mime type
+JSON_TYPE = "application/json"
+CBOR_TYPE = "application/cbor"
+MSGPACK_TYPE = "application/msgpack"
+COLUMNS_TYPE = "application/octet-stream"
+
+# ?format= names
+FORMATS = {
+	"json": JSON_TYPE,
+	"cbor": CBOR_TYPE,
+	"msgpack": MSGPACK_TYPE,
+	"f32": COLUMNS_TYPE,
+}
+
+def isFloat32(value):
+	""" True if a float survives a round trip through float32 """
+
+	return struct.unpack("<f", struct.pack("<f", value))[0] == value or value != value
+
+def cborHead(major, length):
+
+	if length < 24:
+		return bytes([(major << 5) | length])
+	if length < 0x100:
+		return bytes([(major << 5) | 24, length])
+	if length < 0x10000:
+		return bytes([(major << 5) | 25]) + struct.pack(">H", length)
+	if length < 0x100000000:
+		return bytes([(major << 5) | 26]) + struct.pack(">I", length)
+
+	return bytes([(major << 5) | 27]) + struct.pack(">Q", length)
+
+def encodeCBOR(value, out=None):
+	""" Encodes a value as CBOR bytes """
+
+	top = out is None
+	if top:
+		out = []
+
+	if value is None:
+		out.append(b"\xf6")
+	elif value is True:
+		out.append(b"\xf5")
+	elif value is False:
+		out.append(b"\xf4")
+	elif isinstance(value, int):
+		out.append(cborHead(0, value) if value >= 0 else cborHead(1, -1 - value))
+	elif isinstance(value, float):
+		out.append(b"\xfa" + struct.pack(">f", value) if isFloat32(value) else b"\xfb" + struct.pack(">d", value))
+	elif isinstance(value, str):
+		data = value.encode("utf-8")
+		out.append(cborHead(3, len(data)) + data)
+	elif isinstance(value, (bytes, bytearray)):
+		out.append(cborHead(2, len(value)) + bytes(value))
+	elif isinstance(value, (list, tuple)):
+		out.append(cborHead(4, len(value)))
+		for item in value:
+			encodeCBOR(item, out)
+	elif hasattr(value, "items"):
+		out.append(cborHead(5, len(value)))
+		for key, item in value.items():
+			encodeCBOR(key, out)
+			encodeCBOR(item, out)
+	else:
+		raise TypeError("Can not encode " + type(value).__name__ + " as CBOR")
+
+	if top:
+		return b"".join(out)
+
+def msgpackHead(fix, fixLimit, codes, length):
+	""" The header of a str, array or map: a fix type when short, else 8/16/32 bit lengths """
+
+	if length < fixLimit:
+		return bytes([fix | length])
+
+	for code, limit, fmt in codes:
+		if code is not None and length < limit:
+			return bytes([code]) + struct.pack(fmt, length)
+
+	raise ValueError("Too long to encode as MessagePack")
+
+def encodeMsgPack(value, out=None):
+	""" Encodes a value as MessagePack bytes """
+
+	top = out is None
+	if top:
+		out = []
+
+	if value is None:
+		out.append(b"\xc0")
+	elif value is True:
+		out.append(b"\xc3")
+	elif value is False:
+		out.append(b"\xc2")
+	elif isinstance(value, int):
+		if 0 <= value < 0x80:
+			out.append(bytes([value]))
+		elif -32 <= value < 0:
+			out.append(struct.pack(">b", value))
+		elif value >= 0:
+			out.append(msgpackHead(0, 0, ((0xcc, 0x100, ">B"), (0xcd, 0x10000, ">H"), (0xce, 0x100000000, ">I"), (0xcf, 0x10000000000000000, ">Q")), value))
+		else:
+			out.append(b"\xd3" + struct.pack(">q", value))
+	elif isinstance(value, float):
+		out.append(b"\xca" + struct.pack(">f", value) if isFloat32(value) else b"\xcb" + struct.pack(">d", value))
+	elif isinstance(value, str):
+		data = value.encode("utf-8")
+		out.append(msgpackHead(0xa0, 32, ((0xd9, 0x100, ">B"), (0xda, 0x10000, ">H"), (0xdb, 0x100000000, ">I")), len(data)) + data)
+	elif isinstance(value, (bytes, bytearray)):
+		out.append(msgpackHead(0xc4, 0, ((0xc4, 0x100, ">B"), (0xc5, 0x10000, ">H"), (0xc6, 0x100000000, ">I")), len(value)) + bytes(value))
+	elif isinstance(value, (list, tuple)):
+		out.append(msgpackHead(0x90, 16, ((0xdc, 0x10000, ">H"), (0xdd, 0x100000000, ">I")), len(value)))
+		for item in value:
+			encodeMsgPack(item, out)
+	elif hasattr(value, "items"):
+		out.append(msgpackHead(0x80, 16, ((0xde, 0x10000, ">H"), (0xdf, 0x100000000, ">I")), len(value)))
+		for key, item in value.items():
+			encodeMsgPack(key, out)
+			encodeMsgPack(item, out)
+	else:
+		raise TypeError("Can not encode " + type(value).__name__ + " as MessagePack")
+
+	if top:
+		return b"".join(out)
+
+def parsePrecision(text):
+	""" Parses ?precision=, either decimal places for every channel ("2") or per channel ("temperature:1,humidity:0") """
+
+	if not text:
+		return {}
+
+	if ":" not in text:
+		return {"*": int(text)}
+
+	precision = {}
+	for pair in text.split(","):
+		name, places = pair.split(":")
+		precision[name.strip()] = int(places)
+
+	return precision
+
+def quantize(columns, precision):
+	""" Rounds each channel's values to its decimal places, channels without a precision are left alone """
+
+	if not precision:
+		return columns
+
+	quantized = {}
+	for name, column in columns.items():
+		places = precision.get(name, precision.get("*"))
+		quantized[name] = column if places is None else numpy.round(column, places)
+
+	return quantized
+
+def packColumns(columns):
+	""" Packs (name, array, numpy type) columns as little endian arrays, returns (layout, bytes) """
+
+	layout = []
+	parts = []
+	for name, column, dtype in columns:
+		dtype = numpy.dtype(dtype).newbyteorder("<")
+		layout.append(name + ":" + dtype.kind + str(dtype.itemsize))
+		parts.append(numpy.ascontiguousarray(column, dtype=dtype).tobytes())
+
+	return ",".join(layout), b"".join(parts)
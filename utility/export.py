@@ -0,0 +1,71 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Streams long ranges of values out as CSV or packed columns
+#
+# The range is read one fixed length block of time at a time and each block is encoded
+# and yielded before the next is read, so however long the range only one block is
+# ever held in memory. The server sends each yielded block as a chunk.
+
+import struct
+
+import numpy
+
+from utility.encoding import packColumns
+
+# Rows read per block, about 100 KB of CSV for a board's channels
+EXPORT_BLOCK_ROWS = 4096
+
+def blocks(query, channels, start, end, step, blockSeconds):
+	""" Yields (times, columns) for each block of blockSeconds from start up to end, skipping empty blocks """
+
+	blockStart = start
+	while blockStart < end:
+		blockEnd = min(blockStart + blockSeconds, end)
+
+		times, columns = query(channels, blockStart, blockEnd, step)
+		if len(times) > 0:
+			yield times, columns
+
+		blockStart = blockEnd
+
+def formatCSVValue(value):
+	# Missing values are empty fields
+	return "" if value != value else repr(value)
+
+def exportCSV(query, channels, start, end, step, blockSeconds):
+	""" A generator of CSV text blocks, a header then a row per sample, the time first """
+
+	yield ("time," + ",".join(channels) + "\n").encode("utf-8")
+
+	for times, columns in blocks(query, channels, start, end, step, blockSeconds):
+		rows = zip(times.tolist(), *[columns[name].tolist() for name in channels])
+		yield "".join(",".join(map(formatCSVValue, row)) + "\n" for row in rows).encode("utf-8")
+
+def exportColumns(query, channels, start, end, step, blockSeconds):
+	""" A generator of packed column blocks, each the row count (uint32) then the times (float64)
+	and each channel (float32), all little endian. A block of 0 rows marks the end.
+	"""
+
+	for times, columns in blocks(query, channels, start, end, step, blockSeconds):
+		layout, body = packColumns([("times", times, "<f8")] + [(name, columns[name], "<f4") for name in channels])
+		yield struct.pack("<I", len(times)) + body
+
+	yield struct.pack("<I", 0)
+
+def columnsLayout(channels):
+	""" The layout of the packed blocks, as the X-Columns header """
+
+	return packColumns([("times", numpy.zeros(0), "<f8")] + [(name, numpy.zeros(0), "<f4") for name in channels])[0]
@@ -0,0 +1,358 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Pushes the published values to other systems (MQTT, InfluxDB, a file)
+#
+# Each exporter pairs a sink with its own thread and a small bounded queue.
+# Published snapshots are encoded once for the sink and queued, the thread sends them
+# in batches (up to batchSize records, or whatever arrived in interval seconds) over
+# one connection that is kept open.
+#
+# While the sink is failing, batches go to an on disk queue and the exporter backs off.
+# When a send works again the disk queue is drained, oldest first, in large batches.
+# If the thread can not keep up the memory queue fills, new records then go straight
+# to the disk queue so the publisher is never held up.
+# Should the disk queue itself fail (a full or missing disk) the batch in hand is lost,
+# and the thread logs it, backs off and carries on rather than ending.
+
+import http.client
+import math
+import os
+import threading
+from queue import Queue, Empty, Full
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+
+from utility.diskqueue import DiskQueue
+from utility.mqtt import MQTTClient
+
+# Seconds between retries of a failing sink, doubling up to the maximum
+RETRY_MIN = 1.0
+RETRY_MAX = 60.0
+
+# Records per send when draining the disk queue
+DRAIN_BATCH = 1000
+
+def escapeTag(text):
+	""" Escapes an InfluxDB line protocol tag key or value """
+
+	return str(text).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+def encodeLine(measurement, tags, snapshot):
+	""" Encodes a snapshot as an InfluxDB line protocol line, nanosecond timestamp """
+
+	fields = []
+	for name, value in snapshot.values.items():
+		if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+			continue
+		fields.append(escapeTag(name) + "=" + repr(float(value)))
+
+	tagText = "".join("," + escapeTag(key) + "=" + escapeTag(value) for key, value in tags)
+
+	return (measurement + tagText + " " + ",".join(fields) + " " + str(int(snapshot.timestamp * 1e9))).encode("utf-8")
+
+class InfluxSink:
+	""" InfluxDB line protocol over HTTP, e.g. http://host:8086/api/v2/write?org=home&bucket=sensors """
+
+	def __init__(self, url, boardName, token=None, timeout=10.0):
+
+		parts = urlsplit(url)
+		if parts.scheme not in ("http", "https"):
+			raise ValueError("Influx url must be http or https, got " + url)
+
+		self.scheme = parts.scheme
+		self.host = parts.hostname
+		self.port = parts.port
+		self.path = parts.path + ("?" + parts.query if parts.query else "")
+		self.timeout = timeout
+		self.tags = [("board", boardName)]
+
+		self.headers = {"Content-Type": "text/plain; charset=utf-8"}
+		if token:
+			self.headers["Authorization"] = "Token " + token
+
+		self.connection = None
+
+	def encode(self, snapshot):
+		return encodeLine("sensormon", self.tags, snapshot)
+
+	def connect(self):
+
+		if self.scheme == "https":
+			return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+
+		return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+	def post(self, body):
+
+		if self.connection is None:
+			self.connection = self.connect()
+
+		self.connection.request("POST", self.path, body=body, headers=self.headers)
+		response = self.connection.getresponse()
+		response.read()
+
+		return response
+
+	def send(self, records):
+
+		body = b"\n".join(records)
+
+		try:
+			response = self.post(body)
+		except (http.client.HTTPException, OSError):
+			# The server may have closed the kept alive connection, try once on a new one
+			self.close()
+			response = self.post(body)
+
+		if response.status == 429 or response.status >= 500:
+			raise IOError("Influx write failed " + str(response.status) + " " + response.reason)
+
+		if response.status >= 300:
+			# The server will never accept these, retrying would block everything behind them
+			print("Influx rejected " + str(len(records)) + " records " + str(response.status) + " " + response.reason)
+
+	def close(self):
+
+		if self.connection is not None:
+			self.connection.close()
+			self.connection = None
+
+class MQTTSink:
+	""" MQTT, each batch is published as one JSON array of snapshots, e.g. mqtt://host:1883/sensormon/office """
+
+	def __init__(self, url, boardName):
+
+		parts = urlsplit(url if "://" in url else "mqtt://" + url)
+
+		self.topic = parts.path.lstrip("/") or ("sensormon/" + boardName)
+		self.client = MQTTClient(parts.hostname, parts.port or 1883, clientId="sensormon-" + boardName)
+
+	def encode(self, snapshot):
+		return snapshot.json
+
+	def send(self, records):
+		self.client.publish(self.topic, b"[" + b",".join(records) + b"]")
+
+	def close(self):
+		self.client.close()
+
+class FileSink:
+	""" Appends a JSON line per snapshot to a file """
+
+	def __init__(self, path):
+
+		self.path = path
+		self.file = None
+
+	def encode(self, snapshot):
+		return snapshot.json
+
+	def send(self, records):
+
+		if self.file is None:
+			self.file = open(self.path, "ab")
+
+		self.file.write(b"\n".join(records) + b"\n")
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+def createSink(spec, boardName):
+	""" Creates a sink from kind=target, e.g. influx=http://host:8086/write?db=sensors, mqtt=host:1883/topic or file=/data/values.jsonl """
+
+	if "=" not in spec:
+		raise ValueError("Exporter should be kind=target, got " + spec)
+
+	kind, target = spec.split("=", 1)
+	kind = kind.strip().lower()
+
+	if kind == "influx":
+		return kind, InfluxSink(target, boardName, token=os.environ.get("INFLUX_TOKEN"))
+	if kind == "mqtt":
+		return kind, MQTTSink(target, boardName)
+	if kind == "file":
+		return kind, FileSink(target)
+
+	raise ValueError("Unknown exporter " + kind + ", choose from influx, mqtt or file")
+
+class Exporter:
+
+	def __init__(self, name, sink, spool, batchSize=10, interval=10.0, queueSize=1000):
+
+		self.name = name
+		self.sink = sink
+		self.spool = spool
+		self.batchSize = batchSize
+		self.interval = interval
+
+		self.pending = Queue(maxsize=queueSize)
+
+		# When a failing sink may next be tried
+		self.retryAt = 0.0
+		self.retryDelay = RETRY_MIN
+
+		self.running = False
+		self.thread = None
+
+		# Stats
+		self.sent = 0
+		self.spilled = 0
+		self.failures = 0
+		self.lost = 0
+
+	def append(self, snapshot):
+		""" Queues a snapshot to export, used as a SnapshotPublisher listener """
+
+		record = self.sink.encode(snapshot)
+
+		try:
+			self.pending.put_nowait(record)
+		except Full:
+			# Can not keep up, spill rather than hold up the publisher
+			self.spool.put([record])
+			self.spilled = self.spilled + 1
+
+	def collect(self):
+		""" Waits for the next batch, up to batchSize records or whatever arrives within interval """
+
+		batch = []
+		deadline = monotonic() + self.interval
+
+		while len(batch) < self.batchSize:
+			remaining = deadline - monotonic()
+			if remaining <= 0 or not self.running:
+				break
+			try:
+				batch.append(self.pending.get(timeout=min(remaining, 0.5)))
+			except Empty:
+				pass
+
+		return batch
+
+	def failed(self, e):
+
+		self.failures = self.failures + 1
+		print("Exporter " + self.name + " failed, retrying in " + str(self.retryDelay) + "s - " + repr(e))
+
+		self.retryAt = monotonic() + self.retryDelay
+		self.retryDelay = min(self.retryDelay * 2, RETRY_MAX)
+
+	def deliver(self, batch):
+		""" Sends a batch, spilling it to the disk queue if the sink is down or behind """
+
+		# Keep the order, anything new waits behind what is already spooled
+		if monotonic() < self.retryAt or not self.spool.empty():
+			self.spool.put(batch)
+			self.spilled = self.spilled + len(batch)
+			return
+
+		try:
+			self.sink.send(batch)
+			self.sent = self.sent + len(batch)
+			self.retryDelay = RETRY_MIN
+		except Exception as e:
+			self.failed(e)
+			self.spool.put(batch)
+			self.spilled = self.spilled + len(batch)
+
+	def drain(self):
+		""" Sends the spooled records in bulk, oldest first, until empty or the sink fails """
+
+		while self.running and not self.spool.empty() and monotonic() >= self.retryAt:
+			records, token = self.spool.peek(DRAIN_BATCH)
+
+			# Only batches that could not be read, already counted as dropped by the spool
+			if not records:
+				self.spool.ack(token)
+				continue
+
+			try:
+				self.sink.send(records)
+			except Exception as e:
+				self.failed(e)
+				return
+
+			self.spool.ack(token)
+			self.sent = self.sent + len(records)
+			self.retryDelay = RETRY_MIN
+
+	def backOff(self):
+		""" Waits until a failing sink may be tried again, or the exporter is stopped """
+
+		while self.running and monotonic() < self.retryAt:
+			sleep(min(self.retryAt - monotonic(), 0.5))
+
+	def run(self):
+
+		while self.running:
+			batch = []
+			try:
+				batch = self.collect()
+				if batch:
+					self.deliver(batch)
+					# Sent or spooled, no longer ours to lose
+					batch = []
+				self.drain()
+			except Exception as e:
+				# Most likely the disk queue, an exporter thread that ends would silently stop exporting
+				self.lost = self.lost + len(batch)
+				self.failed(e)
+				self.backOff()
+
+		# Anything left goes to the disk queue, to be sent next time
+		batch = []
+		while True:
+			try:
+				batch.append(self.pending.get_nowait())
+			except Empty:
+				break
+		try:
+			self.spool.put(batch)
+		except Exception as e:
+			print("Exporter " + self.name + " lost " + str(len(batch)) + " values on stopping - " + repr(e))
+
+		self.sink.close()
+
+	def start(self):
+
+		self.running = True
+		self.thread = threading.Thread(None, self.run, name="export-" + self.name, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+
+		if not self.running:
+			return
+
+		self.running = False
+		self.thread.join()
+
+def createExporters(specs, boardName, spoolPath, batchSize=10, interval=10.0, spoolBytes=64 * 1024 * 1024):
+	""" Creates an exporter for each kind=target spec, each spooling to its own directory """
+
+	exporters = []
+	for index, spec in enumerate(specs):
+		kind, sink = createSink(spec, boardName)
+		name = kind + str(index)
+		spool = DiskQueue(os.path.join(spoolPath, name), maxBytes=spoolBytes)
+		exporters.append(Exporter(name, sink, spool, batchSize=batchSize, interval=interval))
+
+	return exporters
@@ -0,0 +1,281 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Fleet collector, polls the /values of many SensorMon nodes
+#
+# Every node is polled concurrently from one asyncio event loop on a background thread.
+# Each node keeps its HTTP/1.1 connection open between polls, and sends the ETag of the
+# values it has so an unchanged node answers with a short 304.
+# Each poll has its own timeout, so a slow or dead node does not hold up the others.
+# Polls are spread out, each node starts at a random offset and each deadline has a
+# little random jitter, so dozens of nodes are not all polled in the same instant.
+#
+# The last values of every node are merged into one JSON document, built from the
+# bytes each node sent without decoding and encoding them again.
+
+import asyncio
+import json
+import random
+import threading
+from time import monotonic, time
+from urllib.parse import urlsplit
+
+# Fraction of the period each deadline may move by
+POLL_JITTER = 0.1
+
+class NodeError(Exception):
+	pass
+
+class Node:
+
+	def __init__(self, url):
+
+		parts = urlsplit(url if "://" in url else "http://" + url)
+		if parts.scheme != "http":
+			raise ValueError("Nodes must be http, got " + url)
+
+		self.url = url
+		self.name = parts.netloc
+		self.host = parts.hostname
+		self.port = parts.port or 80
+		self.path = parts.path if parts.path not in ("", "/") else "/values"
+
+		# The kept alive connection
+		self.reader = None
+		self.writer = None
+
+		# The last values, as sent
+		self.body = None
+		self.etag = None
+		self.sequence = None
+		self.timestamp = None
+
+		# Status of the last poll
+		self.ok = False
+		self.error = None
+		self.lastPoll = None
+		self.lastSuccess = None
+		self.latency = None
+
+		# Stats
+		self.polls = 0
+		self.failures = 0
+		self.notModified = 0
+
+	def close(self):
+
+		if self.writer is not None:
+			self.writer.close()
+
+		self.reader = None
+		self.writer = None
+
+	async def readResponse(self):
+		""" Reads a response, returns (status, headers, body) """
+
+		statusLine = await self.reader.readline()
+		if not statusLine:
+			raise NodeError("Connection closed")
+
+		parts = statusLine.decode("latin-1").split(None, 2)
+		if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+			raise NodeError("Bad status line " + repr(statusLine))
+		status = int(parts[1])
+
+		headers = {}
+		while True:
+			line = await self.reader.readline()
+			if line in (b"\r\n", b"\n", b""):
+				break
+			name, _, value = line.decode("latin-1").partition(":")
+			headers[name.strip().lower()] = value.strip()
+
+		if status == 304 or status == 204:
+			body = b""
+		elif "content-length" in headers:
+			body = await self.reader.readexactly(int(headers["content-length"]))
+		elif headers.get("transfer-encoding", "").lower() == "chunked":
+			chunks = []
+			while True:
+				size = int((await self.reader.readline()).split(b";")[0], 16)
+				if size == 0:
+					await self.reader.readline()
+					break
+				chunks.append(await self.reader.readexactly(size))
+				await self.reader.readline()
+			body = b"".join(chunks)
+		else:
+			# The end of the connection is the end of the body
+			body = await self.reader.read()
+			headers["connection"] = "close"
+
+		# HTTP/1.0 servers (e.g. the dev server) close unless asked not to
+		if headers.get("connection", "").lower() == "close" or parts[0] == "HTTP/1.0":
+			self.close()
+
+		return status, headers, body
+
+	async def request(self):
+
+		if self.writer is None:
+			self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+		request = "GET " + self.path + " HTTP/1.1\r\nHost: " + self.name + "\r\nAccept: application/json\r\n"
+		if self.etag is not None:
+			request = request + "If-None-Match: " + self.etag + "\r\n"
+		self.writer.write((request + "\r\n").encode("latin-1"))
+		await self.writer.drain()
+
+		return await self.readResponse()
+
+	async def poll(self, timeout):
+		""" Fetches the node's values, if they changed """
+
+		began = monotonic()
+		self.polls = self.polls + 1
+		self.lastPoll = time()
+
+		try:
+			reused = self.writer is not None
+			try:
+				status, headers, body = await asyncio.wait_for(self.request(), timeout)
+			except (NodeError, ConnectionError, asyncio.IncompleteReadError):
+				# The node may have closed the kept alive connection, try once on a new one
+				self.close()
+				if not reused:
+					raise
+				status, headers, body = await asyncio.wait_for(self.request(), timeout)
+
+			if status == 304:
+				self.notModified = self.notModified + 1
+			elif status == 200:
+				# Only decoded for the sequence and timestamp, the merged view uses the bytes
+				values = json.loads(body)
+				self.body = body
+				self.etag = headers.get("etag")
+				self.sequence = values.get("sequence")
+				self.timestamp = values.get("timestamp")
+			else:
+				raise NodeError("HTTP " + str(status))
+
+			self.ok = True
+			self.error = None
+			self.lastSuccess = time()
+		except Exception as e:
+			self.close()
+			self.ok = False
+			self.failures = self.failures + 1
+			self.error = "Timed out" if isinstance(e, asyncio.TimeoutError) else repr(e)
+
+		self.latency = monotonic() - began
+
+	def toJSON(self, now):
+		""" The node's status and its last values as JSON bytes """
+
+		status = {
+			"url": self.url,
+			"ok": self.ok,
+			"error": self.error,
+			"age": None if self.lastSuccess is None else now - self.lastSuccess,
+			"latency": self.latency,
+			"sequence": self.sequence,
+			"timestamp": self.timestamp,
+			"polls": self.polls,
+			"failures": self.failures,
+			"notModified": self.notModified,
+		}
+
+		# Splice in the node's own JSON rather than decoding and encoding it again
+		values = self.body if self.body is not None else b"null"
+
+		return json.dumps(status)[:-1].encode("utf-8") + b", \"snapshot\": " + values + b"}"
+
+class FleetCollector:
+
+	def __init__(self, urls, period=5.0, timeout=2.0):
+
+		self.nodes = [Node(url) for url in urls]
+		self.period = period
+		self.timeout = min(timeout, period)
+
+		self.running = False
+		self.loop = None
+		self.mainTask = None
+		self.thread = None
+
+	async def pollNode(self, node):
+
+		# Spread the nodes across the period
+		start = monotonic() + random.uniform(0.0, self.period)
+
+		n = 0
+		while self.running:
+			deadline = start + (n * self.period) + random.uniform(-POLL_JITTER, POLL_JITTER) * self.period
+			delay = deadline - monotonic()
+			if delay > 0:
+				await asyncio.sleep(delay)
+
+			await node.poll(self.timeout)
+
+			# Skip any deadlines we missed
+			n = max(n + 1, int((monotonic() - start) / self.period) + 1)
+
+	async def main(self):
+
+		try:
+			await asyncio.gather(*[self.pollNode(node) for node in self.nodes])
+		finally:
+			for node in self.nodes:
+				node.close()
+
+	def threadMain(self):
+
+		asyncio.set_event_loop(self.loop)
+
+		try:
+			self.loop.run_until_complete(self.mainTask)
+		except asyncio.CancelledError:
+			pass
+		finally:
+			self.loop.close()
+
+	def getValues(self):
+		""" The merged view of every node as JSON bytes """
+
+		now = time()
+		nodes = [json.dumps(node.name).encode("utf-8") + b": " + node.toJSON(now) for node in self.nodes]
+		healthy = sum(1 for node in self.nodes if node.ok)
+
+		return b"{ \"timestamp\": " + repr(now).encode() + b", \"healthy\": " + str(healthy).encode() + b", \"nodes\": {" + b", ".join(nodes) + b"}}"
+
+	def start(self):
+		""" Starts polling on a background thread """
+
+		self.running = True
+
+		self.loop = asyncio.new_event_loop()
+		self.mainTask = self.loop.create_task(self.main())
+
+		self.thread = threading.Thread(None, self.threadMain, name="collector", daemon=True)
+		self.thread.start()
+
+	def stop(self):
+
+		if not self.running:
+			return
+
+		self.running = False
+		self.loop.call_soon_threadsafe(self.mainTask.cancel)
+		self.thread.join()
@@ -0,0 +1,169 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# An in memory history of every published channel
+#
+# A fixed size ring, preallocated as one numpy array per board (channels x samples)
+# plus one array of timestamps. Appending a snapshot writes one column, the oldest
+# samples are overwritten once the ring is full.
+# Queries find the time range with a binary search and slice the columns out as
+# arrays, there are no per sample Python objects until the response is encoded.
+
+import threading
+import numpy
+
+def searchRing(times, count, capacity, timestamp, side):
+	""" numpy.searchsorted over a ring of increasing times, returns a logical index (0 is the first sample ever written) """
+
+	position = count % capacity
+
+	if count <= capacity:
+		# Not wrapped yet, one sorted run
+		return int(numpy.searchsorted(times[:count], timestamp, side))
+
+	# Wrapped, the older run is after the write position and the newer run before it
+	oldest = count - capacity
+	older = times[position:]
+	index = int(numpy.searchsorted(older, timestamp, side))
+	if index < len(older):
+		return oldest + index
+
+	return oldest + len(older) + int(numpy.searchsorted(times[:position], timestamp, side))
+
+def toList(column):
+	""" Converts a column to a list for JSON, missing (non finite) values become None """
+
+	if numpy.isfinite(column).all():
+		return column.tolist()
+
+	return numpy.where(numpy.isfinite(column), column, None).tolist()
+
+class HistoryRing:
+
+	def __init__(self, capacity):
+
+		self.capacity = capacity
+
+		# Created from the first snapshot, when we know the channels
+		self.channels = None
+		self.channelIndex = None
+		self.times = None
+		self.data = None
+
+		# Total samples appended, the next write goes to count % capacity
+		self.count = 0
+
+		# Held briefly by the writer and by readers copying a slice out
+		self.lock = threading.Lock()
+
+	def allocate(self, snapshot):
+
+		# Every numeric channel of the board
+		self.channels = [name for name, value in snapshot.values.items() if isinstance(value, (int, float))]
+		self.channelIndex = {name: index for index, name in enumerate(self.channels)}
+
+		self.times = numpy.zeros(self.capacity, dtype=numpy.float64)
+		self.data = numpy.zeros((len(self.channels), self.capacity), dtype=numpy.float64)
+
+	def append(self, snapshot):
+		""" Adds a snapshot to the history, used as a SnapshotPublisher listener """
+
+		if self.channels is None:
+			self.allocate(snapshot)
+
+		values = snapshot.values
+		row = [values.get(name, numpy.nan) for name in self.channels]
+
+		with self.lock:
+			position = self.count % self.capacity
+			self.times[position] = snapshot.timestamp
+			self.data[:, position] = row
+			self.count = self.count + 1
+
+	def load(self, channels, times, data):
+		""" Fills the history from stored samples (channels x samples, oldest first), e.g. at startup """
+
+		if len(times) == 0:
+			return
+
+		self.channels = list(channels)
+		self.channelIndex = {name: index for index, name in enumerate(self.channels)}
+
+		# Only the newest that fit
+		times = times[-self.capacity:]
+		data = data[:, -self.capacity:]
+
+		with self.lock:
+			self.times = numpy.zeros(self.capacity, dtype=numpy.float64)
+			self.data = numpy.zeros((len(self.channels), self.capacity), dtype=numpy.float64)
+			self.times[:len(times)] = times
+			self.data[:, :len(times)] = data
+			self.count = len(times)
+
+	def oldestTime(self):
+		""" The time of the oldest sample held, None if empty """
+
+		if self.count == 0:
+			return None
+
+		return self.times[self.count % self.capacity] if self.count > self.capacity else self.times[0]
+
+	def newestTime(self):
+		""" The time of the newest sample held, None if empty """
+
+		if self.count == 0:
+			return None
+
+		return self.times[(self.count - 1) % self.capacity]
+
+	def covers(self, start):
+		""" True if the history reaches back to start, e.g. not after a restart or once start has been overwritten """
+
+		oldest = self.oldestTime()
+
+		return oldest is not None and oldest <= start
+
+	def search(self, timestamp, side):
+		""" Finds the logical index for a timestamp, as numpy.searchsorted over the ring in time order """
+
+		return searchRing(self.times, self.count, self.capacity, timestamp, side)
+
+	def query(self, channels, start, end, step=0.0):
+		""" Returns (times, {channel: values}) for samples with start <= time < end.
+		When step (seconds) is larger than the sample spacing, samples are decimated to about one per step.
+		"""
+
+		if self.channels is None:
+			return numpy.zeros(0), {name: numpy.zeros(0) for name in channels}
+
+		rows = [self.channelIndex[name] for name in channels]
+
+		with self.lock:
+			first = self.search(start, "left")
+			last = self.search(end, "left")
+
+			stride = 1
+			if step > 0 and last - first > 1:
+				# Average spacing of the samples in range
+				spacing = (self.times[(last - 1) % self.capacity] - self.times[first % self.capacity]) / (last - first - 1)
+				if spacing > 0:
+					stride = max(1, int(round(step / spacing)))
+
+			# Physical positions of the samples we want, then one gather per array
+			positions = numpy.arange(first, last, stride) % self.capacity
+			times = self.times[positions]
+			columns = self.data[numpy.ix_(rows, positions)]
+
+		return times, {name: columns[index] for index, name in enumerate(channels)}
@@ -0,0 +1,188 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# The PI's own health, published as extra values alongside the sensors
+#
+# The temperature of each thermal zone, the clock of each cpufreq policy, the firmware
+# throttling flags (under voltage, frequency capped, throttled, soft temperature limit,
+# and whether each has happened since boot), the load averages and the memory in use.
+#
+# The sysfs and procfs files are opened once and read again with os.pread at offset 0,
+# the kernel makes the contents afresh for each read from the start, so a reading is a
+# few system calls rather than a fork and exec of cat (tens of milliseconds on a Zero).
+# Files the kernel does not have (e.g. no cpufreq in a container) are left out.
+
+from glob import glob
+import os
+
+# Longest sysfs file we read, /proc/meminfo is bigger and read whole
+SYSFS_READ_SIZE = 64
+PROC_READ_SIZE = 4096
+
+THERMAL_ZONES = "/sys/class/thermal/thermal_zone*"
+CPUFREQ_POLICIES = "/sys/devices/system/cpu/cpufreq/policy*"
+THROTTLED = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+LOADAVG = "/proc/loadavg"
+MEMINFO = "/proc/meminfo"
+
+class SysfsFile:
+	""" A sysfs or procfs file kept open, each read is of its current contents """
+
+	def __init__(self, path, size=SYSFS_READ_SIZE):
+
+		self.path = path
+		self.size = size
+		self.fd = None
+
+	def read(self):
+
+		# Opened on the first read, as the files are not there off a PI
+		if self.fd is None:
+			self.fd = os.open(self.path, os.O_RDONLY)
+
+		return os.pread(self.fd, self.size, 0)
+
+	def close(self):
+
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+def zoneNumber(path):
+	""" The number at the end of thermal_zone12 or policy3, so 10 sorts after 9 """
+
+	digits = len(path) - len(path.rstrip("0123456789"))
+
+	return int(path[-digits:]) if digits else 0
+
+def readText(path):
+	""" A small file read once, e.g. a thermal zone's type """
+
+	try:
+		with open(path, "r") as file:
+			return file.read().strip()
+	except OSError:
+		return None
+
+class HostTelemetry:
+
+	def __init__(self):
+
+		# value name -> (file, parse), and value name -> (sensor, unit, description) for /metrics
+		self.readers = {}
+		self.channels = {}
+
+		for path in sorted(glob(THERMAL_ZONES), key=zoneNumber):
+			name = "host_thermal" + str(zoneNumber(path))
+			kind = readText(os.path.join(path, "type")) or "unknown"
+			self.add(name, os.path.join(path, "temp"), parseMillis, "celsius", "Temperature of thermal zone " + kind)
+
+		for path in sorted(glob(CPUFREQ_POLICIES), key=zoneNumber):
+			name = "host_cpufreq" + str(zoneNumber(path))
+			self.add(name, os.path.join(path, "scaling_cur_freq"), parseKiloToMega, "megahertz", "CPU clock of cpufreq " + os.path.basename(path))
+
+		self.add("host_throttled", THROTTLED, parseHex, "flags", "Firmware throttling flags, 0x1 under voltage now, 0x4 throttled now, 0x10000 under voltage since boot")
+
+		self.add("host_load1", LOADAVG, None, "processes", "Load average over 1 minute")
+		self.add("host_load5", LOADAVG, None, "processes", "Load average over 5 minutes")
+		self.add("host_load15", LOADAVG, None, "processes", "Load average over 15 minutes")
+
+		self.add("host_memavailable", MEMINFO, None, "megabytes", "Memory available without swapping")
+		self.add("host_memused", MEMINFO, None, "percent", "Memory in use")
+
+		# The load averages and memory are each parsed once from their file
+		self.loadavg = SysfsFile(LOADAVG, PROC_READ_SIZE) if "host_load1" in self.channels else None
+		self.meminfo = SysfsFile(MEMINFO, PROC_READ_SIZE) if "host_memused" in self.channels else None
+
+	def add(self, name, path, parse, unit, description):
+		""" Adds a value, if the kernel has its file """
+
+		if not os.access(path, os.R_OK):
+			return
+
+		if parse is not None:
+			self.readers[name] = (SysfsFile(path), parse)
+
+		self.channels[name] = ("host", unit, description)
+
+	def read(self):
+		""" The current values, as value name -> number """
+
+		values = {}
+
+		for name, (file, parse) in self.readers.items():
+			try:
+				values[name] = parse(file.read())
+			except (OSError, ValueError):
+				values[name] = float("nan")
+
+		if self.loadavg is not None:
+			try:
+				fields = self.loadavg.read().split()
+				values["host_load1"], values["host_load5"], values["host_load15"] = float(fields[0]), float(fields[1]), float(fields[2])
+			except (OSError, ValueError, IndexError):
+				values["host_load1"] = values["host_load5"] = values["host_load15"] = float("nan")
+
+		if self.meminfo is not None:
+			try:
+				values["host_memavailable"], values["host_memused"] = parseMeminfo(self.meminfo.read())
+			except (OSError, ValueError, KeyError):
+				values["host_memavailable"] = values["host_memused"] = float("nan")
+
+		return values
+
+	def update(self, values):
+		""" Reads the current values into a board's values object """
+
+		for name, value in self.read().items():
+			setattr(values, name, value)
+
+	def close(self):
+
+		for file, parse in self.readers.values():
+			file.close()
+
+		for file in (self.loadavg, self.meminfo):
+			if file is not None:
+				file.close()
+
+def parseMillis(data):
+	""" Thermal zones are in thousandths of a degree """
+
+	return int(data) * 0.001
+
+def parseKiloToMega(data):
+	""" cpufreq is in kHz """
+
+	return int(data) * 0.001
+
+def parseHex(data):
+	""" The firmware flags, e.g. 50005 """
+
+	return int(data, 16)
+
+def parseMeminfo(data):
+	""" (available megabytes, percent used) from /proc/meminfo """
+
+	fields = {}
+	for line in data.split(b"\n"):
+		name, _, rest = line.partition(b":")
+		if rest:
+			fields[name] = int(rest.split()[0])
+
+	total = fields[b"MemTotal"]
+	available = fields[b"MemAvailable"]
+
+	return available / 1024.0, 100.0 * (total - available) / total
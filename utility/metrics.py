@@ -0,0 +1,123 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Prometheus text exposition of the published values and the acquisition loop timings
+#
+# The exposition is rendered once each time the board publishes and the encoded
+# bytes are kept, a scrape just returns them, however often it comes.
+# Each value is a gauge named sensormon_<value>_<unit>, labelled with the board and sensor.
+# Until the first publish the values are placeholders (0.0), so there are no value gauges,
+# a scrape then would record e.g. a temperature of 0C.
+
+import math
+import threading
+
+# The content type of the text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def escapeLabel(value):
+	""" Escapes a label value for the text exposition format """
+
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatValue(value):
+	""" Formats a sample value, including the special values """
+
+	if isinstance(value, int):
+		return str(value)
+
+	value = float(value)
+
+	if math.isnan(value):
+		return "NaN"
+	if math.isinf(value):
+		return "+Inf" if value > 0 else "-Inf"
+
+	return repr(value)
+
+class MetricsExporter:
+
+	def __init__(self, boardName, channels):
+
+		self.boardName = boardName
+
+		# value name -> (sensor, unit, description)
+		self.channels = channels
+
+		# Set once the scheduler is running, for the loop timings
+		self.scheduler = None
+
+		self.lock = threading.Lock()
+		self.rendered = b""
+
+	def addMetric(self, lines, name, kind, description, samples):
+		""" Adds a metric family, samples is a list of (labels, value) """
+
+		lines.append("# HELP " + name + " " + description)
+		lines.append("# TYPE " + name + " " + kind)
+
+		for labels, value in samples:
+			text = ",".join(key + "=\"" + escapeLabel(label) + "\"" for key, label in labels)
+			lines.append(name + "{" + text + "} " + formatValue(value))
+
+	def render(self, snapshot):
+		""" Renders the exposition for a snapshot and the current loop timings """
+
+		lines = []
+		board = ("board", self.boardName)
+
+		# The values, once they have been read
+		for name, value in snapshot.values.items():
+			if snapshot.sequence == 0:
+				break
+			if not isinstance(value, (int, float)):
+				continue
+
+			sensor, unit, description = self.channels.get(name, ("unknown", "", name))
+			metric = "sensormon_" + name + ("_" + unit if unit else "")
+			self.addMetric(lines, metric, "gauge", description, [((board, ("sensor", sensor)), value)])
+
+		# The publish
+		self.addMetric(lines, "sensormon_sequence", "counter", "Number of times the values have been published", [((board,), snapshot.sequence)])
+		self.addMetric(lines, "sensormon_published_timestamp_seconds", "gauge", "When the values were last published, seconds since the epoch", [((board,), snapshot.timestamp)])
+
+		# The acquisition loop
+		scheduler = self.scheduler
+		if scheduler is not None:
+			tasks = [((board, ("task", task.name)), task) for task in scheduler.tasks]
+
+			self.addMetric(lines, "sensormon_task_runs_total", "counter", "Number of times a task has run", [(labels, task.runs) for labels, task in tasks])
+			self.addMetric(lines, "sensormon_task_missed_deadlines_total", "counter", "Number of task deadlines skipped because a run overran", [(labels, task.missed) for labels, task in tasks])
+			self.addMetric(lines, "sensormon_task_overruns_total", "counter", "Number of task runs that took longer than the period", [(labels, task.overruns) for labels, task in tasks])
+			self.addMetric(lines, "sensormon_task_late_starts_total", "counter", "Number of task runs that started late", [(labels, task.late) for labels, task in tasks])
+			self.addMetric(lines, "sensormon_task_period_seconds", "gauge", "How often a task is scheduled to run", [(labels, task.period) for labels, task in tasks])
+			self.addMetric(lines, "sensormon_task_lateness_seconds", "gauge", "How late the last run of a task started", [(labels, task.lateness) for labels, task in tasks])
+			self.addMetric(lines, "sensormon_task_duration_seconds", "gauge", "How long the last run of a task took, including its waits", [(labels, task.duration) for labels, task in tasks])
+
+		return ("\n".join(lines) + "\n").encode("utf-8")
+
+	def publish(self, snapshot):
+		""" Renders and keeps the exposition, used as a SnapshotPublisher listener """
+
+		rendered = self.render(snapshot)
+
+		with self.lock:
+			self.rendered = rendered
+
+	def getMetrics(self):
+		""" The last rendered exposition """
+
+		with self.lock:
+			return self.rendered
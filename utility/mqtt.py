@@ -0,0 +1,150 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# A minimal MQTT 3.1.1 publisher
+#
+# Just enough of the protocol to publish: CONNECT, then PUBLISH at QoS 1 waiting for
+# each PUBACK, so a publish only returns once the broker has the message.
+# The connection is kept open between publishes and reopened when it has failed
+# or has been idle longer than the keep alive.
+
+import socket
+import struct
+from time import monotonic
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH_QOS1 = 0x32
+PUBACK = 0x40
+DISCONNECT = 0xE0
+
+# Seconds, the broker drops us after 1.5 times this without a packet
+KEEP_ALIVE = 60
+
+class MQTTError(Exception):
+	pass
+
+def encodeLength(length):
+	""" The MQTT variable length encoding of a remaining length """
+
+	encoded = bytearray()
+	while True:
+		byte = length % 128
+		length = length // 128
+		if length > 0:
+			byte = byte | 0x80
+		encoded.append(byte)
+		if length == 0:
+			return bytes(encoded)
+
+def encodeString(text):
+
+	data = text.encode("utf-8")
+	return struct.pack("!H", len(data)) + data
+
+def encodePacket(kind, body):
+	return bytes([kind]) + encodeLength(len(body)) + body
+
+class MQTTClient:
+
+	def __init__(self, host, port=1883, clientId="sensormon", timeout=10.0):
+
+		self.host = host
+		self.port = port
+		self.clientId = clientId
+		self.timeout = timeout
+
+		self.sock = None
+		self.lastSent = 0.0
+		self.packetId = 0
+
+	def readExact(self, count):
+
+		data = b""
+		while len(data) < count:
+			chunk = self.sock.recv(count - len(data))
+			if not chunk:
+				raise MQTTError("Connection closed by the broker")
+			data = data + chunk
+
+		return data
+
+	def readPacket(self):
+		""" Reads a packet, returns (type, body) """
+
+		kind = self.readExact(1)[0]
+
+		length = 0
+		multiplier = 1
+		while True:
+			byte = self.readExact(1)[0]
+			length = length + (byte & 0x7F) * multiplier
+			if byte & 0x80 == 0:
+				break
+			multiplier = multiplier * 128
+
+		return kind, self.readExact(length)
+
+	def connect(self):
+
+		self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		# Protocol name and level 4 (3.1.1), clean session, keep alive, then the client id
+		body = encodeString("MQTT") + bytes([4, 0x02]) + struct.pack("!H", KEEP_ALIVE) + encodeString(self.clientId)
+		self.sock.sendall(encodePacket(CONNECT, body))
+
+		kind, body = self.readPacket()
+		if kind != CONNACK or len(body) != 2 or body[1] != 0:
+			self.close()
+			raise MQTTError("Broker refused the connection")
+
+		self.lastSent = monotonic()
+
+	def publish(self, topic, payload):
+		""" Publishes at QoS 1, returns once the broker has acknowledged it """
+
+		# Reconnect if the broker may have dropped an idle connection
+		if self.sock is not None and monotonic() - self.lastSent > KEEP_ALIVE:
+			self.close()
+
+		if self.sock is None:
+			self.connect()
+
+		self.packetId = (self.packetId % 65535) + 1
+
+		try:
+			self.sock.sendall(encodePacket(PUBLISH_QOS1, encodeString(topic) + struct.pack("!H", self.packetId) + payload))
+			self.lastSent = monotonic()
+
+			kind, body = self.readPacket()
+			if kind & 0xF0 != PUBACK or struct.unpack("!H", body[:2])[0] != self.packetId:
+				raise MQTTError("Unexpected reply to a publish")
+		except Exception:
+			self.close()
+			raise
+
+	def close(self):
+
+		if self.sock is None:
+			return
+
+		try:
+			self.sock.sendall(encodePacket(DISCONNECT, b""))
+		except OSError:
+			pass
+
+		self.sock.close()
+		self.sock = None
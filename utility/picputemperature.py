@@ -16,19 +16,33 @@
 # A Wrapper object to handle getting the CPU temperature of the PI but smoothed
 
 from utility.cbuffer import CBuffer
-from subprocess import PIPE, Popen
+from utility.hosttelemetry import SysfsFile
+from utility.trace import openDevice
+
+class ThermalZone:
+
+	def __init__(self):
+
+		# Kept open and read again each time, rather than running cat
+		self.file = SysfsFile("/sys/class/thermal/thermal_zone0/temp")
+
+	# Reads the raw cpu temp directly from thermal zone0
+	def read(self):
+
+		return self.file.read()
 
 class PICPUTemp:
 
 	def __init__(self, sample_window_len):
 		self.sampleBuffer = CBuffer(sample_window_len)
 
+		# Recorded or replayed when tracing
+		self.zone = openDevice("thermal", ThermalZone)
+
 	# Appends a cpu temperature
 	def update(self):
 
-		# We read the cpu temp directly from thermal zone0
-		process = Popen(['cat', '/sys/class/thermal/thermal_zone0/temp'], stdout=PIPE)
-		(output, process) = process.communicate()
+		output = self.zone.read()
 
 		# Our raw cpu temp as a decimal (30525 / 1000 = 30.525)
 		ncpu_temp = float(output) * 0.001
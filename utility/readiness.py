@@ -0,0 +1,162 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Concurrent sensor start up, and the readiness of each sensor
+#
+# Each sensor's init (setup, warm up reads, e.g. the SGP40's 10 second warm up) runs
+# on its own thread, so the warm ups overlap rather than adding up, and the REST server
+# can start while they run. The inits and the scheduler's bus worker share the i2c buses,
+# each call on a bus holds its lock (see utility/trace.py), so calls for sensors on
+# different addresses can interleave but never mix. A sensor is only used by its init
+# until it is ready, then only by its task.
+#
+# A sensor's task is skipped until its init has finished, and the board publishes
+# once every sensor has either started or failed, and every one that started has
+# written its values, so a snapshot never has the initial 0.0 of a working sensor.
+
+import inspect
+import threading
+from time import monotonic
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+class Readiness:
+
+	def __init__(self):
+
+		self.began = monotonic()
+
+		# name -> state, seconds the init took, error
+		self.states = {}
+		self.durations = {}
+		self.errors = {}
+
+		self.lock = threading.Lock()
+		self.settledEvent = threading.Event()
+
+		# Sensors whose jobs write values, and those that have written them at least once
+		self.writers = set()
+		self.written = set()
+
+	def run(self, name, init):
+
+		began = monotonic()
+		try:
+			init()
+			state = READY
+		except Exception as e:
+			print("Sensor " + name + " failed to start - " + repr(e))
+			state = FAILED
+			self.errors[name] = repr(e)
+
+		with self.lock:
+			self.states[name] = state
+			self.durations[name] = monotonic() - began
+
+			if all(state != STARTING for state in self.states.values()):
+				self.settledEvent.set()
+				print("Sensors started in " + "%.2f" % (monotonic() - self.began) + "s")
+
+	def start(self, inits):
+		""" Runs each (name, init) on its own thread """
+
+		with self.lock:
+			for name, init in inits:
+				self.states[name] = STARTING
+
+		if not inits:
+			self.settledEvent.set()
+
+		for name, init in inits:
+			threading.Thread(None, self.run, name="init-" + name, args=(name, init), daemon=True).start()
+
+	def isReady(self, name):
+		return self.states.get(name) == READY
+
+	def settled(self):
+		""" True once every sensor has started or failed """
+
+		return self.settledEvent.is_set()
+
+	def wait(self, timeout=None):
+		""" Waits for every sensor to start or fail, returns settled() """
+
+		return self.settledEvent.wait(timeout)
+
+	def gate(self, name, job, writesValues=True):
+		""" Wraps a job so it is skipped until the named sensor is ready.
+		Unless writesValues is False (e.g. a display) publishing waits for the job to have run once.
+		"""
+
+		if writesValues:
+			with self.lock:
+				self.writers.add(name)
+
+		def gated():
+			if self.states.get(name) != READY:
+				return None
+
+			result = job()
+
+			# A generator job has written its values when it finishes
+			if inspect.isgenerator(result):
+				return self.finishing(name, result)
+
+			self.markWritten(name)
+			return result
+
+		return gated
+
+	def finishing(self, name, steps):
+
+		result = yield from steps
+		self.markWritten(name)
+		return result
+
+	def markWritten(self, name):
+
+		if name not in self.written:
+			with self.lock:
+				self.written.add(name)
+
+	def hasValues(self):
+		""" True once settled, and every started sensor that writes values has written them """
+
+		if not self.settledEvent.is_set():
+			return False
+
+		with self.lock:
+			started = [name for name in self.writers if self.states.get(name) == READY]
+			return len(started) > 0 and all(name in self.written for name in started)
+
+	def gateSettled(self, job):
+		""" Wraps a job so it is skipped until every sensor has started or failed, and the started ones have written their values """
+
+		def gated():
+			if not self.hasValues():
+				return None
+			return job()
+
+		return gated
+
+	def toDict(self):
+
+		with self.lock:
+			return {
+				name: {"state": state, "seconds": self.durations.get(name), "error": self.errors.get(name)}
+				for name, state in self.states.items()
+			}
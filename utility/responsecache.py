@@ -0,0 +1,185 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Compressed responses, and a cache of them for repeated large queries
+#
+# Responses are compressed with zstd when the zstandard package is installed and the
+# client accepts it, otherwise gzip. A response is encoded once, then compressed once
+# per encoding asked for, and the bytes are kept in an LRU cache keyed by the query and
+# the data it was answered from, so a repeat is just a lookup.
+
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+# zstd is optional
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# Smaller bodies are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def supportedEncodings():
+	""" The content encodings we can produce, best first """
+
+	return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+def chooseEncoding(acceptEncodings):
+	""" Picks a content encoding from werkzeug's parsed Accept-Encoding, None for identity """
+
+	for encoding in supportedEncodings():
+		if acceptEncodings[encoding] > 0:
+			return encoding
+
+	return None
+
+def historyCacheKey(args, mimetype, start, end, relative, tier, history, publishPeriod):
+	""" The cache key of a /history request, the query and the data it is answered from.
+	args are the request's (name, value) pairs, start and end the range they resolve to,
+	relative whether that range moves with now (from or to relative, or to left out).
+	"""
+
+	query = tuple(sorted(args))
+
+	# A range relative to now is keyed as asked for, and answered again once the data changes,
+	# so repeats between publishes are hits rather than a new key each time
+	if tier is None:
+		# Raw values up to now change each publish, older ones do not change
+		newest = history.newestTime()
+		if relative or newest is None or end > newest:
+			return (query, mimetype, "raw", history.count)
+		return (query, mimetype, "raw", "sealed")
+
+	# Rollups change as buckets are sealed, the open bucket is refreshed at least each minute
+	if relative or tier.openStart is None or end > tier.openStart:
+		return (query, mimetype, tier.name, (tier.count, int(history.count * publishPeriod // 60)))
+
+	return (query, mimetype, tier.name, "sealed")
+
+def compress(body, encoding):
+
+	if encoding == "zstd":
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+	# mtime 0 so the same body always gives the same bytes
+	return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+def compressStream(blocks, encoding):
+	""" Compresses a generator of blocks as it goes, for streamed responses """
+
+	if encoding == "zstd":
+		compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+	else:
+		compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+	try:
+		for block in blocks:
+			data = compressor.compress(block)
+			if data:
+				yield data
+
+		yield compressor.flush()
+	finally:
+		if hasattr(blocks, "close"):
+			blocks.close()
+
+class CachedResponse:
+
+	def __init__(self, body, mimetype, headers):
+
+		self.mimetype = mimetype
+		self.headers = headers
+
+		# encoding (None for identity) -> bytes
+		self.bodies = {None: body}
+
+	def size(self):
+		return sum(len(body) for body in self.bodies.values())
+
+class ResponseCache:
+
+	def __init__(self, maxBytes=8 * 1024 * 1024):
+
+		self.maxBytes = maxBytes
+
+		self.entries = OrderedDict()
+		self.size = 0
+		self.lock = threading.Lock()
+
+		# Stats
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		""" The cached response for a key, None if there is not one """
+
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses = self.misses + 1
+				return None
+
+			self.entries.move_to_end(key)
+			self.hits = self.hits + 1
+
+			return entry
+
+	def put(self, key, entry):
+
+		with self.lock:
+			old = self.entries.pop(key, None)
+			if old is not None:
+				self.size = self.size - old.size()
+
+			self.entries[key] = entry
+			self.size = self.size + entry.size()
+			self.evict()
+
+	def getBody(self, key, entry, encoding):
+		""" The body of an entry in an encoding, compressed the first time it is asked for. Returns (body, encoding) """
+
+		identity = entry.bodies[None]
+		if encoding is None or len(identity) < MIN_COMPRESS_SIZE:
+			return identity, None
+
+		with self.lock:
+			body = entry.bodies.get(encoding)
+
+		if body is None:
+			# Compress without the lock held, if two requests race both get the same bytes
+			body = compress(identity, encoding)
+
+			with self.lock:
+				if encoding not in entry.bodies:
+					entry.bodies[encoding] = body
+
+					# Only count it if the entry is still cached
+					if self.entries.get(key) is entry:
+						self.size = self.size + len(body)
+						self.evict()
+
+		return body, encoding
+
+	def evict(self):
+		# Least recently used first, with the lock held
+		while self.size > self.maxBytes and len(self.entries) > 1:
+			key, entry = self.entries.popitem(last=False)
+			self.size = self.size - entry.size()
@@ -0,0 +1,288 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Downsampled rollup tiers of the published values (e.g. per minute and per hour)
+#
+# Each tier keeps min, max, sum and count per channel per time bucket.
+# Samples are folded into the open bucket as they are published, a fixed amount of
+# work per sample however long the tier is. When a sample lands in a new bucket the
+# open one is sealed into a ring of buckets, like the raw HistoryRing.
+# Long range queries read the buckets rather than scanning the raw samples.
+
+import threading
+import numpy
+
+from utility.history import searchRing
+
+# (name, bucket width in seconds, buckets kept)
+ROLLUP_TIERS = [
+	("1m", 60, 7 * 24 * 60),
+	("1h", 3600, 365 * 24),
+]
+
+class RollupTier:
+
+	def __init__(self, name, width, capacity, channels):
+
+		self.name = name
+		self.width = width
+		self.capacity = capacity
+		self.channels = channels
+		self.channelIndex = {name: index for index, name in enumerate(channels)}
+
+		# Sealed buckets, the next goes to count % capacity
+		self.starts = numpy.zeros(capacity, dtype=numpy.float64)
+		self.mins = numpy.zeros((len(channels), capacity), dtype=numpy.float64)
+		self.maxs = numpy.zeros((len(channels), capacity), dtype=numpy.float64)
+		self.sums = numpy.zeros((len(channels), capacity), dtype=numpy.float64)
+		self.counts = numpy.zeros((len(channels), capacity), dtype=numpy.int64)
+		self.count = 0
+
+		# The open bucket
+		self.openStart = None
+		self.resetOpen()
+
+		# The first sample added, the oldest bucket may start before it (e.g. after a restart)
+		self.firstTime = None
+
+		self.lock = threading.Lock()
+
+	def resetOpen(self):
+
+		channels = len(self.channels)
+		self.openMin = numpy.full(channels, numpy.inf)
+		self.openMax = numpy.full(channels, -numpy.inf)
+		self.openSum = numpy.zeros(channels)
+		self.openCount = numpy.zeros(channels, dtype=numpy.int64)
+
+	def seal(self):
+		""" Moves the open bucket into the ring """
+
+		position = self.count % self.capacity
+		self.starts[position] = self.openStart
+		self.mins[:, position] = self.openMin
+		self.maxs[:, position] = self.openMax
+		self.sums[:, position] = self.openSum
+		self.counts[:, position] = self.openCount
+		self.count = self.count + 1
+
+		self.resetOpen()
+
+	def add(self, timestamp, row):
+		""" Folds a sample (one value per channel, NaN if missing) into its bucket """
+
+		start = (timestamp // self.width) * self.width
+
+		with self.lock:
+			if self.firstTime is None:
+				self.firstTime = timestamp
+
+			if start != self.openStart:
+				if self.openStart is not None:
+					self.seal()
+				self.openStart = start
+
+			valid = ~numpy.isnan(row)
+			numpy.fmin(self.openMin, row, out=self.openMin)
+			numpy.fmax(self.openMax, row, out=self.openMax)
+			self.openSum += numpy.where(valid, row, 0.0)
+			self.openCount += valid
+
+	def load(self, times, data):
+		""" Folds samples in (channels x samples, in time order, after any added before), e.g. from the store at startup """
+
+		if len(times) == 0:
+			return
+
+		# The min, max, sum and count of each bucket's run of samples, in one pass
+		starts = (times // self.width) * self.width
+		groups = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(starts)) + 1))
+
+		valid = ~numpy.isnan(data)
+		mins = numpy.fmin.reduceat(data, groups, axis=1)
+		maxs = numpy.fmax.reduceat(data, groups, axis=1)
+		sums = numpy.add.reduceat(numpy.where(valid, data, 0.0), groups, axis=1)
+		counts = numpy.add.reduceat(valid, groups, axis=1)
+
+		with self.lock:
+			if self.firstTime is None:
+				self.firstTime = times[0]
+
+			for index, start in enumerate(starts[groups]):
+				if start != self.openStart:
+					if self.openStart is not None:
+						self.seal()
+					self.openStart = start
+
+				# fmin and fmax keep the open bucket's infinities where a bucket has no values
+				numpy.fmin(self.openMin, mins[:, index], out=self.openMin)
+				numpy.fmax(self.openMax, maxs[:, index], out=self.openMax)
+				self.openSum += sums[:, index]
+				self.openCount += counts[:, index]
+
+	def query(self, channels, start, end, step=0.0):
+		""" Returns (bucket starts, {channel: (min, max, mean, count)}) for the buckets covering start <= time < end.
+		When step is wider than the buckets, neighbouring buckets are merged to about one per step.
+		"""
+
+		rows = [self.channelIndex[name] for name in channels]
+
+		# Include the bucket start is in
+		start = (start // self.width) * self.width
+
+		with self.lock:
+			first = searchRing(self.starts, self.count, self.capacity, start, "left")
+			last = searchRing(self.starts, self.count, self.capacity, end, "left")
+
+			positions = numpy.arange(first, last) % self.capacity
+			starts = self.starts[positions]
+			index = numpy.ix_(rows, positions)
+			mins = self.mins[index]
+			maxs = self.maxs[index]
+			sums = self.sums[index]
+			counts = self.counts[index]
+
+			# Include the open bucket if it is in range
+			if self.openStart is not None and start <= self.openStart < end:
+				starts = numpy.append(starts, self.openStart)
+				mins = numpy.column_stack((mins, self.openMin[rows]))
+				maxs = numpy.column_stack((maxs, self.openMax[rows]))
+				sums = numpy.column_stack((sums, self.openSum[rows]))
+				counts = numpy.column_stack((counts, self.openCount[rows]))
+
+		# Merge runs of buckets into one per step
+		merge = int(step // self.width)
+		if merge > 1 and len(starts) > 0:
+			groups = numpy.arange(0, len(starts), merge)
+			starts = starts[groups]
+			mins = numpy.minimum.reduceat(mins, groups, axis=1)
+			maxs = numpy.maximum.reduceat(maxs, groups, axis=1)
+			sums = numpy.add.reduceat(sums, groups, axis=1)
+			counts = numpy.add.reduceat(counts, groups, axis=1)
+
+		with numpy.errstate(invalid="ignore", divide="ignore"):
+			means = sums / counts
+
+		# Buckets with no samples for a channel have no min, max or mean
+		empty = counts == 0
+		mins[empty] = numpy.nan
+		maxs[empty] = numpy.nan
+		means[empty] = numpy.nan
+
+		return starts, {name: (mins[i], maxs[i], means[i], counts[i]) for i, name in enumerate(channels)}
+
+	def oldestTime(self):
+		""" The time the tier reaches back to, None if empty """
+
+		# Until the ring wraps the first bucket may only be partly filled
+		if self.count <= self.capacity:
+			return self.firstTime
+
+		return self.starts[self.count % self.capacity]
+
+	def covers(self, start):
+		""" True if the tier reaches back to start, e.g. not after a restart or once it has been overwritten """
+
+		oldest = self.oldestTime()
+
+		return oldest is not None and oldest <= start
+
+class Rollups:
+
+	def __init__(self, tiers=ROLLUP_TIERS):
+
+		self.tierSpecs = tiers
+
+		# Created from the first snapshot, when we know the channels
+		self.channels = None
+		self.tiers = []
+
+	def append(self, snapshot):
+		""" Adds a snapshot to every tier, used as a SnapshotPublisher listener """
+
+		if self.channels is None:
+			self.channels = [name for name, value in snapshot.values.items() if isinstance(value, (int, float))]
+			self.tiers = [RollupTier(name, width, capacity, self.channels) for name, width, capacity in self.tierSpecs]
+
+		values = snapshot.values
+		row = numpy.array([values.get(name, numpy.nan) for name in self.channels], dtype=numpy.float64)
+
+		for tier in self.tiers:
+			tier.add(snapshot.timestamp, row)
+
+	def load(self, channels, times, data, newest=None):
+		""" Folds stored samples (channels x samples, in time order) into every tier, before any are published.
+		Loaded a block at a time, newest is the time of the last sample of the last block.
+		"""
+
+		if self.channels is None:
+			self.channels = list(channels)
+			self.tiers = [RollupTier(name, width, capacity, self.channels) for name, width, capacity in self.tierSpecs]
+
+		if len(times) == 0:
+			return
+
+		if newest is None:
+			newest = times[-1]
+
+		for tier in self.tiers:
+			# Only what the tier can keep, the oldest buckets would be overwritten anyway
+			first = int(numpy.searchsorted(times, newest - tier.width * (tier.capacity + 1), "left"))
+			tier.load(times[first:], data[:, first:])
+
+	def span(self):
+		""" Seconds the longest tier reaches back """
+
+		return max([width * capacity for name, width, capacity in self.tierSpecs] + [0])
+
+	def getTier(self, name):
+
+		for tier in self.tiers:
+			if tier.name == name:
+				return tier
+
+		return None
+
+	def chooseTier(self, start, step, rawOldest):
+		""" Picks the tier to answer a query from start at about step seconds, None means the raw values.
+		rawOldest is the oldest time the raw values reach back to (the history, or the store), None if there are none.
+		Uses the coarsest tier no wider than step, or a coarser one if that does not reach back to start,
+		or the raw values. If nothing reaches back to start, whichever reaches back furthest.
+		"""
+
+		finer = [tier for tier in self.tiers if tier.width <= step]
+		coarser = [tier for tier in self.tiers if tier.width > step]
+
+		rawCovers = rawOldest is not None and rawOldest <= start
+		if not finer and rawCovers:
+			return None
+
+		for tier in finer[-1:] + coarser:
+			if tier.covers(start):
+				return tier
+
+		if rawCovers:
+			return None
+
+		# None reach back, e.g. the tiers only have what was published since a restart
+		best = None
+		bestOldest = rawOldest
+		for tier in self.tiers:
+			oldest = tier.oldestTime()
+			if oldest is not None and (bestOldest is None or oldest < bestOldest):
+				best = tier
+				bestOldest = oldest
+
+		return best
@@ -0,0 +1,256 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# A drift free acquisition scheduler
+#
+# Each sensor is registered as a task with its own cadence (period in seconds).
+# Tasks fire on absolute deadlines (start + n * period), so the time spent reading
+# a sensor does not push the next reading out as "update then sleep(1)" did.
+#
+# A task job is either a plain function or a generator function.
+# A generator job yields the number of seconds it needs to wait (e.g. a sensor
+# conversion time) instead of sleeping. The wait is done on the event loop, so
+# while one sensor waits for a conversion the others can use the bus.
+#
+# A task can run after others (e.g. publishing after the sensor reads), at each of its
+# deadlines it waits for those tasks to finish their runs due at or before it.
+#
+# All bus jobs run on a single worker thread, which serialises the I2C transactions.
+# Jobs that do not touch the bus (e.g. the SPI display) run on a separate worker.
+#
+# With timings enabled each run of a task records its duration, the time it was busy
+# on its worker, the rest (waits and queueing) and how late it started.
+
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import monotonic, perf_counter, sleep
+
+from utility.timings import Timings
+
+# A run starting later than this after its deadline counts as late, in seconds
+LATE_TOLERANCE = 0.005
+
+# Deadlines closer than this are the same tick, e.g. 3 * 0.1 and 1 * 0.3
+DEADLINE_TOLERANCE = 1e-6
+
+def runJob(job):
+	""" Runs a job to completion on the calling thread, sleeping for any waits it yields """
+
+	result = job()
+
+	if inspect.isgenerator(result):
+		for wait in result:
+			sleep(wait)
+
+class ScheduledTask:
+
+	def __init__(self, name, period, job, onBus, after=()):
+
+		self.name = name
+		self.period = period
+		self.job = job
+		self.onBus = onBus
+
+		# Names of the tasks this one runs after
+		self.after = list(after)
+
+		# The deadline of the next run, every run due before it has finished
+		self.nextDeadline = 0.0
+
+		# Run stats
+		self.runs = 0
+		self.missed = 0
+		self.lateness = 0.0
+		self.duration = 0.0
+		self.overruns = 0
+		self.late = 0
+
+		# Time the current run has spent running on its worker
+		self.busy = 0.0
+
+class AcquisitionScheduler:
+
+	def __init__(self, lock=None, timings=None):
+
+		# Optional lock held while any part of a job is running
+		self.lock = lock if lock is not None else nullcontext()
+
+		# Latency histograms, off unless enabled
+		self.timings = timings if timings is not None else Timings()
+
+		self.tasks = []
+		self.running = False
+		self.loop = None
+		self.mainTask = None
+		self.thread = None
+
+		# Notified each time a run finishes, for tasks waiting on others
+		self.finished = None
+
+		# A single worker, every bus transaction is serialised on this thread
+		self.busExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="i2c-bus")
+
+		# Blocking work that is not on the bus
+		self.workExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="worker")
+
+	def addTask(self, name, period, job, onBus=True, after=()):
+		""" Registers a job to be run every period seconds, after the runs of the named tasks due at the same time """
+
+		if period <= 0:
+			raise ValueError("Task " + name + " needs a period greater than 0, got " + str(period))
+
+		names = [task.name for task in self.tasks]
+		for other in after:
+			if other not in names:
+				raise ValueError("Task " + name + " runs after " + other + ", which is not a task added before it")
+
+		self.tasks.append(ScheduledTask(name, period, job, onBus, after))
+
+	async def waitForTasks(self, task, deadline):
+		""" Waits until the tasks this one runs after have finished their runs due by deadline """
+
+		others = [other for other in self.tasks if other.name in task.after]
+
+		async with self.finished:
+			await self.finished.wait_for(lambda: all(other.nextDeadline > deadline + DEADLINE_TOLERANCE for other in others))
+
+	def call(self, task, fn, *args):
+		# Runs on the worker threads
+		with self.lock:
+			if not self.timings.enabled:
+				return fn(*args)
+
+			began = perf_counter()
+			try:
+				return fn(*args)
+			finally:
+				task.busy = task.busy + (perf_counter() - began)
+
+	async def runJob(self, task):
+		""" Runs one invocation of a task's job, awaiting any waits it yields """
+
+		loop = asyncio.get_running_loop()
+		executor = self.busExecutor if task.onBus else self.workExecutor
+
+		result = await loop.run_in_executor(executor, self.call, task, task.job)
+
+		if inspect.isgenerator(result):
+
+			# Each step runs the job up to its next wait, None when it has finished
+			wait = await loop.run_in_executor(executor, self.call, task, next, result, None)
+			while wait is not None:
+				await asyncio.sleep(wait)
+				wait = await loop.run_in_executor(executor, self.call, task, next, result, None)
+
+	async def runTask(self, task, start):
+		""" Runs a task on absolute deadlines until cancelled """
+
+		n = 0
+		task.nextDeadline = start
+		while self.running:
+
+			deadline = start + (n * task.period)
+			delay = deadline - monotonic()
+			if delay > 0:
+				await asyncio.sleep(delay)
+
+			# Waiting on the tasks it runs after is not lateness
+			task.lateness = monotonic() - deadline
+			if task.after:
+				await self.waitForTasks(task, deadline)
+
+			began = monotonic()
+			task.busy = 0.0
+
+			try:
+				await self.runJob(task)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				print("Task " + task.name + " failed - " + repr(e))
+
+			task.duration = monotonic() - began
+
+			task.runs = task.runs + 1
+			if task.duration > task.period:
+				task.overruns = task.overruns + 1
+			if task.lateness > LATE_TOLERANCE:
+				task.late = task.late + 1
+
+			if self.timings.enabled:
+				self.timings.record(task.name, "run", task.duration)
+				self.timings.record(task.name, "busy", task.busy)
+				self.timings.record(task.name, "wait", max(0.0, task.duration - task.busy))
+				self.timings.record(task.name, "lateness", max(0.0, task.lateness))
+
+			# If the job overran skip the deadlines we missed rather than bursting to catch up
+			n = n + 1
+			due = int((monotonic() - start) / task.period) + 1
+			if due > n:
+				task.missed = task.missed + (due - n)
+				n = due
+
+			task.nextDeadline = start + (n * task.period)
+			async with self.finished:
+				self.finished.notify_all()
+
+	async def main(self):
+
+		self.finished = asyncio.Condition()
+
+		# All tasks share the same start time so their deadlines stay aligned
+		start = monotonic()
+		for task in self.tasks:
+			task.nextDeadline = start
+
+		await asyncio.gather(*[self.runTask(task, start) for task in self.tasks])
+
+	def threadMain(self):
+
+		asyncio.set_event_loop(self.loop)
+
+		try:
+			self.loop.run_until_complete(self.mainTask)
+		except asyncio.CancelledError:
+			pass
+		finally:
+			self.loop.close()
+
+	def start(self):
+		""" Starts running the tasks on a background thread """
+
+		self.running = True
+
+		self.loop = asyncio.new_event_loop()
+		self.mainTask = self.loop.create_task(self.main())
+
+		self.thread = threading.Thread(None, self.threadMain, name="scheduler", daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		""" Stops the tasks and waits for any in progress job to finish """
+
+		if not self.running:
+			return
+
+		self.running = False
+		self.loop.call_soon_threadsafe(self.mainTask.cancel)
+		self.thread.join()
+
+		self.busExecutor.shutdown(wait=True)
+		self.workExecutor.shutdown(wait=True)
@@ -0,0 +1,140 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Immutable snapshots of a board's values
+#
+# The board reads its sensors into a working set of values, then publishes a copy
+# of them as a new snapshot by swapping a single reference.
+# Readers (e.g. the REST API) take the current snapshot without any locking and
+# never wait on the sensors, a snapshot never changes once published.
+#
+# The JSON body and its ETag are encoded once when the snapshot is published,
+# so each request just sends the cached bytes.
+# Other encodings (CBOR, MessagePack) are made the first time they are asked for
+# and kept with the snapshot.
+#
+# Every snapshot has a sequence number, increasing by one each publish, and the
+# time it was published, so clients can tell new values from ones they have seen.
+# Clients can wait for a snapshot newer than the one they have (long polling).
+
+import json
+import threading
+from hashlib import blake2b
+from time import time
+from types import MappingProxyType
+
+class Snapshot:
+
+	__slots__ = ("values", "sequence", "timestamp", "json", "etag", "encodings")
+
+	def __init__(self, values, sequence=0, timestamp=0.0):
+
+		# A read only view of our own copy of the values
+		values = dict(values)
+		object.__setattr__(self, "values", MappingProxyType(values))
+
+		object.__setattr__(self, "sequence", sequence)
+		object.__setattr__(self, "timestamp", timestamp)
+
+		# Serialised once, as bytes ready to send
+		body = ("{ \"sequence\" :" + str(sequence) + ", \"timestamp\" :" + repr(timestamp) + ", \"values\" :" + json.dumps(values, sort_keys=False) + "}").encode("utf-8")
+		object.__setattr__(self, "json", body)
+
+		# A strong ETag, the same values always give the same tag
+		object.__setattr__(self, "etag", blake2b(body, digest_size=12).hexdigest())
+
+		# mime type -> encoded bytes, filled in as they are asked for
+		object.__setattr__(self, "encodings", {})
+
+	def __setattr__(self, name, value):
+		raise AttributeError("Snapshots are immutable")
+
+	def toJSON(self):
+		return self.json.decode("utf-8")
+
+	def encode(self, mimetype):
+		""" The snapshot encoded as CBOR or MessagePack, encoded once and kept """
+
+		body = self.encodings.get(mimetype)
+		if body is None:
+			# Imported here, it pulls in numpy which the boards do not need to start
+			from utility.encoding import CBOR_TYPE, encodeCBOR, encodeMsgPack
+
+			encoder = encodeCBOR if mimetype == CBOR_TYPE else encodeMsgPack
+			body = encoder({"sequence": self.sequence, "timestamp": self.timestamp, "values": self.values})
+
+			# Two readers may both encode it, they get the same bytes
+			self.encodings[mimetype] = body
+
+		return body
+
+class SnapshotPublisher:
+
+	def __init__(self, values):
+
+		# Start with the initial values so there is always a snapshot to read
+		self.snapshot = Snapshot(values.__dict__, 0, time())
+
+		# Only used by readers waiting for a new snapshot, never by getSnapshot
+		self.published = threading.Condition()
+
+		# Called with each new snapshot
+		self.listeners = []
+
+	def addListener(self, listener):
+		""" Calls listener(snapshot) each time a new snapshot is published """
+
+		self.listeners.append(listener)
+
+	def publish(self, values):
+		""" Publishes a copy of the values object as the new current snapshot """
+
+		# Build the new snapshot fully before swapping it in
+		snapshot = Snapshot(values.__dict__, self.snapshot.sequence + 1, time())
+
+		# A single reference assignment, readers see either the old or the new snapshot
+		self.snapshot = snapshot
+
+		# Wake anyone waiting for it
+		with self.published:
+			self.published.notify_all()
+
+		# Listeners run on the publishing thread, so they need to be quick
+		for listener in self.listeners:
+			try:
+				listener(snapshot)
+			except Exception as e:
+				print("Snapshot listener failed - " + repr(e))
+
+		return snapshot
+
+	def getSnapshot(self):
+		""" The current snapshot, safe to call from any thread without a lock """
+
+		return self.snapshot
+
+	def waitForSnapshot(self, since, timeout):
+		""" Waits up to timeout seconds for a snapshot with a sequence after since.
+		Returns the current snapshot, which is not newer than since if we timed out.
+		"""
+
+		# A sequence from the future, e.g. we restarted, the client needs the current values
+		if since > self.snapshot.sequence:
+			return self.snapshot
+
+		with self.published:
+			self.published.wait_for(lambda: self.snapshot.sequence > since, timeout)
+
+		return self.snapshot
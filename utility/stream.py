@@ -0,0 +1,147 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Server-Sent Events push stream of published snapshots
+#
+# Each snapshot is encoded into an event once, and the same bytes are queued to
+# every subscriber. Each subscriber has a small bounded queue, a subscriber that
+# can not keep up (its queue is full) is dropped rather than holding up the others,
+# its EventSource will reconnect and start again from the latest values.
+
+import threading
+from queue import Queue, Empty, Full
+
+# Sent to end a stream
+STREAM_CLOSED = None
+
+# A comment line, keeps proxies from timing out an idle stream
+KEEPALIVE_EVENT = b": keepalive\n\n"
+
+def encodeEvent(snapshot):
+	""" Encodes a snapshot as a Server-Sent Event """
+
+	# The snapshot json is a single line, so it is a valid data field as is
+	return b"id: " + str(snapshot.sequence).encode() + b"\ndata: " + snapshot.json + b"\n\n"
+
+class StreamClient:
+
+	def __init__(self, queueSize):
+
+		self.events = Queue(maxsize=queueSize)
+		self.dropped = False
+
+	def push(self, event):
+		""" Queues an event, returns False if the client could not keep up """
+
+		try:
+			self.events.put_nowait(event)
+			return True
+		except Full:
+			return False
+
+	def close(self):
+		""" Ends the stream, waking the client if it is waiting """
+
+		self.dropped = True
+
+		# Make room for the close if the queue is full
+		try:
+			self.events.get_nowait()
+		except Empty:
+			pass
+		self.push(STREAM_CLOSED)
+
+	def nextEvent(self, timeout):
+		""" Waits for the next event, returns the keepalive on timeout and STREAM_CLOSED when ended """
+
+		try:
+			return self.events.get(timeout=timeout)
+		except Empty:
+			return KEEPALIVE_EVENT
+
+class StreamHub:
+
+	def __init__(self, maxClients=8, queueSize=4, keepAlive=15.0):
+
+		self.maxClients = maxClients
+		self.queueSize = queueSize
+		self.keepAlive = keepAlive
+
+		self.lock = threading.Lock()
+		self.clients = []
+		self.closed = False
+
+		# Stats
+		self.droppedClients = 0
+
+	def publish(self, snapshot):
+		""" Sends a snapshot to every subscriber, used as a SnapshotPublisher listener """
+
+		# Encode once for all the subscribers
+		event = encodeEvent(snapshot)
+
+		with self.lock:
+			clients = list(self.clients)
+
+		for client in clients:
+			if not client.push(event):
+				# Slow consumer, drop it
+				self.unsubscribe(client)
+				client.close()
+				self.droppedClients = self.droppedClients + 1
+
+	def subscribe(self):
+		""" Adds a subscriber, returns None if we are at the fan-out limit """
+
+		with self.lock:
+			if self.closed or len(self.clients) >= self.maxClients:
+				return None
+
+			client = StreamClient(self.queueSize)
+			self.clients.append(client)
+
+			return client
+
+	def unsubscribe(self, client):
+
+		with self.lock:
+			if client in self.clients:
+				self.clients.remove(client)
+
+	def stream(self, client, snapshot):
+		""" A generator of the encoded events for a subscriber, starting with the current snapshot (if there is one) """
+
+		try:
+			# Reconnect quickly if we drop the client
+			yield b"retry: 1000\n" + (encodeEvent(snapshot) if snapshot is not None else b"\n")
+
+			while True:
+				event = client.nextEvent(self.keepAlive)
+				if event is STREAM_CLOSED or client.dropped:
+					return
+				yield event
+		finally:
+			self.unsubscribe(client)
+
+	def close(self):
+		""" Ends all the streams, e.g. on shutdown """
+
+		with self.lock:
+			self.closed = True
+			clients = list(self.clients)
+			self.clients = []
+
+		for client in clients:
+			client.close()
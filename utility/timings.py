@@ -0,0 +1,150 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Latency histograms of the acquisition hot path
+#
+# Durations are recorded per task (usually one per sensor) and per stage (a part of
+# a task, e.g. "busy" on the bus, "wait" for a conversion, or a stage a board marks).
+# Each (task, stage) has a histogram with fixed buckets, recording is a bisect and a
+# few additions, there is no per sample allocation.
+#
+# Timings are off unless enabled, then stage() returns a shared do nothing context
+# and record() returns straight away, so the instrumented code costs next to nothing.
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+# Bucket upper bounds in seconds, anything slower goes in the last (+Inf) bucket
+TIMING_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+
+	def __init__(self, bounds=TIMING_BUCKETS):
+
+		self.bounds = bounds
+		self.counts = [0] * (len(bounds) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def record(self, seconds):
+		# Only ever recorded from one thread at a time, each task runs one job at a time
+		self.counts[bisect_left(self.bounds, seconds)] += 1
+		self.count = self.count + 1
+		self.sum = self.sum + seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def quantile(self, q):
+		""" Estimates a quantile as the upper bound of the bucket it falls in """
+
+		if self.count == 0:
+			return None
+
+		rank = q * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen = seen + count
+			if seen >= rank and count > 0:
+				return self.bounds[index] if index < len(self.bounds) else self.max
+
+		return self.max
+
+	def toDict(self):
+
+		return {
+			"count": self.count,
+			"sum": self.sum,
+			"mean": self.sum / self.count if self.count else None,
+			"max": self.max,
+			"p50": self.quantile(0.5),
+			"p99": self.quantile(0.99),
+			"buckets": self.counts,
+		}
+
+class NullStage:
+	""" The stage when timings are off """
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+NULL_STAGE = NullStage()
+
+class Stage:
+
+	def __init__(self, histogram):
+
+		self.histogram = histogram
+		self.began = 0.0
+
+	def __enter__(self):
+		self.began = perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.histogram.record(perf_counter() - self.began)
+		return False
+
+class Timings:
+
+	def __init__(self, enabled=False):
+
+		self.enabled = enabled
+
+		# (task, stage) -> Histogram
+		self.histograms = {}
+		self.lock = threading.Lock()
+
+	def enable(self):
+		self.enabled = True
+
+	def getHistogram(self, task, stage):
+
+		histogram = self.histograms.get((task, stage))
+		if histogram is None:
+			with self.lock:
+				histogram = self.histograms.setdefault((task, stage), Histogram())
+
+		return histogram
+
+	def record(self, task, stage, seconds):
+		""" Records a duration, does nothing when timings are off """
+
+		if self.enabled:
+			self.getHistogram(task, stage).record(seconds)
+
+	def stage(self, task, stage):
+		""" A context that times the code in it, e.g. with timings.stage("bme280", "read"): """
+
+		if not self.enabled:
+			return NULL_STAGE
+
+		return Stage(self.getHistogram(task, stage))
+
+	def toDict(self):
+		""" The histograms as {task: {stage: histogram}} """
+
+		with self.lock:
+			items = sorted(self.histograms.items())
+
+		tasks = {}
+		for (task, stage), histogram in items:
+			tasks.setdefault(task, {})[stage] = histogram.toDict()
+
+		return tasks
@@ -0,0 +1,352 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# Hardware traces, recorded on a PI and replayed anywhere
+#
+# The boards open their hardware (the i2c buses, the GPIO, the ST7735 display and the
+# CPU thermal zone) through openBus() and openDevice(). Normally these are the real
+# devices. When recording, every call made on a device is passed through to it and
+# written to a trace file with its arguments, result and how long it took. When
+# replaying, the devices are never opened, each call is answered from the trace.
+#
+# The calls are matched per device, and per i2c address on a bus, so sensors started
+# or read on different threads replay correctly. A call matches on its method and its
+# arguments except the data written (a list), which can differ a little in a replay
+# (e.g. the SGP40 is sent the current temperature and humidity).
+# A replayed call can take as long as it did (speed 1), or return at once (max speed,
+# for benchmarking what is around it).
+#
+# Where a sensor loops for a time (e.g. the SGP40 warm up) it can make a different number
+# of calls in a replay. A call that is not next in the trace but was made before is
+# answered as it was last time, and a call further on in the trace skips the calls in between.
+#
+# Tracing must be set up before a board module is imported, as they open the i2c bus on import.
+#
+# Every call on an i2c bus opened with openBus() (or wrapped with lockBus()) holds that bus's
+# lock, shared by all the handles on the bus. A call sets the address and makes its transfer,
+# so a call from one thread can not go to the address another thread set (smbus keeps one
+# address per handle). A sensor's write, wait, read can have other sensors' calls in between,
+# each device only answers transfers to its own address.
+
+import atexit
+import json
+import threading
+from collections import deque
+from time import monotonic, sleep, time
+
+TRACE_VERSION = 1
+
+# How far ahead a replayed call may be found in the trace
+REPLAY_WINDOW = 256
+
+# Replay as fast as possible
+MAX_SPEED = 0.0
+
+class TraceError(Exception):
+	pass
+
+def encodeValue(value):
+	""" A call's arguments or result as JSON, objects only by their type """
+
+	if value is None or isinstance(value, (bool, int, float, str)):
+		return value
+	if isinstance(value, (bytes, bytearray)):
+		return {"bytes": bytes(value).hex()}
+	if isinstance(value, (list, tuple)):
+		return [encodeValue(item) for item in value]
+
+	# e.g. the frame buffer image sent to the display
+	return {"object": type(value).__name__}
+
+def matchArgs(args):
+	""" The arguments a replayed call is matched on, without the data written """
+
+	return [None if isinstance(arg, list) else arg for arg in args]
+
+def decodeValue(value):
+
+	if isinstance(value, list):
+		return [decodeValue(item) for item in value]
+	if isinstance(value, dict):
+		if "bytes" in value:
+			return bytes.fromhex(value["bytes"])
+		return None
+
+	return value
+
+def parseSpeed(text):
+	""" Parses a replay speed, a multiple of the recorded speed or max """
+
+	return MAX_SPEED if text == "max" else float(text)
+
+class TraceWriter:
+
+	def __init__(self, path):
+
+		self.file = open(path, "w", encoding="utf-8")
+		self.began = monotonic()
+		self.lock = threading.Lock()
+		self.events = 0
+
+		self.write({"trace": TRACE_VERSION, "started": time()})
+
+	def write(self, event):
+
+		line = json.dumps(event, separators=(",", ":")) + "\n"
+
+		with self.lock:
+			if self.file is not None:
+				self.file.write(line)
+				self.events = self.events + 1
+
+	def close(self):
+
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+class TraceReader:
+
+	def __init__(self, path, speed=1.0):
+
+		self.speed = speed
+
+		# key (device, or device@address) -> the calls made on it, in order
+		self.calls = {}
+
+		# device -> attribute -> value
+		self.attributes = {}
+
+		with open(path, "r", encoding="utf-8") as file:
+			header = json.loads(file.readline())
+			if header.get("trace") != TRACE_VERSION:
+				raise TraceError("Unsupported trace " + path)
+
+			for line in file:
+				event = json.loads(line)
+				if "attribute" in event:
+					self.attributes.setdefault(event["device"], {})[event["attribute"]] = event["value"]
+				else:
+					self.calls.setdefault(event["key"], deque()).append(event)
+
+		self.lock = threading.Lock()
+
+		# key -> (method, arguments) -> the last call answered
+		self.answered = {}
+
+	def answer(self, key, method, args):
+		""" The recorded call matching this one """
+
+		call = (method, json.dumps(args))
+
+		with self.lock:
+			calls = self.calls.get(key)
+			answered = self.answered.setdefault(key, {})
+
+			if not calls:
+				raise TraceError("Trace of " + key + " ended")
+
+			# The next call
+			if calls[0]["method"] == method and matchArgs(calls[0]["args"]) == args:
+				event = calls.popleft()
+				answered[call] = event
+				return event
+
+			# Made more times than when recorded
+			if call in answered:
+				return answered[call]
+
+			# Made fewer times, skip to the next time this call was made
+			for n, event in enumerate(calls):
+				if n >= REPLAY_WINDOW:
+					break
+				if event["method"] == method and matchArgs(event["args"]) == args:
+					for skip in range(n + 1):
+						calls.popleft()
+					answered[call] = event
+					return event
+
+			raise TraceError("Trace of " + key + " has no " + method + repr(args) + ", next is " + calls[0]["method"] + repr(calls[0]["args"]))
+
+	def getAttribute(self, device, name):
+
+		attributes = self.attributes.get(device, {})
+		if name not in attributes:
+			raise AttributeError("Trace of " + device + " has no attribute " + name)
+
+		return attributes[name]
+
+class RecordingDevice:
+	""" Passes every call through to the device and writes it to the trace """
+
+	def __init__(self, writer, name, device, addressed):
+
+		self._writer = writer
+		self._name = name
+		self._device = device
+		self._addressed = addressed
+
+	def __getattr__(self, attribute):
+
+		value = getattr(self._device, attribute)
+		if not callable(value):
+			self._writer.write({"device": self._name, "attribute": attribute, "value": encodeValue(value)})
+			return value
+
+		writer = self._writer
+		key = self._name
+		addressed = self._addressed
+
+		def recorded(*args):
+
+			began = monotonic()
+			event = {
+				"key": key + "@" + hex(args[0]) if addressed and args else key,
+				"method": attribute,
+				"args": encodeValue(args),
+				"time": began - writer.began,
+			}
+
+			try:
+				result = value(*args)
+				event["result"] = encodeValue(result)
+				return result
+			except OSError as e:
+				event["error"] = str(e)
+				raise
+			finally:
+				event["seconds"] = monotonic() - began
+				writer.write(event)
+
+		return recorded
+
+class ReplayDevice:
+	""" Answers every call from the trace """
+
+	def __init__(self, reader, name, addressed):
+
+		self._reader = reader
+		self._name = name
+		self._addressed = addressed
+
+	def __getattr__(self, attribute):
+
+		if attribute.startswith("__"):
+			raise AttributeError(attribute)
+
+		try:
+			return self._reader.getAttribute(self._name, attribute)
+		except AttributeError:
+			pass
+
+		reader = self._reader
+		key = self._name
+		addressed = self._addressed
+
+		def replayed(*args):
+
+			event = reader.answer(key + "@" + hex(args[0]) if addressed and args else key, attribute, matchArgs(encodeValue(args)))
+
+			if reader.speed != MAX_SPEED:
+				sleep(event["seconds"] / reader.speed)
+
+			if "error" in event:
+				raise OSError(event["error"])
+
+			return decodeValue(event.get("result"))
+
+		return replayed
+
+# The trace being recorded or replayed, None when using the hardware
+writer = None
+reader = None
+
+def record(path):
+	""" Records every device the boards open to a trace file """
+
+	global writer
+	writer = TraceWriter(path)
+
+	# Closed last, so calls made as we exit (e.g. turning the MICS6814 heater off) are recorded
+	atexit.register(writer.close)
+
+def replay(path, speed=1.0):
+	""" Replays the devices from a trace file, without any hardware """
+
+	global reader
+	reader = TraceReader(path, speed)
+
+def enabled():
+	return writer is not None or reader is not None
+
+def openDevice(name, create, addressed=False):
+	""" A device, create() is only called if the hardware is used. Addressed devices take the address as the first argument of every call """
+
+	if reader is not None:
+		return ReplayDevice(reader, name, addressed)
+
+	device = create()
+
+	if writer is not None:
+		return RecordingDevice(writer, name, device, addressed)
+
+	return device
+
+class LockedBus:
+	""" An i2c bus whose calls are each made holding the bus lock """
+
+	def __init__(self, bus, lock):
+
+		self._bus = bus
+		self._lock = lock
+
+	def __getattr__(self, attribute):
+
+		value = getattr(self._bus, attribute)
+		if not callable(value):
+			return value
+
+		lock = self._lock
+
+		def locked(*args, **kwargs):
+			with lock:
+				return value(*args, **kwargs)
+
+		# Found here from now on
+		setattr(self, attribute, locked)
+
+		return locked
+
+# bus number -> the lock shared by every handle on that bus
+busLocks = {}
+busLocksLock = threading.Lock()
+
+def lockBus(number, bus):
+	""" Wraps a bus so each call holds the lock of bus number, for buses opened by a library """
+
+	with busLocksLock:
+		lock = busLocks.setdefault(number, threading.RLock())
+
+	return LockedBus(bus, lock)
+
+def openBus(number):
+	""" An i2c bus """
+
+	def openSMBus():
+		from smbus import SMBus
+		return SMBus(number)
+
+	return lockBus(number, openDevice("i2c-" + str(number), openSMBus, addressed=True))
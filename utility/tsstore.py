@@ -0,0 +1,446 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# A persistent append only time-series store of the published values
+#
+# Values are kept in segment files, each a fixed number of rows laid out in columns
+# (the timestamps, then one column per channel, all float64) and memory mapped.
+# Segment files are created sparse so only the pages written use space on the card.
+#
+# Only the segment being written stays mapped. The others are mapped while a query reads
+# them, and the last few read are kept mapped (MAPPED_SEGMENTS), so a year of day long
+# segments does not need gigabytes of address space (a 32 bit PI has about 3GB in all).
+#
+# Published values are held in memory and written in a group commit every few
+# seconds, one flush per commit rather than a write per value, to spare the SD card.
+# If a commit fails (e.g. the card is full) the rows not written wait for the next one.
+# A segment's header holds how many rows are committed, it is only advanced after the
+# rows themselves are flushed, so after a crash anything past it is ignored.
+#
+# Segments older than the retention are deleted.
+# Queries binary search the mapped timestamp column and copy the rows out of the mapped pages.
+
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from time import time
+
+import numpy
+
+SEGMENT_MAGIC = b"SMTS"
+SEGMENT_VERSION = 1
+
+# magic, version, channels, capacity, committed rows, then the channel names as json
+HEADER_FORMAT = "<4sIIIQ"
+HEADER_SIZE = 4096
+COMMITTED_OFFSET = 16
+
+# Rows per segment, a day at one sample per second
+SEGMENT_ROWS = 86400
+
+# Segments other than the one being written kept mapped after a query reads them
+MAPPED_SEGMENTS = 2
+
+class Segment:
+
+	def __init__(self, path, channels=None, capacity=SEGMENT_ROWS):
+
+		self.path = path
+
+		if channels is not None:
+			# New segment, sized up front (sparse)
+			names = json.dumps(channels).encode("utf-8")
+			if struct.calcsize(HEADER_FORMAT) + len(names) > HEADER_SIZE:
+				raise ValueError("Too many channels for a segment header")
+
+			# A segment that could not be made whole (e.g. the card is full) is not left behind
+			try:
+				with open(path, "wb") as f:
+					f.write(struct.pack(HEADER_FORMAT, SEGMENT_MAGIC, SEGMENT_VERSION, len(channels), capacity, 0) + names)
+					f.truncate(HEADER_SIZE + 8 * capacity * (len(channels) + 1))
+			except OSError:
+				if os.path.exists(path):
+					os.remove(path)
+				raise
+
+		with open(path, "rb") as f:
+			header = f.read(HEADER_SIZE)
+
+		if len(header) < struct.calcsize(HEADER_FORMAT):
+			raise ValueError(path + " is not a segment")
+
+		magic, version, channelCount, capacity, committed = struct.unpack_from(HEADER_FORMAT, header, 0)
+		if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+			raise ValueError(path + " is not a segment")
+
+		self.capacity = capacity
+		self.channelCount = channelCount
+		names = header[struct.calcsize(HEADER_FORMAT):].rstrip(b"\0")
+		self.channels = json.loads(names.decode("utf-8"))
+		self.channelIndex = {name: index for index, name in enumerate(self.channels)}
+
+		# Mapped while in use, see openMap()
+		self.file = None
+		self.map = None
+		self.times = None
+		self.data = None
+
+		# Checking the committed rows reads them, the first and last times are kept so the segment
+		# can be picked for a query without mapping it
+		self.openMap()
+		self.committed = self.recover(committed)
+		self.firstTime = self.times[0] if self.committed > 0 else None
+		self.lastTime = self.times[self.committed - 1] if self.committed > 0 else None
+
+	def openMap(self):
+		""" Maps the segment, if it is not already """
+
+		if self.map is not None:
+			return
+
+		self.file = open(self.path, "r+b")
+		try:
+			self.map = mmap.mmap(self.file.fileno(), 0)
+
+			# Views straight onto the mapped pages
+			self.times = numpy.ndarray((self.capacity,), dtype=numpy.float64, buffer=self.map, offset=HEADER_SIZE)
+			self.data = numpy.ndarray((self.channelCount, self.capacity), dtype=numpy.float64, buffer=self.map, offset=HEADER_SIZE + 8 * self.capacity)
+		except (ValueError, TypeError, OSError) as e:
+			self.closeMap()
+			raise ValueError(self.path + " is not a whole segment - " + repr(e))
+
+	def closeMap(self):
+		""" Unmaps the segment, values read from it before are copies so stay valid """
+
+		self.times = None
+		self.data = None
+
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	def recover(self, committed):
+		""" Checks the committed rows, trimming back any tail that is not in time order """
+
+		committed = min(committed, self.capacity)
+
+		# A valid tail is non zero and increasing, step back until it is
+		while committed > 0:
+			last = self.times[committed - 1]
+			if last > 0 and (committed == 1 or self.times[committed - 2] <= last):
+				break
+			committed = committed - 1
+
+		return committed
+
+	def free(self):
+		return self.capacity - self.committed
+
+	def start(self):
+		return self.firstTime
+
+	def end(self):
+		return self.lastTime
+
+	def write(self, times, rows):
+		""" Writes rows after the committed ones, flushes them, then commits them """
+
+		count = len(times)
+		first = self.committed
+
+		self.times[first:first + count] = times
+		for index, name in enumerate(self.channels):
+			self.data[index, first:first + count] = rows[name]
+
+		# Data first, then the header, so the header never counts rows that are not on disk
+		self.map.flush()
+		struct.pack_into("<Q", self.map, COMMITTED_OFFSET, first + count)
+		self.map.flush(0, mmap.PAGESIZE)
+
+		self.committed = first + count
+		if self.firstTime is None:
+			self.firstTime = self.times[0]
+		self.lastTime = self.times[self.committed - 1]
+
+	def query(self, channels, start, end, step):
+		""" As HistoryRing.query over the committed rows of this segment, values are copied out """
+
+		committed = self.committed
+		times = self.times[:committed]
+
+		first = int(numpy.searchsorted(times, start, "left"))
+		last = int(numpy.searchsorted(times, end, "left"))
+
+		stride = 1
+		if step > 0 and last - first > 1:
+			spacing = (times[last - 1] - times[first]) / (last - first - 1)
+			if spacing > 0:
+				stride = max(1, int(round(step / spacing)))
+
+		columns = {}
+		for name in channels:
+			if name in self.channelIndex:
+				columns[name] = numpy.array(self.data[self.channelIndex[name], first:last:stride])
+			else:
+				columns[name] = numpy.full(len(range(first, last, stride)), numpy.nan)
+
+		return numpy.array(times[first:last:stride]), columns
+
+	def close(self):
+		self.closeMap()
+
+class TimeSeriesStore:
+
+	def __init__(self, path, commitInterval=60.0, retention=365 * 86400.0, segmentRows=SEGMENT_ROWS):
+
+		self.path = path
+		self.commitInterval = commitInterval
+		self.retention = retention
+		self.segmentRows = segmentRows
+
+		os.makedirs(path, exist_ok=True)
+
+		# Open the existing segments, oldest first
+		self.segments = []
+		for name in sorted(os.listdir(path)):
+			if name.endswith(".seg"):
+				try:
+					segment = Segment(os.path.join(path, name))
+				except (ValueError, OSError) as e:
+					print("Skipping segment " + name + " - " + repr(e))
+					continue
+
+				# Each is mapped only while it is checked, bar the last which is written to
+				if self.segments:
+					self.segments[-1].closeMap()
+				self.segments.append(segment)
+
+		# Segments other than the last mapped for queries, least recently read first
+		self.mapped = OrderedDict()
+
+		# Created from the first snapshot, when we know the channels
+		self.channels = None
+
+		# Values waiting for the next commit
+		self.pendingTimes = []
+		self.pendingRows = []
+		self.pendingLock = threading.Lock()
+
+		# Guards the segment list against readers while committing or deleting
+		self.lock = threading.Lock()
+
+		self.running = False
+		self.wake = threading.Event()
+		self.thread = None
+
+		# Stats
+		self.commits = 0
+		self.rowsCommitted = 0
+
+	def append(self, snapshot):
+		""" Queues a snapshot for the next commit, used as a SnapshotPublisher listener """
+
+		if self.channels is None:
+			self.channels = [name for name, value in snapshot.values.items() if isinstance(value, (int, float))]
+
+		values = snapshot.values
+		with self.pendingLock:
+			self.pendingTimes.append(snapshot.timestamp)
+			self.pendingRows.append([values.get(name, numpy.nan) for name in self.channels])
+
+	def commit(self):
+		""" Writes the pending values to the segments in one group """
+
+		with self.pendingLock:
+			times = self.pendingTimes
+			rows = self.pendingRows
+			self.pendingTimes = []
+			self.pendingRows = []
+
+		if not times:
+			return
+
+		times = numpy.array(times, dtype=numpy.float64)
+		rows = numpy.array(rows, dtype=numpy.float64).reshape(len(times), len(self.channels))
+
+		with self.lock:
+			written = 0
+			try:
+				while written < len(times):
+
+					segment = self.segments[-1] if self.segments else None
+
+					# A new segment when full, or when the channels change, the last is only mapped for queries from now on
+					if segment is None or segment.free() == 0 or segment.channels != self.channels:
+						name = "%013.3f.seg" % times[written]
+						segment = Segment(os.path.join(self.path, name), self.channels, self.segmentRows)
+						if self.segments and self.segments[-1] not in self.mapped:
+							self.segments[-1].closeMap()
+						self.segments.append(segment)
+
+					count = min(segment.free(), len(times) - written)
+					columns = {name: rows[written:written + count, index] for index, name in enumerate(self.channels)}
+					segment.write(times[written:written + count], columns)
+					written = written + count
+			except Exception:
+				# Not lost, the rows not written go back ahead of any published since
+				with self.pendingLock:
+					self.pendingTimes = times[written:].tolist() + self.pendingTimes
+					self.pendingRows = rows[written:].tolist() + self.pendingRows
+				raise
+
+			self.expire()
+
+		self.commits = self.commits + 1
+		self.rowsCommitted = self.rowsCommitted + len(times)
+
+	def expire(self):
+		""" Deletes the segments that are entirely older than the retention """
+
+		cutoff = time() - self.retention
+
+		# Always keep the segment being written
+		while len(self.segments) > 1 and (self.segments[0].end() or 0) < cutoff:
+			segment = self.segments.pop(0)
+			self.mapped.pop(segment, None)
+			segment.close()
+			os.remove(segment.path)
+
+	def useSegment(self, segment):
+		""" Maps a segment for reading, with the lock held, unmapping the least recently read beyond MAPPED_SEGMENTS """
+
+		# The last is always mapped, it is being written to
+		if segment is self.segments[-1]:
+			segment.openMap()
+			return
+
+		segment.openMap()
+		self.mapped[segment] = True
+		self.mapped.move_to_end(segment)
+
+		while len(self.mapped) > MAPPED_SEGMENTS:
+			oldest, _ = self.mapped.popitem(last=False)
+			if oldest is not self.segments[-1]:
+				oldest.closeMap()
+
+	def query(self, channels, start, end, step=0.0):
+		""" Returns (times, {channel: values}) for committed samples with start <= time < end """
+
+		times = []
+		columns = {name: [] for name in channels}
+
+		with self.lock:
+			for segment in self.segments:
+				first = segment.start()
+				if first is None or first >= end or segment.end() < start:
+					continue
+
+				self.useSegment(segment)
+				segmentTimes, segmentColumns = segment.query(channels, start, end, step)
+				times.append(segmentTimes)
+				for name in channels:
+					columns[name].append(segmentColumns[name])
+
+		if not times:
+			return numpy.zeros(0), {name: numpy.zeros(0) for name in channels}
+
+		return numpy.concatenate(times), {name: numpy.concatenate(parts) for name, parts in columns.items()}
+
+	def blocks(self, start):
+		""" The committed samples from start on, a segment at a time oldest first, as (channels, times, data) """
+
+		with self.lock:
+			segments = list(self.segments)
+
+		for segment in segments:
+			with self.lock:
+				if segment not in self.segments:
+					continue
+				end = segment.end()
+				if end is None or end < start:
+					continue
+
+				self.useSegment(segment)
+				first = int(numpy.searchsorted(segment.times[:segment.committed], start, "left"))
+				times = numpy.array(segment.times[first:segment.committed])
+				data = numpy.array(segment.data[:, first:segment.committed])
+
+			yield segment.channels, times, data
+
+	def tail(self, count):
+		""" The last count committed samples of every channel, oldest first, as (channels, times, data) """
+
+		with self.lock:
+			if not self.segments:
+				return [], numpy.zeros(0), numpy.zeros((0, 0))
+
+			channels = self.segments[-1].channels
+
+			times = []
+			rows = []
+			remaining = count
+			for segment in reversed(self.segments):
+				if remaining <= 0 or segment.channels != channels:
+					break
+				take = min(remaining, segment.committed)
+				self.useSegment(segment)
+				times.insert(0, numpy.array(segment.times[segment.committed - take:segment.committed]))
+				rows.insert(0, numpy.array(segment.data[:, segment.committed - take:segment.committed]))
+				remaining = remaining - take
+
+		if not times:
+			return channels, numpy.zeros(0), numpy.zeros((len(channels), 0))
+
+		return channels, numpy.concatenate(times), numpy.concatenate(rows, axis=1)
+
+	def committer(self):
+
+		while self.running:
+			self.wake.wait(self.commitInterval)
+			self.wake.clear()
+			try:
+				self.commit()
+			except Exception as e:
+				print("Store commit failed - " + repr(e))
+
+	def start(self):
+		""" Starts the group commit thread """
+
+		self.running = True
+		self.thread = threading.Thread(None, self.committer, name="store-commit", daemon=True)
+		self.thread.start()
+
+	def close(self):
+		""" Commits anything pending and closes the segments """
+
+		if self.running:
+			self.running = False
+			self.wake.set()
+			self.thread.join()
+
+		self.commit()
+
+		with self.lock:
+			for segment in self.segments:
+				segment.close()
+			self.segments = []
+			self.mapped.clear()
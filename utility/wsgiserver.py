@@ -0,0 +1,351 @@
+#
+# Seamus McShane 2022
+#
+# This file is part of SensorMonitor.
+#
+# SensorMonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License Version 3
+# as published by the Free Software Foundation.
+#
+# SensorMonitor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License Version 3 for more details.
+#
+
+# A small pure Python WSGI server for production use
+#
+# HTTP/1.1 with keep-alive, served by a fixed pool of worker threads.
+# Accepted connections wait in a bounded queue for a worker, when the queue is full
+# new connections get an immediate 503 rather than piling up.
+# Idle keep-alive connections are closed after a timeout, and straight away after
+# their current request if other connections are waiting, so slow clients can not
+# hold every worker.
+# Shutdown stops accepting, lets the in flight requests finish, then stops the workers.
+
+import select
+import socket
+import sys
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+from io import BytesIO
+from queue import Queue, Full
+from urllib.parse import unquote
+
+SERVER_VERSION = "SensorMon"
+
+# How often an idle keep-alive connection checks if it should give up its worker
+IDLE_POLL = 0.1
+
+# Sent when the connection queue is full
+BUSY_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+
+class WSGIRequestHandler(BaseHTTPRequestHandler):
+
+	protocol_version = "HTTP/1.1"
+	server_version = SERVER_VERSION
+	sys_version = ""
+
+	def setup(self):
+
+		# Idle keep-alive timeout (used by StreamRequestHandler for the socket timeout)
+		self.timeout = self.server.keepAliveTimeout
+
+		super().setup()
+
+	def handle(self):
+		""" Serves requests until the connection closes or goes idle """
+
+		self.close_connection = True
+		self.handle_one_request()
+
+		while not self.close_connection:
+			if not self.waitForRequest():
+				break
+			self.handle_one_request()
+
+	def waitForRequest(self):
+		""" Waits for the next request on a kept alive connection.
+		Gives up early if we are shutting down or other connections are waiting for a worker.
+		"""
+
+		waited = 0.0
+		while waited < self.server.keepAliveTimeout:
+			readable, writable, errored = select.select([self.connection], [], [], IDLE_POLL)
+			if readable:
+				return True
+
+			if self.server.shuttingDown or self.server.connections.qsize() > 0:
+				return False
+
+			waited = waited + IDLE_POLL
+
+		return False
+
+	def handle_one_request(self):
+		""" Reads and serves one request, as BaseHTTPRequestHandler but calling the WSGI app """
+
+		try:
+			self.raw_requestline = self.rfile.readline(65537)
+			if len(self.raw_requestline) > 65536:
+				self.requestline = ""
+				self.request_version = ""
+				self.command = ""
+				self.send_error(414)
+				return
+
+			if not self.raw_requestline:
+				self.close_connection = True
+				return
+
+			if not self.parse_request():
+				# An error code has been sent, just exit
+				return
+
+			self.runApp()
+			self.wfile.flush()
+
+		except (socket.timeout, ConnectionError):
+			# Idle keep-alive timeout or the client went away
+			self.close_connection = True
+
+	def getEnviron(self):
+		""" Builds the WSGI environ for the current request """
+
+		path, _, query = self.path.partition("?")
+
+		length = self.headers.get("Content-Length")
+		body = self.rfile.read(int(length)) if length else b""
+
+		environ = {
+			"REQUEST_METHOD": self.command,
+			"SCRIPT_NAME": "",
+			"PATH_INFO": unquote(path, "iso-8859-1"),
+			"QUERY_STRING": query,
+			"CONTENT_TYPE": self.headers.get("Content-Type", ""),
+			"CONTENT_LENGTH": length or "",
+			"SERVER_NAME": self.server.host,
+			"SERVER_PORT": str(self.server.port),
+			"SERVER_PROTOCOL": self.request_version,
+			"REMOTE_ADDR": self.client_address[0],
+			"REMOTE_PORT": str(self.client_address[1]),
+			"wsgi.version": (1, 0),
+			"wsgi.url_scheme": "http",
+			"wsgi.input": BytesIO(body),
+			"wsgi.errors": sys.stderr,
+			"wsgi.multithread": True,
+			"wsgi.multiprocess": False,
+			"wsgi.run_once": False,
+		}
+
+		for name, value in self.headers.items():
+			key = "HTTP_" + name.upper().replace("-", "_")
+			if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+				continue
+			if key in environ:
+				environ[key] = environ[key] + "," + value
+			else:
+				environ[key] = value
+
+		return environ
+
+	def runApp(self):
+		""" Calls the WSGI app and writes its response """
+
+		environ = self.getEnviron()
+
+		self.responseStatus = None
+		self.responseHeaders = None
+		self.headersSent = False
+		self.chunked = False
+
+		# Finish the current request then close if we are shutting down or others are waiting
+		if self.server.shuttingDown or self.server.connections.qsize() > 0:
+			self.close_connection = True
+
+		def start_response(status, headers, exc_info=None):
+			if exc_info:
+				try:
+					if self.headersSent:
+						raise exc_info[1].with_traceback(exc_info[2])
+				finally:
+					exc_info = None
+
+			self.responseStatus = status
+			self.responseHeaders = headers
+			return self.writeBody
+
+		result = self.server.app(environ, start_response)
+
+		try:
+			# A single block body, we know the length so avoid chunking
+			if isinstance(result, (list, tuple)) and len(result) == 1:
+				self.writeBody(result[0], len(result[0]))
+			else:
+				for data in result:
+					if data:
+						self.writeBody(data)
+
+			if not self.headersSent:
+				self.writeBody(b"", 0)
+
+			if self.chunked:
+				self.wfile.write(b"0\r\n\r\n")
+		finally:
+			if hasattr(result, "close"):
+				result.close()
+
+	def buildHeaders(self, length):
+		""" Builds the status line and headers, adding the ones we manage """
+
+		self.headersSent = True
+
+		status = self.responseStatus
+		code = int(status[:3])
+
+		lines = ["HTTP/1.1 " + status]
+		names = set()
+		for name, value in self.responseHeaders:
+			names.add(name.lower())
+			lines.append(name + ": " + value)
+
+		if "content-length" not in names:
+			if code in (204, 304) or (code < 200) or self.command == "HEAD":
+				pass
+			elif length is not None:
+				lines.append("Content-Length: " + str(length))
+			elif self.request_version == "HTTP/1.1":
+				self.chunked = True
+				lines.append("Transfer-Encoding: chunked")
+			else:
+				# No length and no chunking, the end of the body is the end of the connection
+				self.close_connection = True
+
+		if "date" not in names:
+			lines.append("Date: " + formatdate(usegmt=True))
+		if "server" not in names:
+			lines.append("Server: " + SERVER_VERSION)
+
+		if self.close_connection:
+			lines.append("Connection: close")
+		elif self.request_version == "HTTP/1.0":
+			lines.append("Connection: keep-alive")
+
+		return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
+
+	def writeBody(self, data, length=None):
+		""" The WSGI write callable, sends the headers with the first block of data """
+
+		if self.responseStatus is None:
+			raise AssertionError("write() before start_response()")
+
+		out = b""
+		if not self.headersSent:
+			out = self.buildHeaders(length)
+
+		if self.command != "HEAD" and data:
+			if self.chunked:
+				out = out + (b"%x\r\n" % len(data)) + data + b"\r\n"
+			else:
+				out = out + data
+
+		if out:
+			self.wfile.write(out)
+
+	def log_message(self, format, *args):
+
+		# Access logging is off unless asked for, it costs more than serving /values
+		if self.server.accessLog:
+			super().log_message(format, *args)
+
+class WSGIServer:
+
+	def __init__(self, app, host="0.0.0.0", port=8080, workers=4, queueSize=32, keepAliveTimeout=5.0, accessLog=False):
+
+		self.app = app
+		self.host = host
+		self.port = int(port)
+		self.workers = workers
+		self.keepAliveTimeout = keepAliveTimeout
+		self.accessLog = accessLog
+
+		# Accepted connections waiting for a worker
+		self.connections = Queue(maxsize=queueSize)
+
+		self.shuttingDown = False
+		self.listener = None
+		self.workerThreads = []
+
+	def worker(self):
+
+		while True:
+			connection = self.connections.get()
+
+			# Told to stop
+			if connection is None:
+				return
+
+			sock, address = connection
+			try:
+				WSGIRequestHandler(sock, address, self)
+			except Exception as e:
+				print("Request from " + address[0] + " failed - " + repr(e))
+			finally:
+				try:
+					sock.shutdown(socket.SHUT_WR)
+				except OSError:
+					pass
+				sock.close()
+
+	def serveForever(self):
+		""" Serves until shutdown() is called, then waits for the workers to finish """
+
+		self.listener = socket.create_server((self.host, self.port), backlog=self.connections.maxsize)
+
+		# So we notice shutdown while waiting for connections
+		self.listener.settimeout(0.5)
+
+		for n in range(self.workers):
+			thread = threading.Thread(None, self.worker, name="http-worker-" + str(n), daemon=True)
+			thread.start()
+			self.workerThreads.append(thread)
+
+		print("Serving on " + self.host + ":" + str(self.port) + " with " + str(self.workers) + " workers")
+
+		try:
+			while not self.shuttingDown:
+				try:
+					sock, address = self.listener.accept()
+				except socket.timeout:
+					continue
+				except OSError:
+					# The listener is closed on shutdown
+					if self.shuttingDown:
+						break
+					raise
+
+				sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+				try:
+					self.connections.put_nowait((sock, address))
+				except Full:
+					# Every worker is busy and the queue is full, tell the client to come back later
+					try:
+						sock.sendall(BUSY_RESPONSE)
+					except OSError:
+						pass
+					sock.close()
+		finally:
+			self.listener.close()
+
+			# Let the workers finish what they have, then stop them
+			for thread in self.workerThreads:
+				self.connections.put(None)
+			for thread in self.workerThreads:
+				thread.join(self.keepAliveTimeout + 1)
+
+	def shutdown(self):
+		""" Stops accepting connections, in flight requests are allowed to finish """
+
+		self.shuttingDown = True